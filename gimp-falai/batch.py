@@ -0,0 +1,144 @@
+"""
+Batch processing: one prompt across many layers or image files.
+
+Jobs go through fal's queue API (submit plus status polling in
+falai_wrapper.process_image) on a bounded pool of worker threads, with a
+minimum interval between submissions. Inputs can be added while earlier jobs
+are still running, so exporting and uploading overlap with generation, and
+results are released strictly in input order.
+"""
+
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import falai_wrapper
+import keypool
+import result_cache
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.tif', '.tiff', '.bmp')
+
+
+class RateLimiter:
+    """Space calls at least 1/rate seconds apart across threads (rate <= 0 disables)."""
+
+    def __init__(self, rate):
+        self._interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self._interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class BatchScheduler:
+    """Run process_image for many inputs with bounded concurrency.
+
+    on_result(index, paths_or_exception) is called in input order, from worker
+    threads, as soon as a job and all jobs before it have finished.
+    """
+
+    def __init__(self, settings, prompt, on_result=None, on_status=None, cancel=None):
+        self._settings = settings
+        self._prompt = prompt
+        self._on_result = on_result
+        self._on_status = on_status
+        self._cancel = cancel
+        self._limiter = RateLimiter(settings.get('batch_submit_rate', 2.0))
+        workers = int(settings.get('batch_concurrency', 4))
+        # With several API keys, enough workers to keep every key's slots busy
+        keys = keypool.get_pool(settings)
+        if keys is not None and keys.total_concurrency():
+            workers = max(workers, keys.total_concurrency())
+        self._pool = ThreadPoolExecutor(
+            max_workers=max(1, workers),
+            thread_name_prefix='falai-batch',
+        )
+        self._lock = threading.Lock()
+        # Serializes result delivery so callbacks from different workers stay in order
+        self._release_lock = threading.Lock()
+        self._results = {}
+        self._next_index = 0
+        self._submitted = 0
+        self._closed = threading.Event()
+        self._done = threading.Condition(self._lock)
+
+    def submit(self, **inputs):
+        """Queue one job; inputs are passed to process_image (input_data, image_url, ...)."""
+        with self._lock:
+            index = self._submitted
+            self._submitted += 1
+        self._pool.submit(self._run, index, inputs)
+        return index
+
+    def close(self):
+        """Signal that no more inputs will be submitted."""
+        self._closed.set()
+        with self._lock:
+            self._done.notify_all()
+
+    def wait(self):
+        """Block until close() was called and every job has finished; return results in order."""
+        self._closed.wait()
+        with self._lock:
+            while self._next_index < self._submitted:
+                self._done.wait()
+        self._pool.shutdown()
+        return [self._results[i] for i in range(self._submitted)]
+
+    def _run(self, index, inputs):
+        try:
+            if self._cancel is not None and self._cancel.is_set():
+                raise falai_wrapper.CancelledError("Batch cancelled")
+            self._limiter.wait()
+            result = falai_wrapper.process_image(
+                self._settings, self._prompt, cancel=self._cancel, **inputs)
+        except Exception as e:
+            result = e
+        with self._release_lock:
+            with self._lock:
+                self._results[index] = result
+                # Release every finished result that is next in input order
+                ready = []
+                while self._next_index in self._results:
+                    ready.append((self._next_index, self._results[self._next_index]))
+                    self._next_index += 1
+                done, total = self._next_index, self._submitted
+            for i, res in ready:
+                if self._on_result:
+                    self._on_result(i, res)
+            if ready and self._on_status:
+                self._on_status(f"{done}/{total} done", done / total)
+        with self._lock:
+            self._done.notify_all()
+
+
+def image_files(directory):
+    """Return the image files in directory, sorted by name."""
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def write_outputs(paths, out_dir, stem):
+    """Move result files to out_dir as <stem>_falai_<n>.<ext> and return the new paths.
+    Results served from the result cache are copied instead.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for i, path in enumerate(paths):
+        dest = os.path.join(out_dir, f"{stem}_falai_{i + 1}{os.path.splitext(path)[1]}")
+        if result_cache.is_cached(path):
+            shutil.copyfile(path, dest)
+        else:
+            shutil.move(path, dest)
+        written.append(dest)
+    return written
@@ -0,0 +1,81 @@
+"""
+Alpha-coverage scanning used to decide between text-to-image and image-to-image.
+
+Works on the raw 8-bit pixel bytes returned by utils.read_pixels. NumPy is used
+when available; otherwise strided bytes slicing keeps the per-pixel work in C.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Rows (or columns) scanned per band; content_bbox() works inwards from each edge
+# and stops at the first band with any coverage
+TILE_ROWS = 256
+
+
+def _has_alpha(bpp):
+    # GRAYA (2) and RGBA (4) carry alpha as the last byte of each pixel
+    return bpp in (2, 4)
+
+
+def _band_hits(alpha, starts, axis):
+    """Covered row (axis 0) or column (axis 1) indices of the first band, taken in
+    the order of starts, that has any coverage; None if none has."""
+    for start in starts:
+        band = alpha[start:start + TILE_ROWS] if axis == 0 else alpha[:, start:start + TILE_ROWS]
+        hits = np.flatnonzero(band.any(axis=1 - axis))
+        if hits.size:
+            return start + hits
+    return None
+
+
+def _backwards(length):
+    """Band starts from the far edge inwards."""
+    return range((length - 1) // TILE_ROWS * TILE_ROWS, -1, -TILE_ROWS)
+
+
+def content_bbox(data, width, height, bpp):
+    """Return the bounding box (x, y, width, height) of non-transparent pixels.
+
+    Returns None for fully transparent (or empty) buffers and the full extent for
+    buffers without an alpha channel.
+    """
+    if width == 0 or height == 0:
+        return None
+    if not _has_alpha(bpp):
+        return (0, 0, width, height)
+    stride = width * bpp
+    if np is not None:
+        alpha = np.frombuffer(data, np.uint8, count=stride * height)
+        alpha = alpha.reshape(height, width, bpp)[:, :, bpp - 1]
+        # Pixels between the first covered band from each edge are never read
+        rows = _band_hits(alpha, range(0, height, TILE_ROWS), 0)
+        if rows is None:
+            return None
+        top = int(rows[0])
+        bottom = int(_band_hits(alpha, _backwards(height), 0)[-1])
+        alpha = alpha[top:bottom + 1]
+        left = int(_band_hits(alpha, range(0, width, TILE_ROWS), 1)[0])
+        right = int(_band_hits(alpha, _backwards(width), 1)[-1])
+        return (left, top, right - left + 1, bottom - top + 1)
+
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    top = bottom = None
+    left, right = width, -1
+    for y in range(height):
+        start = y * stride
+        row = data[start + bpp - 1:start + stride:bpp]
+        stripped = row.lstrip(b'\x00')
+        if not stripped:
+            continue
+        if top is None:
+            top = y
+        bottom = y
+        left = min(left, width - len(stripped))
+        right = max(right, len(row.rstrip(b'\x00')) - 1)
+    if top is None:
+        return None
+    return (left, top, right - left + 1, bottom - top + 1)
@@ -0,0 +1,291 @@
+"""
+Concurrent, streaming download of generated images.
+
+All downloads go through the shared keep-alive pool of http_session, write to
+disk in fixed-size chunks and resume with Range requests after partial failures.
+Inline (data: URI) results are decoded to disk while the response streams in.
+"""
+
+import base64
+import json
+import mimetypes
+import os
+import random
+import re
+import ssl
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import http_session
+import tracing
+
+CHUNK_SIZE = 256 * 1024
+
+# Status codes worth retrying; other HTTP errors fail the image immediately
+RETRY_STATUS = (408, 425, 429, 500, 502, 503, 504)
+
+# Data URIs in a streamed JSON response are replaced by a file URL with this prefix
+LOCAL_PREFIX = 'file://'
+
+# Header of the data URIs that are decoded to files: a MIME type, optional
+# parameters and ';base64'. Anything else starting with "data:" stays a string.
+DATA_HEADER = re.compile(rb'[\w.+-]+/[\w.+-]+(?:;[\w.+-]+=[\w.+-]+)*;base64')
+MAX_HEADER = 256
+# The only characters a JSON encoder may escape inside base64 text
+BASE64_ESCAPES = {b'\\/': b'/'}
+
+
+class UnsupportedEscape(ValueError):
+    """A data URI holds a JSON escape the streaming decoder does not handle."""
+
+
+class DataURIExtractor:
+    """Incrementally parse a JSON response, decoding data: URI strings straight to files.
+
+    feed() the response bytes as they arrive and call result() at the end: it
+    returns the parsed JSON with every data URI replaced by LOCAL_PREFIX + path
+    of a temporary file holding the decoded bytes. Only the small remainder of
+    the JSON and one chunk of base64 are held in memory at a time.
+    """
+
+    MARK = b'"data:'
+
+    def __init__(self):
+        self.paths = []
+        self._skeleton = bytearray()
+        self._buf = b''
+        self._state = 'json'
+        self._header = bytearray()
+        self._file = None
+        self._left = b''
+        self._escape = b''
+
+    def feed(self, chunk):
+        buf = self._buf + chunk
+        self._buf = b''
+        while buf:
+            if self._state == 'json':
+                i = buf.find(self.MARK)
+                if i < 0:
+                    # Hold back a tail that may be the start of a split marker
+                    keep = len(self.MARK) - 1
+                    self._skeleton += buf[:-keep]
+                    self._buf = buf[-keep:]
+                    return
+                self._skeleton += buf[:i + 1]
+                buf = buf[i + len(self.MARK):]
+                self._state = 'header'
+                self._header = bytearray()
+            elif self._state == 'header':
+                j = buf.find(b',')
+                q = buf.find(b'"')
+                if 0 <= q < j or (j < 0 and q >= 0) or len(self._header) + max(j, 0) > MAX_HEADER:
+                    # A string that merely starts with "data:"; keep it as it is
+                    self._skeleton += b'data:' + self._header
+                    self._state = 'json'
+                    continue
+                if j < 0:
+                    self._header += buf
+                    return
+                self._header += buf[:j]
+                buf = buf[j + 1:]
+                if not DATA_HEADER.fullmatch(bytes(self._header)):
+                    # Not a base64 data URI (e.g. a prompt reading "data: a, b")
+                    self._skeleton += b'data:' + self._header + b','
+                    self._state = 'json'
+                    continue
+                self._open()
+            else:
+                k = buf.find(b'"')
+                self._write(buf if k < 0 else buf[:k])
+                if k < 0:
+                    return
+                self._close()
+                buf = buf[k:]  # The closing quote goes back to the JSON
+
+    def result(self):
+        """Return the parsed JSON once all bytes have been fed."""
+        if self._state != 'json':
+            raise ValueError("Truncated response: data URI not terminated")
+        self._skeleton += self._buf
+        self._buf = b''
+        return json.loads(bytes(self._skeleton))
+
+    def discard(self):
+        """Remove the files written so far (after a failed or cancelled transfer)."""
+        if self._file is not None:
+            self._file.close()
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _open(self):
+        mime = bytes(self._header).decode('ascii').partition(';')[0]
+        suffix = mimetypes.guess_extension(mime) or ''
+        self._file = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+        self.paths.append(self._file.name)
+        self._left = b''
+        self._escape = b''
+        self._state = 'data'
+
+    def _unescape(self, part):
+        """Undo the JSON escapes base64 text can carry; an escape split across
+        chunks is held back until the rest of it arrives.
+        """
+        part = self._escape + part
+        self._escape = b''
+        if b'\\' not in part:
+            return part
+        out = bytearray()
+        i = 0
+        while True:
+            k = part.find(b'\\', i)
+            if k < 0:
+                out += part[i:]
+                return bytes(out)
+            out += part[i:k]
+            if k + 2 > len(part):
+                self._escape = part[k:]
+                return bytes(out)
+            escape = part[k:k + 2]
+            if escape not in BASE64_ESCAPES:
+                raise UnsupportedEscape(f"JSON escape {escape!r} inside a data URI")
+            out += BASE64_ESCAPES[escape]
+            i = k + 2
+
+    def _write(self, part):
+        data = self._left + self._unescape(part)
+        n = len(data) // 4 * 4
+        self._file.write(base64.b64decode(data[:n]))
+        self._left = data[n:]
+
+    def _close(self):
+        if self._escape:
+            raise UnsupportedEscape("JSON escape inside a data URI")
+        if self._left:
+            self._file.write(base64.b64decode(self._left + b'=' * (-len(self._left) % 4)))
+        self._file.close()
+        # Written as a JSON string body, escaped like any other (e.g. Windows paths)
+        self._skeleton += json.dumps(LOCAL_PREFIX + self._file.name)[1:-1].encode('utf-8')
+        self._file = None
+        self._state = 'json'
+
+
+def fetch_json(client, url, **kwargs):
+    """GET a JSON document, decoding embedded data URIs to files as it streams.
+    Returns (parsed JSON, list of the files written).
+    """
+    extractor = DataURIExtractor()
+    try:
+        with client.stream('GET', url, **kwargs) as resp:
+            if resp.is_error:
+                resp.read()
+                resp.raise_for_status()
+            for chunk in resp.iter_bytes(CHUNK_SIZE):
+                extractor.feed(chunk)
+        return extractor.result(), extractor.paths
+    except UnsupportedEscape:
+        # Rare encoder output; parse the whole document instead of streaming it
+        extractor.discard()
+        resp = client.get(url, **kwargs)
+        resp.raise_for_status()
+        paths = []
+        return _decode_inline(resp.json(), paths), paths
+    except BaseException:
+        extractor.discard()
+        raise
+
+
+def _decode_inline(value, paths):
+    """Replace base64 data URI strings in parsed JSON by LOCAL_PREFIX file URLs."""
+    if isinstance(value, dict):
+        return {k: _decode_inline(v, paths) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_inline(v, paths) for v in value]
+    if isinstance(value, str) and value.startswith('data:'):
+        header, comma, payload = value[len('data:'):].partition(',')
+        if comma and DATA_HEADER.fullmatch(header.encode('ascii', 'replace')):
+            suffix = mimetypes.guess_extension(header.partition(';')[0]) or ''
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                paths.append(f.name)
+                f.write(base64.b64decode(payload + '=' * (-len(payload) % 4)))
+            return LOCAL_PREFIX + f.name
+    return value
+
+
+def _is_ssl_error(exc):
+    while exc is not None:
+        if isinstance(exc, ssl.SSLError):
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+def download(url, path, on_progress=None, retries=3, backoff=0.5, settings=None):
+    """Stream url into path, calling on_progress(received, total) as bytes arrive.
+    Partial downloads are resumed with a Range request; failures retry with jittered backoff.
+    """
+    received = 0
+    total = None
+    verify = True
+    attempt = 0
+    while True:
+        headers = {'Range': f'bytes={received}-'} if received else {}
+        try:
+            client = http_session.get_client(settings, verify=verify)
+            with client.stream('GET', url, headers=headers) as resp:
+                resp.raise_for_status()
+                if received and resp.status_code != 206:
+                    received = 0  # Server ignored the range; start over
+                length = resp.headers.get('Content-Length')
+                if length is not None:
+                    total = received + int(length)
+                with open(path, 'ab' if received else 'wb') as f:
+                    for chunk in resp.iter_bytes(CHUNK_SIZE):
+                        f.write(chunk)
+                        received += len(chunk)
+                        if on_progress:
+                            on_progress(received, total)
+            return path
+        except httpx.HTTPError as e:
+            if verify and _is_ssl_error(e):
+                # Retry without certificate verification on SSL errors, as before
+                verify = False
+                continue
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if attempt >= retries or (status is not None and status not in RETRY_STATUS):
+                raise
+            time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+
+
+def download_all(items, on_progress=None, on_done=None, max_workers=4, retries=3, settings=None):
+    """Download (url, path) items concurrently.
+
+    on_progress(index, received, total) and on_done(index, path) are called from
+    worker threads. Returns a list aligned with items holding the path, or the
+    exception if that image failed.
+    """
+    if not items:
+        return []
+
+    def _fetch(index, url, path):
+        def _progress(received, total):
+            if on_progress:
+                on_progress(index, received, total)
+        try:
+            with tracing.span('download', index=index) as attrs:
+                download(url, path, _progress, retries, settings=settings)
+                attrs['bytes'] = os.path.getsize(path)
+        except Exception as e:
+            return e
+        if on_done:
+            on_done(index, path)
+        return path
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        futures = [pool.submit(_fetch, i, url, path) for i, (url, path) in enumerate(items)]
+        return [f.result() for f in futures]
@@ -0,0 +1,175 @@
+"""
+Minimal client for fal's queue and storage REST APIs.
+
+Speaks the same endpoints as fal_client, but the base URLs come from settings
+('fal_queue_url', 'fal_rest_url'), so the plug-in and the CLI can be pointed at a
+local fake server. Request handles are fal_client.SyncRequestHandle objects, so
+status polling, result retrieval and cancellation use fal_client's own code.
+All clients share the connection pool of http_session.
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+
+import fal_client
+import httpx
+
+import downloads
+import http_session
+
+QUEUE_URL = 'https://queue.fal.run'
+REST_URL = 'https://rest.fal.ai'
+
+_tokens = {}
+_lock = threading.Lock()
+
+
+def api_key(settings):
+    """Return the API key from settings (api_key, else the first of api_keys) or the
+    FAL_KEY environment variable."""
+    pooled = [e.get('key') for e in settings.get('api_keys') or [] if e.get('key')]
+    key = settings.get('api_key') or (pooled[0] if pooled else None) or os.environ.get('FAL_KEY')
+    if not key:
+        raise RuntimeError(
+            "API key not set in settings or FAL_KEY environment variable"
+        )
+    return key
+
+
+def queue_url(settings):
+    return (settings.get('fal_queue_url') or QUEUE_URL).rstrip('/')
+
+
+def rest_url(settings):
+    return (settings.get('fal_rest_url') or REST_URL).rstrip('/')
+
+
+def get_client(settings):
+    """Return the pooled httpx client authenticated with the settings' API key."""
+    return http_session.get_client(settings, headers={'Authorization': f"Key {api_key(settings)}"})
+
+
+def _raise_for_status(response):
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(f"fal.ai request failed ({response.status_code}): {response.text}") from e
+
+
+def submit(settings, model, arguments):
+    """Submit a request to the queue and return a fal_client.SyncRequestHandle."""
+    client = get_client(settings)
+    response = client.post(f"{queue_url(settings)}/{model}", json=arguments)
+    _raise_for_status(response)
+    data = response.json()
+    return fal_client.SyncRequestHandle(
+        request_id=data['request_id'],
+        response_url=data['response_url'],
+        status_url=data['status_url'],
+        cancel_url=data['cancel_url'],
+        client=client,
+    )
+
+
+def request_handle(settings, request):
+    """Rebuild the handle of a previously submitted request from its recorded URLs."""
+    return fal_client.SyncRequestHandle(
+        request_id=request['request_id'],
+        response_url=request['response_url'],
+        status_url=request['status_url'],
+        cancel_url=request['cancel_url'],
+        client=get_client(settings),
+    )
+
+
+def get_result(settings, handle):
+    """Fetch a completed request's result, streaming inline images to temporary files.
+    Returns (result, files): data URIs in the result are replaced by
+    downloads.LOCAL_PREFIX URLs of the files. The handle's client is used, so the
+    result is fetched with the key the request was submitted with.
+    """
+    try:
+        return downloads.fetch_json(handle.client, handle.response_url)
+    except httpx.HTTPStatusError as e:
+        raise RuntimeError(
+            f"fal.ai request failed ({e.response.status_code}): {e.response.text}") from e
+
+
+def _parse_time(text):
+    value = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _cdn_token(settings):
+    """Return (authorization header, upload base URL), refreshing the CDN token when expired."""
+    key = (api_key(settings), rest_url(settings))
+    with _lock:
+        token = _tokens.get(key)
+    if token is None or datetime.now(timezone.utc) >= token['expires_at']:
+        response = get_client(settings).post(
+            f"{rest_url(settings)}/storage/auth/token?storage_type=fal-cdn-v3", json={})
+        _raise_for_status(response)
+        data = response.json()
+        token = {
+            'header': f"{data['token_type']} {data['token']}",
+            'base_url': data['base_url'].rstrip('/'),
+            'expires_at': _parse_time(data['expires_at']),
+        }
+        with _lock:
+            _tokens[key] = token
+    return token['header'], token['base_url']
+
+
+def upload(settings, data, content_type, file_name=None):
+    """Upload bytes to the fal CDN and return the access URL."""
+    auth, base_url = _cdn_token(settings)
+    headers = {'Authorization': auth, 'Content-Type': content_type}
+    if file_name:
+        headers['X-Fal-File-Name'] = file_name
+    response = get_client(settings).post(f"{base_url}/files/upload", content=data, headers=headers)
+    _raise_for_status(response)
+    return response.json()['access_url']
+
+
+def multipart_create(settings, content_type, file_name=None):
+    """Start a multipart upload on the fal CDN and return (access_url, upload_id)."""
+    auth, base_url = _cdn_token(settings)
+    headers = {'Authorization': auth, 'Content-Type': content_type, 'Accept': 'application/json'}
+    if file_name:
+        headers['X-Fal-File-Name'] = file_name
+    response = get_client(settings).post(f"{base_url}/files/upload/multipart", headers=headers)
+    _raise_for_status(response)
+    data = response.json()
+    return data['access_url'], data['uploadId']
+
+
+def multipart_part(settings, access_url, upload_id, part_number, data, content_type):
+    """Upload one part (numbered from 1) and return its ETag.
+    Raises httpx.HTTPError, so callers can tell retryable failures apart.
+    """
+    auth, _ = _cdn_token(settings)
+    response = get_client(settings).put(
+        f"{access_url}/multipart/{upload_id}/{part_number}",
+        content=data,
+        headers={
+            'Authorization': auth,
+            'Content-Type': content_type,
+            'Accept-Encoding': 'identity',  # Compressed responses drop the ETag header
+        },
+    )
+    response.raise_for_status()
+    return response.headers['etag']
+
+
+def multipart_complete(settings, access_url, upload_id, etags):
+    """Assemble the uploaded parts ({part number: ETag}) and return the access URL."""
+    auth, _ = _cdn_token(settings)
+    parts = [{'partNumber': n, 'etag': etags[n]} for n in sorted(etags)]
+    response = get_client(settings).post(
+        f"{access_url}/multipart/{upload_id}/complete",
+        json={'parts': parts},
+        headers={'Authorization': auth},
+    )
+    _raise_for_status(response)
+    return access_url
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Headless command-line entry point for fal.ai generations.
+
+Runs the same pipeline as the plug-in (falai_wrapper.process_image, through the
+batch scheduler) on image files, without GIMP. Defaults come from the plug-in's
+settings.json; options override them for this run only.
+
+    python3 falai_cli.py --prompt "make it snow" -o out/ frames/*.png
+    python3 falai_cli.py --prompt "a red fox" --num-images 4 -o out/
+    python3 falai_cli.py --collect -o out/
+    python3 falai_cli.py --key-usage
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import batch
+import settings
+import tracing
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run fal.ai image generations without GIMP.")
+    parser.add_argument('inputs', nargs='*', help='input images or folders (none: text-to-image)')
+    parser.add_argument('-p', '--prompt')
+    parser.add_argument('-o', '--output-dir', default='.', help='where results are written')
+    parser.add_argument('-m', '--model', help='fal.ai model endpoint')
+    parser.add_argument('--num-images', type=int)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--guidance-scale', type=float)
+    parser.add_argument('--output-format', choices=['jpeg', 'png'])
+    parser.add_argument('--api-key', help='defaults to settings or FAL_KEY')
+    parser.add_argument('--concurrency', type=int, help='jobs in flight at once')
+    parser.add_argument('--no-cache', action='store_true', help='bypass the result cache')
+    parser.add_argument('--endpoint', help='base URL of a fake fal server, e.g. http://127.0.0.1:8765')
+    parser.add_argument('--collect', action='store_true',
+                        help='fetch results of requests left pending by earlier sessions')
+    parser.add_argument('--key-usage', action='store_true',
+                        help='print the usage counters of the api_keys pool')
+    opts = parser.parse_args(argv)
+    if not opts.prompt and not opts.collect and not opts.key_usage:
+        parser.error('the following arguments are required: -p/--prompt')
+    return opts
+
+
+def build_settings(opts):
+    """Merge command-line overrides into the saved plug-in settings."""
+    conf = settings.load_settings()
+    overrides = {
+        'model': opts.model,
+        'num_images': opts.num_images,
+        'seed': opts.seed,
+        'guidance_scale': opts.guidance_scale,
+        'output_format': opts.output_format,
+        'api_key': opts.api_key,
+        'batch_concurrency': opts.concurrency,
+    }
+    conf.update({k: v for k, v in overrides.items() if v is not None})
+    conf['model'] = conf.get('model') or conf.get('last_model')
+    if opts.api_key:
+        conf['api_keys'] = []  # An explicit key replaces the pool
+    if opts.no_cache:
+        conf['use_result_cache'] = False
+    if opts.endpoint:
+        conf['fal_queue_url'] = conf['fal_rest_url'] = opts.endpoint
+        # Use the stored or bundled model schemas only; the fake server has no OpenAPI
+        conf['model_registry_url'] = ''
+        conf['api_key'] = conf.get('api_key') or 'fake'
+    return conf
+
+
+def expand_inputs(inputs):
+    files = []
+    for path in inputs:
+        files.extend(batch.image_files(path) if os.path.isdir(path) else [path])
+    return files
+
+
+def collect(conf, output_dir):
+    """Write finished results of journaled requests; GIMP layer results go to output_dir."""
+    import falai_wrapper
+
+    def _on_result(entry, result):
+        target = entry.get('target') or {}
+        if isinstance(result, Exception):
+            print(f"{entry['request_id']}: failed: {result}", file=sys.stderr)
+            return
+        if target.get('kind') == 'file':
+            out_dir, stem = target['out_dir'], target['stem']
+        else:
+            out_dir, stem = output_dir, entry['request_id']
+        for path in batch.write_outputs(result, out_dir, stem):
+            print(path)
+
+    collected, running = falai_wrapper.collect_pending(conf, _on_result)
+    print(f"Collected {collected} pending request(s); {running} still running", file=sys.stderr)
+    return 0
+
+
+def key_usage():
+    """Print requests, 429s and other failures per pooled API key."""
+    import keypool
+    usage = keypool.usage()
+    if not usage:
+        print("No API key pool usage recorded", file=sys.stderr)
+        return 0
+    print(f"{'key':<20} {'requests':>9} {'429s':>6} {'failures':>9}  last used")
+    for name, entry in sorted(usage.items()):
+        last = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.get('last_used', 0)))
+        print(f"{name:<20} {entry.get('requests', 0):>9} {entry.get('rate_limited', 0):>6} "
+              f"{entry.get('failures', 0):>9}  {last}")
+    return 0
+
+
+def main(argv=None):
+    opts = parse_args(argv)
+    if opts.key_usage:
+        return key_usage()
+    conf = build_settings(opts)
+    if opts.collect:
+        return collect(conf, opts.output_dir)
+    files = expand_inputs(opts.inputs)
+
+    def _on_result(index, result):
+        label = os.path.basename(files[index]) if files else 'text-to-image'
+        if isinstance(result, Exception):
+            print(f"{label}: failed: {result}", file=sys.stderr)
+            return
+        stem = os.path.splitext(label)[0]
+        for path in batch.write_outputs(result, opts.output_dir, stem):
+            print(path)
+
+    def _target(path=None):
+        stem = os.path.splitext(os.path.basename(path))[0] if path else 'text-to-image'
+        return {'kind': 'file', 'out_dir': os.path.abspath(opts.output_dir), 'stem': stem}
+
+    tracing.begin_run(conf, 'cli', inputs=len(files))
+    scheduler = batch.BatchScheduler(conf, opts.prompt, on_result=_on_result)
+    for path in files:
+        scheduler.submit(input_path=path, target=_target(path))
+    if not files:
+        scheduler.submit(target=_target())
+    scheduler.close()
+    try:
+        results = scheduler.wait()
+    finally:
+        tracing.end_run()
+    failed = sum(isinstance(r, Exception) for r in results)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
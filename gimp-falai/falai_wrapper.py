@@ -7,20 +7,26 @@ import os
 
 # Allow vendored fal_client (and its dependencies) to take priority
 _HERE = os.path.dirname(__file__)
-sys.path.insert(
-    0,
-    os.path.join(
-        _HERE,
-        'vendor',
-        'fal_client',
-    ),
+_VENDOR = os.path.join(
+    _HERE,
+    'vendor',
+    'fal_client',
 )
+if _VENDOR not in sys.path:
+    sys.path.insert(0, _VENDOR)
 
+import contextlib
 import tempfile
-import urllib.request
-import ssl
-import base64
-from gi.repository import Gimp
+import hashlib
+import mimetypes
+import threading
+import time
+
+try:
+    from gi.repository import Gimp, GLib
+except ImportError:
+    # Running headless (falai_cli.py); messages go to stderr
+    Gimp = GLib = None
 
 try:
     import fal_client
@@ -30,58 +36,102 @@ except ImportError:
         "ensure you have run the subtree pull for fal_client and vendored httpx/httpx-sse"
     )
 
-def process_image(settings, prompt, input_path=None):
-    """Invoke fal.ai image-to-image or text-to-image API.
-    If input_path is provided, perform image-to-image; otherwise fall back to text-to-image.
+import downloads
+import fal_api
+import history
+import inflight
+import journal
+import keypool
+import models
+import policy
+import result_cache
+import tracing
+import upload_cache
+import uploads
+
+# Seconds between queue status polls
+POLL_INTERVAL = 0.25
+
+
+class CancelledError(RuntimeError):
+    """Raised when a generation is cancelled by the user."""
+
+
+def _idle_message(text):
+    Gimp.message(text)
+    return False  # Run once
+
+
+def _message(text):
+    """Show a message in GIMP; safe to call from worker threads."""
+    if Gimp is None:
+        print(text, file=sys.stderr)
+    elif threading.current_thread() is threading.main_thread():
+        Gimp.message(text)
+    else:
+        # libgimp is not thread-safe; hand the message to the main loop
+        GLib.idle_add(_idle_message, text)
+
+
+def _debug(settings, text):
+    """Show a [DEBUG] message when the 'debug' setting is on."""
+    if settings.get('debug'):
+        _message(f"[DEBUG] {text}")
+
+
+def discard_outputs(paths):
+    """Delete result files once they have been imported or copied elsewhere.
+    Files served from the result cache belong to the cache and are kept.
     """
-    # Ensure API key is set
-    api_key = settings.get('api_key') or os.environ.get('FAL_KEY')
-    if not api_key:
-        raise RuntimeError(
-            "API key not set in settings or FAL_KEY environment variable"
-        )
-    # Set for fal-client
-    os.environ['FAL_KEY'] = api_key
-
-    # Upload input image file if present (image-to-image); otherwise text-to-image
-    image_url = None
-    if input_path:
-        image_url = fal_client.upload_file(input_path)
-        Gimp.message(f"[DEBUG] Uploaded image URL: {image_url}")
+    for path in paths:
+        if not result_cache.is_cached(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
-    # Prepare arguments for API call
-    args = {
-        'prompt': prompt,
-        'guidance_scale': settings.get('guidance_scale'),
-        'num_images': settings.get('num_images'),
-        'seed': settings.get('seed'),
-        'output_format': settings.get('output_format'),
-        'safety_tolerance': settings.get('safety_tolerance'),
-        'aspect_ratio': settings.get('aspect_ratio'),
-        'sync_mode': settings.get('sync_mode'),
-        'enable_safety_checker': settings.get('enable_safety_checker', True),
-    }
-    if image_url:
-        args['image_url'] = image_url
 
-    def _on_update(update):
-        # Print progress logs to stderr
-        if isinstance(update, fal_client.InProgress):
-            for log in getattr(update, 'logs', []):
-                msg = log.get('message') if isinstance(log, dict) else str(log)
-                print(msg, file=sys.stderr)
-
-    # Debug: show invocation arguments
-    Gimp.message(f"[DEBUG] Invoking fal.ai model '{settings.get('model')}' with args: {args}")
-    # Invoke the fal.ai model
-    result = fal_client.subscribe(
-        settings.get('model'),
-        arguments=args,
-        with_logs=True,
-        on_queue_update=_on_update,
-    )
+def _raise_if_cancelled(cancel, handle=None):
+    """Raise CancelledError if cancel is set, cancelling the queued request first."""
+    if cancel is not None and cancel.is_set():
+        if handle is not None:
+            try:
+                handle.cancel()
+            except Exception as e:
+                print(f"Could not cancel request {handle.request_id}: {e}", file=sys.stderr)
+        raise CancelledError("Generation cancelled")
+
+
+def upload_input(settings, data, content_type, file_name=None, key=None,
+                 on_progress=None, check=None):
+    """Upload image bytes (or an uploads.Source) to the fal CDN and return the URL.
+    Large inputs go up in parallel, resumable parts; see uploads.upload.
+    """
+    source = data if isinstance(data, uploads.Source) else uploads.Source(data)
+    with tracing.span('upload', bytes=source.size):
+        image_url = uploads.upload(settings, source, content_type, file_name, key,
+                                   on_progress, check)
+    _debug(settings, f"Uploaded image URL: {image_url}")
+    return image_url
+
+
+def fetch_outputs(settings, handle, on_status=None, on_image=None, cancel=None, meta=None):
+    """Retrieve the result of a completed request and return the paths of its images.
+    Inline images are decoded to disk, URLs downloaded concurrently; the callbacks
+    and cancel behave as in process_image. meta, if a dict, receives the seed the
+    model reports.
+    """
+    def _status(text, fraction=None):
+        if on_status:
+            on_status(text, fraction)
+
+    # Inline (sync_mode) images are decoded to disk while the result streams in
+    with tracing.span('result', request=handle.request_id) as attrs:
+        result, inline_paths = fal_api.get_result(settings, handle)
+        attrs['inline'] = len(inline_paths)
+    _status("Downloading results...", 0.0)
 
-    # Debug: report result object and normalize single- vs multi-image response
+    # Normalize single- vs multi-image response
     images = []
     if isinstance(result, dict):
         # prefer 'images' list, fallback to single 'image' key
@@ -95,12 +145,14 @@ def process_image(settings, prompt, input_path=None):
         single = getattr(result, 'image', None)
         if not images and single:
             images = [single]
-    Gimp.message(f"[DEBUG] fal.ai returned {len(images)} image(s): {images}")
+    if meta is not None:
+        meta['seed'] = result.get('seed') if isinstance(result, dict) else getattr(result, 'seed', None)
+    # Never format the result itself: inline images can be hundreds of MB
+    _debug(settings, f"fal.ai returned {len(images)} image(s)")
 
-    # Download generated images
+    # Download generated images; inline ones are already on disk, URLs fetched concurrently
     output_paths = []
-    # Debug: print full result for inspection
-    Gimp.message(f"[DEBUG] fal.ai full result: {result!r}")
+    pending = []
     for img in images:
         # support both dict and object types for img
         if isinstance(img, dict):
@@ -111,6 +163,13 @@ def process_image(settings, prompt, input_path=None):
             content_type = getattr(img, 'content_type', None)
         if not url:
             continue
+        if url.startswith(downloads.LOCAL_PREFIX):
+            out_path = url[len(downloads.LOCAL_PREFIX):]
+            inline_paths.remove(out_path)
+            output_paths.append(out_path)
+            if on_image:
+                on_image(len(output_paths) - 1, out_path)
+            continue
         # Determine file suffix: prefer content_type, else url or output_format
         ext = None
         if content_type and '/' in content_type:
@@ -119,24 +178,350 @@ def process_image(settings, prompt, input_path=None):
             ext = os.path.splitext(url)[1].lstrip('.') or settings.get('output_format', 'jpeg')
         suffix = f".{ext}"
         out_path = tempfile.mktemp(suffix=suffix)
-        # Download or decode generated image
-        if url.startswith('data:'):
-            # data URI: decode base64 or raw data
-            header, data_part = url.split(',', 1)
-            if ';base64' in header:
-                data = base64.b64decode(data_part)
-            else:
-                data = data_part.encode('utf-8')
-            with open(out_path, 'wb') as f:
-                f.write(data)
-        else:
-            try:
-                urllib.request.urlretrieve(url, out_path)
-            except Exception:
-                # Retry download without certificate verification on any SSL/URL error
-                ctx = ssl._create_unverified_context()
-                with urllib.request.urlopen(url, context=ctx) as resp, open(out_path, 'wb') as f:
-                    f.write(resp.read())
+        pending.append((url, out_path))
         output_paths.append(out_path)
+    # Inline data the result held outside its images is not needed
+    for path in inline_paths:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+
+    # Aggregate per-image byte counts into one download fraction
+    progress = {}
+
+    def _on_download(index, received, total):
+        _raise_if_cancelled(cancel)
+        progress[index] = (received, total)
+        known = [t for _, t in progress.values() if t]
+        if len(known) == len(pending):
+            _status("Downloading results...", sum(r for r, _ in progress.values()) / sum(known))
 
+    def _on_downloaded(index, path):
+        if on_image:
+            on_image(output_paths.index(path), path)
+
+    results = downloads.download_all(
+        pending,
+        on_progress=_on_download,
+        on_done=_on_downloaded,
+        max_workers=settings.get('download_workers', 4),
+        retries=settings.get('download_retries', 3),
+        settings=settings,
+    )
+    for (url, out_path), res in zip(pending, results):
+        if isinstance(res, Exception):
+            _message(f"[fal.ai] Failed to download {url}: {res}")
+            output_paths.remove(out_path)
+            discard_outputs([out_path])
+    if cancel is not None and cancel.is_set():
+        discard_outputs(output_paths)
+    _raise_if_cancelled(cancel)
     return output_paths
+
+
+def _poll(settings, model, request, target, status, on_update, cancel):
+    """Submit request and poll until it completes; return the completed handle.
+    Past the model's hedge point one duplicate is submitted and the first to finish
+    wins. Every request that does not win is cancelled.
+    """
+    def _submit():
+        with tracing.span('submit'):
+            handle = fal_api.submit(settings, model, request)
+        # Journal the request before waiting on it, so a paid result can still be
+        # collected if this process dies (see collect_pending)
+        if target is not None:
+            journal.record(settings, handle, model, request, target)
+        return handle, time.perf_counter()
+
+    status("Submitting request...")
+    running = [_submit()]
+    hedge_at = policy.hedge_after(settings, model)
+    timeout = policy.request_timeout(settings, model)
+    # Queue and inference time are split at the first non-queued status update
+    submitted, t_submitted = time.time(), running[0][1]
+    started = t_started = None
+    winner = None
+    try:
+        while winner is None:
+            _raise_if_cancelled(cancel)
+            for handle, t_handle in running:
+                update = handle.status(with_logs=True)
+                if started is None and not isinstance(update, fal_client.Queued):
+                    started, t_started = time.time(), time.perf_counter()
+                    tracing.record('queue', submitted, t_started - t_submitted,
+                                   request=handle.request_id)
+                if isinstance(update, fal_client.Completed):
+                    if getattr(update, 'error', None):
+                        raise RuntimeError(f"fal.ai request failed: {update.error}")
+                    winner = handle
+                    policy.record_success(model, time.perf_counter() - t_handle)
+                    break
+                if handle is running[0][0]:
+                    on_update(update)
+            if winner is not None:
+                break
+            elapsed = time.perf_counter() - t_submitted
+            if (hedge_at is not None and len(running) == 1 and elapsed > hedge_at
+                    and policy.allow_hedge(settings, model)):
+                _message(f"[fal.ai] Request slower than usual ({elapsed:.1f} s); "
+                         f"sending a hedged duplicate")
+                tracing.record('hedge', time.time(), 0.0, after=round(elapsed, 1))
+                running.append(_submit())
+            if timeout is not None and elapsed > timeout:
+                raise policy.RequestTimeout(f"fal.ai request timed out after {elapsed:.0f} s")
+            time.sleep(POLL_INTERVAL)
+    finally:
+        for handle, _ in running:
+            if handle is not winner:
+                try:
+                    handle.cancel()
+                except Exception as e:
+                    print(f"Could not cancel request {handle.request_id}: {e}", file=sys.stderr)
+                journal.complete(handle.request_id)
+    if started is not None:
+        tracing.record('inference', started, time.perf_counter() - t_started,
+                       request=winner.request_id)
+    return winner
+
+
+def _await_request(settings, prepare, target, status, on_update, cancel):
+    """Run a request to completion under the execution policy and return its handle.
+    prepare(settings) uploads the inputs with the given settings' API key and returns
+    the request arguments; it runs once, under the first key leased.
+    Timeouts and transient failures are retried with jittered backoff; models whose
+    circuit breaker is open fail immediately. With a key pool every attempt leases a
+    key, and a rate-limited attempt moves on to another key without backing off.
+    """
+    model = settings.get('model')
+    retries = int(settings.get('request_retries', 2))
+    pool = keypool.get_pool(settings)
+    attempt = switched = 0
+    request = None
+    while True:
+        policy.check_circuit(settings, model)
+        name = None
+        keyed = settings
+        if pool is not None:
+            name = pool.acquire(check=lambda: _raise_if_cancelled(cancel),
+                                on_wait=lambda: status("Waiting for a free API key..."))
+            keyed = keypool.with_key(settings, name, pool.key(name))
+        rate_limited, retry_after = False, None
+        try:
+            if request is None:
+                request = prepare(keyed)
+            return _poll(keyed, model, request, target, status, on_update, cancel)
+        except CancelledError:
+            raise
+        except Exception as e:
+            rate_limited, retry_after = keypool.is_rate_limited(e)
+            if name is not None and not rate_limited:
+                keypool.record_failure(name)
+            if not policy.is_transient(e):
+                raise
+            if rate_limited and pool is not None and switched < retries + len(pool):
+                # The key rests; the next lease goes to another one (or waits for one)
+                switched += 1
+                _message(f"[fal.ai] API key '{name}' is rate limited; trying another key")
+                continue
+            policy.record_failure(model)
+            if attempt >= retries:
+                raise
+            delay = policy.backoff(attempt)
+            _message(f"[fal.ai] {e}; retrying in {delay:.1f} s")
+            status(f"Retrying in {delay:.0f} s...")
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+            _raise_if_cancelled(cancel)
+            attempt += 1
+        finally:
+            # The request is finished at fal; its result is fetched outside the lease
+            if name is not None:
+                pool.release(name, rate_limited, retry_after)
+
+
+def process_image(settings, prompt, input_path=None, input_data=None, image_url=None,
+                  input_key=None, mask_data=None, mask_url=None, mask_key=None,
+                  use_cache=None, on_status=None, on_image=None, cancel=None, target=None):
+    """Invoke fal.ai image-to-image or text-to-image API.
+    If input_path, input_data (an in-memory (bytes, content_type) pair) or an already
+    uploaded image_url is provided, perform image-to-image; otherwise fall back to text-to-image.
+    input_key identifies the input content for the result and upload caches; use_cache
+    overrides the 'use_result_cache' setting for this run. mask_data / mask_url and
+    mask_key do the same for an inpainting mask, sent as the model's mask_url.
+
+    Safe to call from a worker thread: on_status(text, fraction) reports progress
+    (fraction is None while it is unknown), on_image(index, path) is called as each
+    image becomes available, and setting the threading.Event cancel aborts the request.
+    target describes where the results go (JSON-serialisable); requests with a target
+    are journaled until their outputs are retrieved.
+    """
+    def _status(text, fraction=None):
+        if on_status:
+            on_status(text, fraction)
+
+    def _check_cancel(handle=None):
+        _raise_if_cancelled(cancel, handle)
+
+    if use_cache is None:
+        use_cache = settings.get('use_result_cache', True)
+
+    # Identify the input by content so cached results survive re-uploads
+    if input_key is None:
+        if input_data:
+            input_key = hashlib.blake2b(input_data[0], digest_size=20).hexdigest()
+        elif input_path:
+            input_key = uploads.Source(path=input_path).digest()
+
+    # Prepare arguments for API call
+    args = {
+        'prompt': prompt,
+        'guidance_scale': settings.get('guidance_scale'),
+        'num_images': settings.get('num_images'),
+        'seed': settings.get('seed'),
+        'output_format': settings.get('output_format'),
+        'safety_tolerance': settings.get('safety_tolerance'),
+        'aspect_ratio': settings.get('aspect_ratio'),
+        'sync_mode': settings.get('sync_mode'),
+        'enable_safety_checker': settings.get('enable_safety_checker', True),
+    }
+    if image_url or input_data or input_path:
+        # Filled in by the upload below, after the cache lookup
+        args['image_url'] = image_url
+    if mask_url or mask_data:
+        args['mask_url'] = mask_url
+    # Send only what the model accepts; invalid values fail here, not in the queue
+    args = models.prepare_args(settings, settings.get('model'), args)
+    if (image_url or input_data or input_path) and 'image_url' not in args:
+        _message(f"[fal.ai] {settings.get('model')} takes no input image; running text-to-image")
+        input_key = image_url = input_data = input_path = None
+    if (mask_url or mask_data) and 'mask_url' not in args:
+        mask_key = mask_url = mask_data = None
+
+    def _generate():
+        started = time.perf_counter()
+        # Fixed-seed requests are deterministic; serve repeats from the result cache
+        cache_key = None
+        if use_cache:
+            cache_key = result_cache.cache_key(settings.get('model'), args, input_key, mask_key)
+            cached = cache_key and result_cache.lookup(cache_key)
+            if cached:
+                tracing.record('cache_hit', time.time(), 0.0, images=len(cached))
+                _message(f"[fal.ai] Reusing {len(cached)} cached result(s)")
+                for i, path in enumerate(cached):
+                    if on_image:
+                        on_image(i, path)
+                return cached
+
+        def _on_upload(sent, total):
+            _status("Uploading input image...", sent / total if total else None)
+
+        def _prepare(keyed):
+            # Upload input image if present (image-to-image); otherwise text-to-image.
+            # keyed carries the API key leased for the request, if any
+            if input_data:
+                _status("Uploading input image...")
+                args['image_url'] = upload_input(keyed, *input_data, key=input_key,
+                                                 on_progress=_on_upload, check=_check_cancel)
+                if input_key:
+                    upload_cache.store(input_key, args['image_url'], len(input_data[0]), settings)
+            elif input_path:
+                _status("Uploading input image...")
+                content_type = mimetypes.guess_type(input_path)[0] or 'application/octet-stream'
+                # Read part by part, so large files are never held in memory whole
+                args['image_url'] = upload_input(
+                    keyed, uploads.Source(path=input_path), content_type,
+                    os.path.basename(input_path), key=input_key,
+                    on_progress=_on_upload, check=_check_cancel)
+            if mask_data:
+                args['mask_url'] = upload_input(keyed, *mask_data)
+                if mask_key:
+                    upload_cache.store(mask_key, args['mask_url'], len(mask_data[0]), settings)
+            _check_cancel()
+            request = models.finalize_args(settings, settings.get('model'), args)
+            # Debug: show invocation arguments
+            _debug(settings, f"Invoking fal.ai model '{settings.get('model')}' with args: {request}")
+            return request
+
+        def _on_update(update):
+            if isinstance(update, fal_client.Queued):
+                _status(f"Queued (position {update.position})")
+            elif isinstance(update, fal_client.InProgress):
+                # Print progress logs to stderr and show the latest one
+                for log in getattr(update, 'logs', None) or []:
+                    msg = log.get('message') if isinstance(log, dict) else str(log)
+                    print(msg, file=sys.stderr)
+                    _status(f"Generating: {msg}")
+
+        # Submit to the queue and poll, so the request can be cancelled while it waits
+        handle = _await_request(settings, _prepare, target, _status, _on_update, cancel)
+        meta = {}
+        try:
+            output_paths = fetch_outputs(settings, handle, on_status, on_image, cancel, meta)
+        except CancelledError:
+            journal.complete(handle.request_id)
+            raise
+        journal.complete(handle.request_id)
+
+        if cache_key and output_paths:
+            result_cache.store(cache_key, output_paths, settings)
+        # Keep every paid-for result, so earlier variants can be recalled offline
+        try:
+            history.record(settings, settings.get('model'), args, output_paths,
+                           seed=meta.get('seed'), source_key=input_key,
+                           request_id=handle.request_id,
+                           seconds=time.perf_counter() - started)
+        except Exception as e:
+            print(f"Could not add the result to the history: {e}", file=sys.stderr)
+        return output_paths
+
+    # Identical requests already in flight (other threads or plug-in processes) are
+    # waited for and their outputs shared instead of being generated again
+    if not settings.get('dedup_inflight', True):
+        return _generate()
+    key = result_cache.request_key(settings.get('model'), args, input_key, mask_key)
+    paths, shared = inflight.run_once(
+        key, _generate, check=_check_cancel,
+        on_wait=lambda: _status("Waiting for an identical request in flight..."))
+    if shared:
+        tracing.record('dedup', time.time(), 0.0, images=len(paths))
+        _message(f"[fal.ai] Shared {len(paths)} result(s) of an identical request")
+        for i, path in enumerate(paths):
+            if on_image:
+                on_image(i, path)
+    return paths
+
+
+def collect_pending(settings, on_result, on_status=None, cancel=None):
+    """Retrieve the results of journaled requests from earlier sessions.
+
+    on_result(entry, paths_or_exception) is called for every request that has
+    finished; requests still queued or running are left in the journal. Returns
+    (collected, still running).
+    """
+    collected = running = 0
+    for entry in journal.pending(settings):
+        _raise_if_cancelled(cancel)
+        key = keypool.key_for(settings, entry.get('key_name'))
+        keyed = keypool.with_key(settings, entry['key_name'], key) if key else settings
+        handle = fal_api.request_handle(keyed, entry)
+        try:
+            status = handle.status()
+        except Exception as e:
+            # Unknown to fal (expired or another account): nothing left to collect
+            on_result(entry, RuntimeError(f"Request {handle.request_id} is gone: {e}"))
+            journal.complete(handle.request_id)
+            continue
+        if not isinstance(status, fal_client.Completed):
+            running += 1
+            continue
+        try:
+            paths = fetch_outputs(keyed, handle, on_status, cancel=cancel)
+        except CancelledError:
+            raise
+        except Exception as e:
+            paths = e
+        journal.complete(handle.request_id)
+        collected += 1
+        on_result(entry, paths)
+    return collected, running
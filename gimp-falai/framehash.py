@@ -0,0 +1,99 @@
+"""
+Perceptual hashing of layers to find near-duplicate animation frames.
+
+Animation frames stored as layers often repeat (holds, static backgrounds).
+Each frame is reduced to a small area-averaged thumbnail of its premultiplied
+luminance and alpha, read downsampled through utils.read_pixels. A difference
+hash of the thumbnail buckets candidates by Hamming distance; a candidate only
+joins a group if no thumbnail pixel differs from the group's representative by
+more than a tolerance, so a small object moving over a static background still
+counts as a new frame. Thumbnails, hashes and distances are computed with NumPy
+across all frames at once; without NumPy only frames whose downsampled pixels
+are byte-identical are grouped.
+"""
+
+import hashlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Longest edge of the downsampled read each thumbnail is averaged from
+SAMPLE_EDGE = 128
+THUMB_SIZE = 64
+# The difference hash has HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 16
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], np.uint8) if np is not None else None
+
+
+def sample_scale(width, height):
+    """Scale for utils.read_pixels that yields a buffer of about SAMPLE_EDGE pixels."""
+    return min(1.0, SAMPLE_EDGE / max(width, height, 1))
+
+
+def _area(a, rows, cols):
+    """Area-average the (..., h, w, c) array down (or nearest-sample it up) to rows x cols."""
+    h, w = a.shape[-3:-1]
+    ys = np.arange(rows) * h // rows
+    xs = np.arange(cols) * w // cols
+    a = np.add.reduceat(a, ys, axis=-3) / np.diff(np.append(ys, h)).clip(1)[:, None, None]
+    return np.add.reduceat(a, xs, axis=-2) / np.diff(np.append(xs, w)).clip(1)[:, None]
+
+
+def _thumbnail(pixels):
+    """THUMB_SIZE x THUMB_SIZE x 2 float32 array of premultiplied luminance and alpha."""
+    data, width, height, bpp = pixels
+    a = np.frombuffer(data, np.uint8, count=width * height * bpp)
+    a = a.reshape(height, width, bpp).astype(np.float32)
+    alpha = a[:, :, -1] / 255.0 if bpp in (2, 4) else np.ones((height, width), np.float32)
+    if bpp >= 3:
+        luma = a[:, :, 0] * 0.299 + a[:, :, 1] * 0.587 + a[:, :, 2] * 0.114
+    else:
+        luma = a[:, :, 0]
+    planes = np.stack([luma * alpha, alpha * 255.0], axis=-1)
+    return _area(planes, THUMB_SIZE, THUMB_SIZE)
+
+
+def _dhash(thumbs):
+    """Packed difference hashes, one row per (N, THUMB_SIZE, THUMB_SIZE, 2) thumbnail."""
+    small = _area(thumbs[..., :1], HASH_SIZE, HASH_SIZE + 1)[..., 0]
+    bits = small[:, :, 1:] > small[:, :, :-1]
+    return np.packbits(bits.reshape(len(thumbs), -1), axis=1)
+
+
+def group_frames(frames, threshold=4, tolerance=3.0):
+    """Group near-duplicate frames.
+
+    frames is a list of (key, Pixels) pairs; only frames with equal keys (e.g. the
+    same region size) can be grouped. threshold is the largest Hamming distance
+    between hashes, tolerance the largest per-pixel difference of the thumbnails
+    (in 8-bit levels). Returns a list holding, for each frame, the index of its
+    group's representative, which is the frame's own index for representatives.
+    """
+    if np is None:
+        first = {}
+        return [first.setdefault((key, hashlib.blake2b(bytes(pixels.data)).digest()), i)
+                for i, (key, pixels) in enumerate(frames)]
+    if not frames:
+        return []
+    thumbs = np.stack([_thumbnail(pixels) for _, pixels in frames])
+    hashes = _dhash(thumbs)
+    reps = {}  # key -> indices of representatives
+    groups = []
+    for i, (key, _) in enumerate(frames):
+        candidates = np.array(reps.get(key, []), np.intp)
+        if candidates.size:
+            distance = _POPCOUNT[hashes[candidates] ^ hashes[i]].sum(axis=1, dtype=np.int32)
+            close = distance <= threshold
+            if close.any():
+                candidates, distance = candidates[close], distance[close]
+                diff = np.abs(thumbs[candidates] - thumbs[i]).max(axis=(1, 2, 3))
+                match = diff <= tolerance
+                if match.any():
+                    groups.append(int(candidates[match][np.argmin(distance[match])]))
+                    continue
+        reps.setdefault(key, []).append(i)
+        groups.append(i)
+    return groups
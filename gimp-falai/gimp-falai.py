@@ -11,20 +11,28 @@ print("🔍 fal.ai plugin.py loaded!", file=sys.stderr)
 import gi
 gi.require_version('Gimp', '3.0')
 gi.require_version('GimpUi', '3.0')
-from gi.repository import Gimp, GimpUi, GObject, GLib
+from gi.repository import Gimp, GObject, GLib
 
 from settings import load_settings, save_settings
-from ui import show_settings_dialog, show_prompt_dialog
+
+# GimpUi (Gtk) and ui (and through it utils, NumPy and the fal_client/httpx stack)
+# are imported by the run handlers only; GIMP's query at startup registers
+# procedures without them.
 
 # Procedure identifiers
 PROC_SETTINGS = 'plug-in-falai-settings'
 PROC_RUN = 'plug-in-falai-run'
+PROC_BATCH = 'plug-in-falai-batch'
+PROC_COLLECT = 'plug-in-falai-collect'
+PROC_HISTORY = 'plug-in-falai-history'
 
 def settings_run(proc, run_mode, image, drawables, args, data):
     """Run handler for global settings dialog."""
     # Launch interactive UI for settings
     if run_mode == Gimp.RunMode.INTERACTIVE:
+        from gi.repository import GimpUi
         GimpUi.init(proc.get_name())
+        from ui import show_settings_dialog
         settings = load_settings()
         try:
             show_settings_dialog(settings)
@@ -34,24 +42,103 @@ def settings_run(proc, run_mode, image, drawables, args, data):
             raise
     return proc.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
+def _settings_from_args(args):
+    """Saved settings with the PDB arguments of a non-interactive call applied.
+    Empty strings and negative/zero sentinels keep the saved value."""
+    conf = load_settings()
+    prompt = args.get_property('prompt') or conf.get('prompt', '')
+    model = args.get_property('model')
+    if model:
+        conf['model'] = model
+    conf['model'] = conf.get('model') or conf.get('last_model')
+    if args.get_property('num-images') > 0:
+        conf['num_images'] = args.get_property('num-images')
+    if args.get_property('seed') >= 0:
+        conf['seed'] = args.get_property('seed')
+    if args.get_property('guidance-scale') >= 0:
+        conf['guidance_scale'] = args.get_property('guidance-scale')
+    return conf, prompt
+
 def run_run(proc, run_mode, image, drawables, args, data):
     """Run handler for per-image prompt and processing."""
+    drawable = drawables[0] if drawables else None
     # Launch interactive UI for prompt and image processing
     if run_mode == Gimp.RunMode.INTERACTIVE:
+        from gi.repository import GimpUi
         GimpUi.init(proc.get_name())
-        drawable = drawables[0] if drawables else None
+        from ui import show_prompt_dialog
         try:
             show_prompt_dialog(image, drawable)
         except Exception as e:
             Gimp.message(f"[DEBUG] prompt dialog failed: {e}")
             raise
+        return proc.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
+
+    # Non-interactive / last values: scripted use from batch GIMP or other plug-ins
+    conf, prompt = _settings_from_args(args)
+    if not prompt:
+        return proc.new_return_values(
+            Gimp.PDBStatusType.CALLING_ERROR, GLib.Error("A prompt is required"))
+    from ui import run_generation
+    try:
+        image.undo_group_start()
+        try:
+            run_generation(image, drawable, conf, prompt, interactive=False)
+        finally:
+            image.undo_group_end()
+    except Exception as e:
+        return proc.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(str(e)))
+    return proc.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
+
+def batch_run(proc, run_mode, image, drawables, args, data):
+    """Run handler for applying one prompt to many layers or files."""
+    if run_mode == Gimp.RunMode.INTERACTIVE:
+        from gi.repository import GimpUi
+        GimpUi.init(proc.get_name())
+        from ui import show_batch_dialog
+        try:
+            show_batch_dialog(image, drawables)
+        except Exception as e:
+            Gimp.message(f"[DEBUG] batch dialog failed: {e}")
+            raise
+    return proc.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
+
+def collect_run(proc, run_mode, image, drawables, args, data):
+    """Run handler for fetching results of requests from earlier sessions."""
+    interactive = run_mode == Gimp.RunMode.INTERACTIVE
+    if interactive:
+        from gi.repository import GimpUi
+        GimpUi.init(proc.get_name())
+    from ui import collect_pending_results
+    try:
+        collect_pending_results(load_settings(), interactive)
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Could not collect pending results: {e}")
+        return proc.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(str(e)))
+    return proc.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
+
+def history_run(proc, run_mode, image, drawables, args, data):
+    """Run handler for re-importing results from the local history."""
+    # Choosing entries needs the dialog; there is nothing to run headless
+    if run_mode != Gimp.RunMode.INTERACTIVE:
+        return proc.new_return_values(
+            Gimp.PDBStatusType.CALLING_ERROR,
+            GLib.Error("The history can only be browsed interactively"))
+    from gi.repository import GimpUi
+    GimpUi.init(proc.get_name())
+    from ui import show_history_dialog
+    try:
+        show_history_dialog(image, load_settings())
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Could not open the history: {e}")
+        return proc.new_return_values(Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(str(e)))
     return proc.new_return_values(Gimp.PDBStatusType.SUCCESS, None)
 
 class FalAiPlugin(Gimp.PlugIn):
     """GIMP3 PlugIn for fal.ai settings and image-to-image."""
 
     def do_query_procedures(self):
-        return [PROC_SETTINGS, PROC_RUN]
+        return [PROC_SETTINGS, PROC_RUN, PROC_BATCH, PROC_COLLECT, PROC_HISTORY]
 
     def do_set_i18n(self, name):
         # We do not support translations
@@ -84,11 +171,79 @@ class FalAiPlugin(Gimp.PlugIn):
             proc.set_attribution('fal.ai', 'fal.ai plugin', '2023')
             proc.set_documentation(
                 'Invoke fal.ai image-to-image model',
-                'Opens a prompt dialog and runs fal.ai model on the current image.',
+                'Opens a prompt dialog and runs fal.ai model on the current image. '
+                'Non-interactive calls use the arguments below; empty or negative '
+                'values fall back to the saved settings.',
                 None)
             proc.set_sensitivity_mask(
                 Gimp.ProcedureSensitivityMask.DRAWABLE |
                 Gimp.ProcedureSensitivityMask.NO_DRAWABLES)
+            proc.add_string_argument(
+                'prompt', 'Prompt', 'Text prompt', '', GObject.ParamFlags.READWRITE)
+            proc.add_string_argument(
+                'model', 'Model', 'fal.ai model endpoint', '', GObject.ParamFlags.READWRITE)
+            proc.add_int_argument(
+                'num-images', '# Images', 'Number of images (0: saved setting)',
+                0, 10, 0, GObject.ParamFlags.READWRITE)
+            proc.add_int_argument(
+                'seed', 'Seed', 'Seed (-1: saved setting)',
+                -1, 2147483647, -1, GObject.ParamFlags.READWRITE)
+            proc.add_double_argument(
+                'guidance-scale', 'Guidance scale', 'Guidance scale (-1: saved setting)',
+                -1.0, 50.0, -1.0, GObject.ParamFlags.READWRITE)
+            return proc
+
+        if name == PROC_BATCH:
+            proc = Gimp.ImageProcedure.new(
+                self, name,
+                Gimp.PDBProcType.PLUGIN,
+                batch_run, None)
+            proc.set_image_types('*')
+            proc.set_menu_label('fal.ai Batch...')
+            proc.add_menu_path('<Image>/Filters/fal.ai')
+            proc.set_attribution('fal.ai', 'fal.ai plugin', '2023')
+            proc.set_documentation(
+                'Run a fal.ai model over many layers or files',
+                'Applies one prompt to every selected layer and/or every image in a folder.',
+                None)
+            proc.set_sensitivity_mask(
+                Gimp.ProcedureSensitivityMask.DRAWABLE |
+                Gimp.ProcedureSensitivityMask.DRAWABLES |
+                Gimp.ProcedureSensitivityMask.NO_DRAWABLES)
+            return proc
+
+        if name == PROC_COLLECT:
+            proc = Gimp.ImageProcedure.new(
+                self, name,
+                Gimp.PDBProcType.PLUGIN,
+                collect_run, None)
+            proc.set_image_types('*')
+            proc.set_menu_label('fal.ai Collect Pending Results')
+            proc.add_menu_path('<Image>/Filters/fal.ai')
+            proc.set_attribution('fal.ai', 'fal.ai plugin', '2023')
+            proc.set_documentation(
+                'Fetch fal.ai results of interrupted sessions',
+                'Polls requests that were submitted before GIMP or the plug-in closed '
+                'and imports the finished results.',
+                None)
+            proc.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.ALWAYS)
+            return proc
+
+        if name == PROC_HISTORY:
+            proc = Gimp.ImageProcedure.new(
+                self, name,
+                Gimp.PDBProcType.PLUGIN,
+                history_run, None)
+            proc.set_image_types('*')
+            proc.set_menu_label('fal.ai History...')
+            proc.add_menu_path('<Image>/Filters/fal.ai')
+            proc.set_attribution('fal.ai', 'fal.ai plugin', '2023')
+            proc.set_documentation(
+                'Re-import earlier fal.ai results',
+                'Shows the locally kept results of earlier generations and imports the '
+                'selected ones as layers, without a new request.',
+                None)
+            proc.set_sensitivity_mask(Gimp.ProcedureSensitivityMask.ALWAYS)
             return proc
 
 Gimp.main(FalAiPlugin.__gtype__, sys.argv)
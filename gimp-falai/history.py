@@ -0,0 +1,239 @@
+"""
+Local history of generated results, for recalling earlier variants offline.
+
+Every fresh generation is indexed in CONFIG_DIR/history/index.sqlite with its
+model, arguments, seed, timing and the content hash of the source layer, and its
+output files are kept under history/files/<id>/. A THUMB_SIZE thumbnail of the
+first output is written into a fixed slot of history/thumbs.atlas, a flat file of
+RGBA slots that the history dialog memory-maps, so hundreds of entries show
+without decoding any image. Entries beyond 'history_max_entries' or
+'history_max_mb' are evicted oldest first; their slots are reused, so the atlas
+stays within history_max_entries slots.
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from settings import CONFIG_DIR
+
+HISTORY_DIR = CONFIG_DIR / 'history'
+DB_PATH = HISTORY_DIR / 'index.sqlite'
+ATLAS_PATH = HISTORY_DIR / 'thumbs.atlas'
+FILES_DIR = HISTORY_DIR / 'files'
+
+THUMB_SIZE = 128
+SLOT_BYTES = THUMB_SIZE * THUMB_SIZE * 4
+
+# Arguments that only say how the outputs were delivered
+TRANSPORT_ARGS = ('sync_mode',)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL NOT NULL,
+    model TEXT,
+    prompt TEXT,
+    args TEXT NOT NULL,
+    seed INTEGER,
+    source_key TEXT,
+    request_id TEXT,
+    seconds REAL,
+    files TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    slot INTEGER,
+    thumb_width INTEGER,
+    thumb_height INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_created ON entries (created);
+CREATE INDEX IF NOT EXISTS entries_source ON entries (source_key);
+"""
+
+# Atlas writes of this process; other processes are serialised by the database lock
+_atlas_lock = threading.Lock()
+
+
+def _connect():
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _thumbnail(path):
+    """Return (RGBA slot bytes, width, height) for the image at path, or None without Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(path) as img:
+        img = img.convert('RGBA')
+        img.thumbnail((THUMB_SIZE, THUMB_SIZE))
+        slot = Image.new('RGBA', (THUMB_SIZE, THUMB_SIZE))
+        slot.paste(img, (0, 0))
+        return slot.tobytes(), img.width, img.height
+
+
+def _write_slot(slot, data):
+    with _atlas_lock:
+        mode = 'r+b' if os.path.exists(ATLAS_PATH) else 'w+b'
+        with open(ATLAS_PATH, mode) as f:
+            f.seek(slot * SLOT_BYTES)
+            f.write(data)
+
+
+def _free_slot(conn):
+    used = [row[0] for row in conn.execute(
+        'SELECT slot FROM entries WHERE slot IS NOT NULL ORDER BY slot')]
+    for expected, slot in enumerate(used):
+        if slot != expected:
+            return expected
+    return len(used)
+
+
+def record(settings, model, args, paths, seed=None, source_key=None, request_id=None,
+           seconds=None):
+    """Keep copies of a generation's outputs and index them; returns the entry ID,
+    or None when 'history_enabled' is off.
+    """
+    if not settings.get('history_enabled', True) or not paths:
+        return None
+    args = {k: v for k, v in args.items() if k not in TRANSPORT_ARGS}
+    thumb = _thumbnail(paths[0])
+    conn = _connect()
+    entry_id = None
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            slot = _free_slot(conn) if thumb else None
+            entry_id = conn.execute(
+                'INSERT INTO entries (created, model, prompt, args, seed, source_key, '
+                'request_id, seconds, files, size, slot, thumb_width, thumb_height) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), model, args.get('prompt'), json.dumps(args, sort_keys=True),
+                 seed if seed is not None else args.get('seed'), source_key, request_id,
+                 seconds, '[]', 0, slot, thumb and thumb[1], thumb and thumb[2])).lastrowid
+            entry_dir = FILES_DIR / str(entry_id)
+            os.makedirs(entry_dir, exist_ok=True)
+            files, size = [], 0
+            for i, path in enumerate(paths):
+                name = f"{i}{os.path.splitext(path)[1]}"
+                # Outputs are temp files the caller deletes; a hard link keeps the data
+                try:
+                    os.link(path, entry_dir / name)
+                except OSError:
+                    shutil.copyfile(path, entry_dir / name)
+                files.append(name)
+                size += os.path.getsize(entry_dir / name)
+            conn.execute('UPDATE entries SET files = ?, size = ? WHERE id = ?',
+                         (json.dumps(files), size, entry_id))
+            if thumb:
+                _write_slot(slot, thumb[0])
+            _evict(conn, settings)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            if entry_id is not None:
+                shutil.rmtree(FILES_DIR / str(entry_id), ignore_errors=True)
+            raise
+    finally:
+        conn.close()
+    return entry_id
+
+
+def _evict(conn, settings):
+    """Delete the oldest entries until both limits hold. The atlas is never truncated
+    (an open dialog may have it mapped); freed slots are filled first instead.
+    """
+    max_entries = int(settings.get('history_max_entries', 500))
+    max_bytes = float(settings.get('history_max_mb', 1000)) * 1024 * 1024
+    count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+    rows = conn.execute('SELECT id, size FROM entries ORDER BY created').fetchall()
+    # The newest entry always stays, even if it alone is over the size limit
+    for row in rows[:-1]:
+        if count <= max_entries and total <= max_bytes:
+            break
+        conn.execute('DELETE FROM entries WHERE id = ?', (row['id'],))
+        shutil.rmtree(FILES_DIR / str(row['id']), ignore_errors=True)
+        count -= 1
+        total -= row['size']
+
+
+def _decode(row):
+    entry = dict(row)
+    entry['args'] = json.loads(entry['args'])
+    entry['files'] = json.loads(entry['files'])
+    return entry
+
+
+def entries(limit=None, source_key=None):
+    """Return indexed entries as dicts, newest first; source_key filters by source layer."""
+    if not os.path.exists(DB_PATH):
+        return []
+    query, params = 'SELECT * FROM entries', []
+    if source_key:
+        query += ' WHERE source_key = ?'
+        params.append(source_key)
+    query += ' ORDER BY created DESC'
+    if limit:
+        query += ' LIMIT ?'
+        params.append(int(limit))
+    conn = _connect()
+    try:
+        return [_decode(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+
+def files(entry):
+    """Return the paths of the entry's stored outputs that still exist."""
+    paths = [str(FILES_DIR / str(entry['id']) / name) for name in entry['files']]
+    return [p for p in paths if os.path.isfile(p)]
+
+
+def delete(entry_id):
+    """Remove one entry and its files; its atlas slot is reused by the next entry."""
+    conn = _connect()
+    try:
+        conn.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+    finally:
+        conn.close()
+    shutil.rmtree(FILES_DIR / str(entry_id), ignore_errors=True)
+
+
+class Atlas:
+    """Read-only memory map of the thumbnail atlas, used as a context manager."""
+
+    def __init__(self):
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        try:
+            self._file = open(ATLAS_PATH, 'rb')
+            if os.fstat(self._file.fileno()).st_size:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            pass
+        return self
+
+    def __exit__(self, *exc):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def thumbnail(self, entry):
+        """Return (RGBA bytes, width, height, rowstride) of the entry's thumbnail, or None."""
+        slot = entry.get('slot')
+        if slot is None or self._map is None or (slot + 1) * SLOT_BYTES > len(self._map):
+            return None
+        start = slot * SLOT_BYTES
+        return (self._map[start:start + SLOT_BYTES], entry['thumb_width'],
+                entry['thumb_height'], THUMB_SIZE * 4)
@@ -0,0 +1,80 @@
+"""
+Shared HTTP session layer for uploads, queue polling and downloads.
+
+Every httpx client the plug-in creates mounts the same transport (connection
+pool), one per TLS verification mode, so fal API calls and CDN downloads reuse
+keep-alive connections instead of repeating DNS, TCP and TLS handshakes.
+Timeouts, pool size, HTTP/2 and the proxy come from settings.
+"""
+
+import importlib.util
+import threading
+import urllib.request
+
+import httpx
+
+_transports = {}
+_clients = {}
+_lock = threading.Lock()
+
+
+def _option(settings, name, default):
+    value = (settings or {}).get(name)
+    return default if value is None else value
+
+
+def _transport(settings, verify, proxy=None):
+    """Return the shared pool for this verification mode and proxy."""
+    # HTTP/2 needs the optional h2 package; fall back to HTTP/1.1 keep-alive without it
+    http2 = bool(_option(settings, 'http2', True)) and importlib.util.find_spec('h2') is not None
+    size = int(_option(settings, 'http_max_connections', 16))
+    key = (verify, proxy, http2, size)
+    transport = _transports.get(key)
+    if transport is None:
+        transport = httpx.HTTPTransport(
+            verify=verify,
+            http2=http2,
+            proxy=proxy,
+            limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+        )
+        _transports[key] = transport
+    return transport
+
+
+def _mounts(settings, verify):
+    """Route through the configured proxy, or the environment's, honouring no_proxy."""
+    proxy = _option(settings, 'http_proxy', '')
+    env = {} if proxy else urllib.request.getproxies()
+    proxy = proxy or env.get('https') or env.get('all')
+    if not proxy:
+        return None
+    mounts = {'all://': _transport(settings, verify, proxy)}
+    for host in env.get('no', '').split(','):
+        host = host.strip().lstrip('.')
+        if host:
+            mounts[f"all://*{host}"] = None  # Direct, through the default pool
+    return mounts
+
+
+def get_client(settings=None, headers=None, verify=True):
+    """Return a client on the shared pool; clients are cached per header set and
+    per connection settings, so changed settings take effect without a restart."""
+    key = (tuple(sorted((headers or {}).items())), verify,
+           _option(settings, 'http_timeout', 30.0), _option(settings, 'http_read_timeout', 120.0),
+           _option(settings, 'http_proxy', ''), bool(_option(settings, 'http2', True)),
+           int(_option(settings, 'http_max_connections', 16)))
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = httpx.Client(
+                transport=_transport(settings, verify),
+                mounts=_mounts(settings, verify),
+                headers=headers,
+                follow_redirects=True,
+                timeout=httpx.Timeout(
+                    float(_option(settings, 'http_timeout', 30.0)),
+                    read=float(_option(settings, 'http_read_timeout', 120.0)),
+                ),
+            )
+            _clients[key] = client
+        return client
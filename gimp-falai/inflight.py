@@ -0,0 +1,138 @@
+"""
+Coalescing of identical requests that are in flight at the same time.
+
+The first caller for a request key holds an exclusive lock on
+CONFIG_DIR/inflight/<key>.lock while it generates, then publishes its outputs
+next to the lock. Identical requests from other threads or plug-in processes
+block on the same lock and receive copies of those outputs instead of being
+queued and billed again. If the first caller fails, the next one runs itself.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows
+    import msvcrt
+
+from settings import CONFIG_DIR, read_json, write_json
+
+INFLIGHT_DIR = CONFIG_DIR / 'inflight'
+POLL_INTERVAL = 0.25
+# Published outputs are removed once they are older than this (seconds)
+PUBLISH_TTL = 600
+
+
+def _try_lock(f):
+    # flock locks belong to the open file, so threads of one process exclude each other too
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _publish(key, paths):
+    """Hard-link (or copy) outputs into the shared directory and write its manifest."""
+    entry_dir = INFLIGHT_DIR / key
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.makedirs(entry_dir)
+    files = []
+    for i, path in enumerate(paths):
+        name = f"{i}{os.path.splitext(path)[1]}"
+        try:
+            os.link(path, entry_dir / name)
+        except OSError:
+            shutil.copyfile(path, entry_dir / name)
+        files.append(name)
+    write_json(INFLIGHT_DIR / f"{key}.json", {'files': files, 'finished': time.time()})
+
+
+def _shared(key, since):
+    """Return private copies of the outputs published for key after since, or None."""
+    manifest = read_json(INFLIGHT_DIR / f"{key}.json", None)
+    if not manifest or manifest['finished'] < since:
+        return None
+    paths = []
+    try:
+        for name in manifest['files']:
+            path = tempfile.mktemp(suffix=os.path.splitext(name)[1])
+            shutil.copyfile(INFLIGHT_DIR / key / name, path)
+            paths.append(path)
+    except OSError:
+        for path in paths:
+            os.remove(path)
+        return None  # Cleaned up in between; generate instead
+    return paths
+
+
+def _cleanup(now):
+    """Remove published outputs that no waiting request can still claim, and idle locks."""
+    try:
+        names = os.listdir(INFLIGHT_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = INFLIGHT_DIR / name
+        try:
+            if name.endswith('.json'):
+                if now - read_json(path, {}).get('finished', 0) >= PUBLISH_TTL:
+                    shutil.rmtree(INFLIGHT_DIR / name[:-len('.json')], ignore_errors=True)
+                    os.remove(path)
+            elif name.endswith('.lock') and now - os.path.getmtime(path) >= PUBLISH_TTL:
+                with open(path, 'a+') as f:
+                    if _try_lock(f):
+                        os.remove(path)
+                        _unlock(f)
+        except OSError:
+            pass
+
+
+def run_once(key, generate, check=None, on_wait=None):
+    """Run generate() -> paths, unless an identical request is already running.
+
+    Returns (paths, shared); shared is True when the paths are copies of another
+    request's outputs. While waiting, check() is called periodically (it may raise to
+    abort) and on_wait() once. Without a key, generate() simply runs.
+    """
+    if not key:
+        return generate(), False
+    os.makedirs(INFLIGHT_DIR, exist_ok=True)
+    started = time.time()
+    _cleanup(started)
+    with open(INFLIGHT_DIR / f"{key}.lock", 'a+') as f:
+        waited = False
+        while not _try_lock(f):
+            if not waited and on_wait:
+                on_wait()
+            waited = True
+            if check:
+                check()
+            time.sleep(POLL_INTERVAL)
+        try:
+            if waited:
+                paths = _shared(key, started)
+                if paths is not None:
+                    return paths, True
+            paths = generate()
+            if paths:
+                _publish(key, paths)
+            return paths, False
+        finally:
+            _unlock(f)
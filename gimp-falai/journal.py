@@ -0,0 +1,111 @@
+"""
+Journal of submitted requests whose results have not been retrieved yet.
+
+Each request is written to CONFIG_DIR/jobs/<request id>.json right after it is
+queued, with its model, arguments and a description of where its results go.
+The entry is removed once the outputs are on disk (or the request is
+cancelled), so entries that remain belong to sessions that closed or crashed
+while waiting; falai_wrapper.collect_pending fetches their results. Entries
+record the pid and host of the process waiting on them; pending() leaves out
+those whose process is still alive, so a result is never imported twice.
+"""
+
+import os
+import socket
+import time
+
+from settings import CONFIG_DIR, read_json, write_json
+
+JOBS_DIR = CONFIG_DIR / 'jobs'
+
+
+def _ttl(settings):
+    return float(settings.get('job_journal_ttl_hours', 24)) * 3600
+
+
+def record(settings, handle, model, args, target):
+    """Remember a queued request until complete() is called for it."""
+    if _ttl(settings) <= 0:
+        return
+    write_json(JOBS_DIR / f"{handle.request_id}.json", {
+        'request_id': handle.request_id,
+        'response_url': handle.response_url,
+        'status_url': handle.status_url,
+        'cancel_url': handle.cancel_url,
+        'model': model,
+        'args': args,
+        'target': target,
+        # Results can only be fetched with the key that submitted the request
+        'key_name': settings.get('api_key_name'),
+        'submitted': time.time(),
+        'owner_pid': os.getpid(),
+        'owner_host': socket.gethostname(),
+    })
+
+
+def complete(request_id):
+    """Forget a request whose outputs were retrieved, cancelled or given up on."""
+    try:
+        os.remove(JOBS_DIR / f"{request_id}.json")
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    if os.name == 'nt':
+        # os.kill() would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        try:
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Alive, owned by another user
+    return True
+
+
+def _owned(entry):
+    """True if the process that journaled entry may still be waiting on it."""
+    pid = entry.get('owner_pid')
+    if pid is None:
+        return False
+    if entry.get('owner_host') != socket.gethostname():
+        # Config directory shared between machines: liveness cannot be checked
+        # here, so leave the entry to its owner until it expires
+        return True
+    return _pid_alive(pid)
+
+
+def pending(settings):
+    """Return the journaled requests of processes that are gone, oldest first;
+    expired entries are dropped."""
+    try:
+        names = os.listdir(JOBS_DIR)
+    except OSError:
+        return []
+    now = time.time()
+    entries = []
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        entry = read_json(JOBS_DIR / name, None)
+        if entry is None:
+            continue
+        if now - entry.get('submitted', 0) >= _ttl(settings):
+            # fal no longer keeps the result (or journaling was turned off)
+            complete(entry.get('request_id', name[:-len('.json')]))
+            continue
+        if _owned(entry):
+            # Still being polled by a live session (possibly this one)
+            continue
+        entries.append(entry)
+    return sorted(entries, key=lambda e: e['submitted'])
@@ -0,0 +1,176 @@
+"""
+Scheduling of requests across several fal.ai API keys.
+
+'api_keys' in the settings lists named keys, each with its own limits:
+
+    {"name": "team-a", "key": "...", "max_concurrent": 2, "requests_per_minute": 30}
+
+A request leases the least busy key with a free slot (0 means unlimited) while
+its inputs upload and for as long as it is queued or running at fal, then
+releases it; the result is fetched with the same key but outside the lease. A key answering 429 rests for the
+server's Retry-After, or 'key_backoff_s' doubling with every consecutive 429,
+while the other keys carry on. Per-key usage counters are kept in
+CONFIG_DIR/key_usage.json. Keys travel inside the settings dict of each request
+(see with_key), never through the process environment.
+"""
+
+import collections
+import json
+import threading
+import time
+
+import httpx
+
+from settings import CONFIG_DIR, read_json, write_json
+
+USAGE_PATH = CONFIG_DIR / 'key_usage.json'
+POLL_INTERVAL = 0.25
+# Longest rest after repeated 429s (seconds)
+MAX_BACKOFF = 600
+
+_pools = {}
+_pools_lock = threading.Lock()
+_usage_lock = threading.Lock()
+
+
+class KeyPool:
+    """Leases of the keys in one 'api_keys' list, shared by all threads of a process."""
+
+    def __init__(self, entries, backoff):
+        self._backoff = backoff
+        self._cond = threading.Condition()
+        self._keys = collections.OrderedDict()
+        for entry in entries:
+            self._keys[entry['name']] = {
+                'key': entry['key'],
+                'limit': int(entry.get('max_concurrent') or 0),
+                'rate': float(entry.get('requests_per_minute') or 0),
+                'active': 0,
+                'starts': collections.deque(),
+                'resume': 0.0,
+                'strikes': 0,
+                'last': 0.0,
+            }
+
+    def __len__(self):
+        return len(self._keys)
+
+    def key(self, name):
+        return self._keys[name]['key']
+
+    def total_concurrency(self):
+        """Combined max_concurrent of all keys, or None if any key is unlimited."""
+        limits = [state['limit'] for state in self._keys.values()]
+        return sum(limits) if all(limits) else None
+
+    def _delay(self, state, now):
+        """Seconds until the key can take another request (0 when it can now)."""
+        while state['starts'] and now - state['starts'][0] >= 60:
+            state['starts'].popleft()
+        if state['limit'] and state['active'] >= state['limit']:
+            return POLL_INTERVAL  # Freed by release(), which notifies
+        delay = max(0.0, state['resume'] - now)
+        if state['rate'] and len(state['starts']) >= state['rate']:
+            delay = max(delay, state['starts'][0] + 60 - now)
+        return delay
+
+    def acquire(self, check=None, on_wait=None):
+        """Lease a key and return its name, blocking until one is free.
+        check() is called while waiting (it may raise to abort), on_wait() once.
+        """
+        waited = False
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = [(name, state) for name, state in self._keys.items()
+                         if self._delay(state, now) == 0]
+                if ready:
+                    # Spread: lowest share of its limit first, then least recently used
+                    name, state = min(ready, key=lambda item: (
+                        item[1]['active'] / item[1]['limit'] if item[1]['limit'] else 0.0,
+                        item[1]['last']))
+                    state['active'] += 1
+                    state['starts'].append(now)
+                    state['last'] = now
+                    break
+                if not waited and on_wait:
+                    on_wait()
+                waited = True
+                delay = min(self._delay(state, now) for state in self._keys.values())
+                self._cond.wait(min(delay, POLL_INTERVAL))
+                if check:
+                    check()
+        _count(name, 'requests')
+        return name
+
+    def release(self, name, rate_limited=False, retry_after=None):
+        """End a lease. After a 429 the key rests before it is leased again."""
+        with self._cond:
+            state = self._keys[name]
+            state['active'] -= 1
+            if rate_limited:
+                rest = retry_after or min(MAX_BACKOFF, self._backoff * 2 ** state['strikes'])
+                state['resume'] = max(state['resume'], time.monotonic() + rest)
+                state['strikes'] += 1
+            else:
+                state['strikes'] = 0
+            self._cond.notify_all()
+        if rate_limited:
+            _count(name, 'rate_limited')
+
+
+def get_pool(settings):
+    """Return the process-wide KeyPool for the settings' 'api_keys', or None without any."""
+    entries = [e for e in settings.get('api_keys') or [] if e.get('key')]
+    if not entries:
+        return None
+    backoff = float(settings.get('key_backoff_s', 30))
+    signature = json.dumps([entries, backoff], sort_keys=True)
+    with _pools_lock:
+        pool = _pools.get(signature)
+        if pool is None:
+            pool = _pools[signature] = KeyPool(entries, backoff)
+        return pool
+
+
+def with_key(settings, name, key):
+    """Return a copy of settings that authenticates requests with the named key."""
+    return dict(settings, api_key=key, api_key_name=name)
+
+
+def key_for(settings, name):
+    """Return the API key called name in 'api_keys', or None."""
+    for entry in settings.get('api_keys') or []:
+        if entry.get('name') == name:
+            return entry.get('key')
+    return None
+
+
+def is_rate_limited(error):
+    """Return (True, Retry-After seconds or None) if error is a 429 response."""
+    cause = error if isinstance(error, httpx.HTTPError) else error.__cause__
+    if not isinstance(cause, httpx.HTTPStatusError) or cause.response.status_code != 429:
+        return False, None
+    try:
+        return True, float(cause.response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return True, None
+
+
+def _count(name, field):
+    with _usage_lock:
+        usage = read_json(USAGE_PATH, {})
+        entry = usage.setdefault(name, {'requests': 0, 'rate_limited': 0, 'failures': 0})
+        entry[field] = entry.get(field, 0) + 1
+        entry['last_used'] = time.time()
+        write_json(USAGE_PATH, usage)
+
+
+def record_failure(name):
+    """Count a failed request (other than a 429) against the key."""
+    _count(name, 'failures')
+
+
+def usage():
+    """Return the per-key usage counters: {name: {requests, rate_limited, failures, last_used}}."""
+    return read_json(USAGE_PATH, {})
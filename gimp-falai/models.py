@@ -0,0 +1,275 @@
+"""
+Registry of model capabilities: accepted parameters, input limits and outputs.
+
+Each endpoint's input schema is read from fal's OpenAPI description, cached in
+CONFIG_DIR/models.json and refreshed lazily once it is older than
+'model_registry_ttl_hours'. Schemas bundled below cover the common models when
+the registry cannot be reached. process_image uses the registry to send only the
+parameters a model accepts and to reject invalid values before queueing.
+"""
+
+import sys
+import time
+
+from settings import CONFIG_DIR, read_json, write_json
+
+REGISTRY_PATH = CONFIG_DIR / 'models.json'
+# Bump when the stored capability format changes; older registries are refetched
+REGISTRY_VERSION = 1
+OPENAPI_URL = 'https://fal.ai/api/openapi/queue/openapi.json?endpoint_id={model}'
+
+# Arguments filled in by process_image after the cache lookup (uploaded inputs)
+URL_ARGS = ('image_url', 'mask_url')
+
+_ASPECT_RATIOS = ['21:9', '16:9', '4:3', '3:2', '1:1', '2:3', '3:4', '9:16', '9:21']
+_KONTEXT = {
+    'prompt': {'type': 'string'},
+    'image_url': {'type': 'string'},
+    'seed': {'type': 'integer'},
+    'guidance_scale': {'type': 'number', 'minimum': 1, 'maximum': 20},
+    'sync_mode': {'type': 'boolean'},
+    'num_images': {'type': 'integer', 'minimum': 1, 'maximum': 4},
+    'output_format': {'type': 'string', 'enum': ['jpeg', 'png']},
+    'safety_tolerance': {'type': 'string', 'enum': ['1', '2', '3', '4', '5', '6']},
+    'aspect_ratio': {'type': 'string', 'enum': _ASPECT_RATIOS},
+    'enhance_prompt': {'type': 'boolean'},
+}
+_TEXT_TO_IMAGE = {k: v for k, v in _KONTEXT.items() if k != 'image_url'}
+# Kontext works at about one megapixel; larger inputs are resized by fal anyway
+_KONTEXT_MEGAPIXELS = 1.0
+
+BUNDLED = {
+    'fal-ai/flux-pro/kontext/max': {
+        'inputs': _KONTEXT, 'required': ['prompt', 'image_url'], 'outputs': ['images'],
+        'max_megapixels': _KONTEXT_MEGAPIXELS,
+    },
+    'fal-ai/flux-pro/kontext': {
+        'inputs': _KONTEXT, 'required': ['prompt', 'image_url'], 'outputs': ['images'],
+        'max_megapixels': _KONTEXT_MEGAPIXELS,
+    },
+    'fal-ai/flux-pro/kontext/max/text-to-image': {
+        'inputs': _TEXT_TO_IMAGE, 'required': ['prompt'], 'outputs': ['images'],
+    },
+    'fal-ai/flux-pro/kontext/text-to-image': {
+        'inputs': _TEXT_TO_IMAGE, 'required': ['prompt'], 'outputs': ['images'],
+    },
+    'fal-ai/flux-pro/v1/fill': {
+        'inputs': {
+            **{k: v for k, v in _KONTEXT.items() if k not in ('guidance_scale', 'aspect_ratio')},
+            'mask_url': {'type': 'string'},
+        },
+        'required': ['prompt', 'image_url', 'mask_url'],
+        'outputs': ['images'],
+    },
+    'fal-ai/flux/dev': {
+        'inputs': {
+            'prompt': {'type': 'string'},
+            'image_size': {'type': 'object'},
+            'num_inference_steps': {'type': 'integer', 'minimum': 1, 'maximum': 50},
+            'seed': {'type': 'integer'},
+            'guidance_scale': {'type': 'number', 'minimum': 1, 'maximum': 20},
+            'sync_mode': {'type': 'boolean'},
+            'num_images': {'type': 'integer', 'minimum': 1, 'maximum': 4},
+            'enable_safety_checker': {'type': 'boolean'},
+            'output_format': {'type': 'string', 'enum': ['jpeg', 'png']},
+        },
+        'required': ['prompt'],
+        'outputs': ['images'],
+    },
+}
+
+_fetched = set()  # Endpoints already looked up in this process
+
+
+def _resolve(spec, schema):
+    """Follow $ref pointers and merge allOf parts of an OpenAPI schema."""
+    while isinstance(schema, dict) and '$ref' in schema:
+        node = spec
+        for part in schema['$ref'].lstrip('#/').split('/'):
+            node = node.get(part, {})
+        schema = node
+    if isinstance(schema, dict) and 'allOf' in schema:
+        merged = {k: v for k, v in schema.items() if k != 'allOf'}
+        for part in schema['allOf']:
+            merged = {**_resolve(spec, part), **merged}
+        schema = merged
+    return schema if isinstance(schema, dict) else {}
+
+
+def _parameter(spec, prop):
+    """Reduce a property schema to the type, enum and numeric bounds we check."""
+    prop = _resolve(spec, prop)
+    options = [_resolve(spec, o) for o in prop.get('anyOf') or prop.get('oneOf') or []]
+    options = [o for o in options if o.get('type') != 'null']
+    if options:
+        # A union only constrains values when every alternative is an enum
+        enums = [o.get('enum') for o in options]
+        if all(enums):
+            return {'type': options[0].get('type'), 'enum': sum(enums, [])}
+        return {'type': 'object' if len(options) > 1 else options[0].get('type')}
+    param = {'type': prop.get('type')}
+    for name in ('enum', 'minimum', 'maximum'):
+        if name in prop:
+            param[name] = prop[name]
+    return param
+
+
+def _max_megapixels(spec, schema):
+    """Largest custom image_size (width x height bounds) in megapixels, or None."""
+    prop = _resolve(spec, schema.get('properties', {}).get('image_size', {}))
+    for option in [prop] + [_resolve(spec, o) for o in prop.get('anyOf') or prop.get('oneOf') or []]:
+        dims = option.get('properties', {})
+        width = _resolve(spec, dims.get('width', {})).get('maximum')
+        height = _resolve(spec, dims.get('height', {})).get('maximum')
+        if width and height:
+            return width * height / 1e6
+    return None
+
+
+def parse_openapi(spec, model):
+    """Extract the capabilities of model from fal's OpenAPI description of it."""
+    paths = spec.get('paths', {})
+    post = (paths.get(f"/{model}") or {}).get('post')
+    if post is None:
+        post = next((p['post'] for p in paths.values() if 'post' in p), None)
+    if post is None:
+        raise ValueError(f"No submit operation for {model} in its OpenAPI description")
+    body = post.get('requestBody', {}).get('content', {}).get('application/json', {})
+    schema = _resolve(spec, body.get('schema', {}))
+    outputs = []
+    for path, item in paths.items():
+        if path.endswith('/requests/{request_id}') and 'get' in item:
+            response = item['get'].get('responses', {}).get('200', {})
+            result = response.get('content', {}).get('application/json', {})
+            outputs = sorted(_resolve(spec, result.get('schema', {})).get('properties', {}))
+            break
+    if not schema.get('properties'):
+        raise ValueError(f"No input parameters for {model} in its OpenAPI description")
+    caps = {
+        'inputs': {name: _parameter(spec, prop) for name, prop in schema['properties'].items()},
+        'required': list(schema.get('required', [])),
+        'outputs': outputs,
+    }
+    megapixels = _max_megapixels(spec, schema)
+    if megapixels:
+        caps['max_megapixels'] = megapixels
+    return caps
+
+
+def _fetch(settings, model):
+    """Download and parse the OpenAPI description of model; None if unavailable."""
+    url = settings.get('model_registry_url', OPENAPI_URL)
+    if not url:
+        return None
+    import http_session
+    try:
+        response = http_session.get_client(settings).get(url.format(model=model), timeout=10.0)
+        response.raise_for_status()
+        return parse_openapi(response.json(), model)
+    except Exception as e:
+        print(f"Could not fetch the schema of {model}: {e}", file=sys.stderr)
+        return None
+
+
+def capabilities(settings, model, fetch=True):
+    """Return {'inputs', 'required', 'outputs', 'max_megapixels'} for model, or None if unknown.
+
+    A missing or stale registry entry is refreshed from fal when fetch is true (at most
+    once per process and model); otherwise the stored or bundled schema is used as is.
+    """
+    registry = read_json(REGISTRY_PATH, {})
+    if registry.get('version') != REGISTRY_VERSION:
+        registry = {'version': REGISTRY_VERSION, 'models': {}}
+    entry = registry['models'].get(model)
+    ttl = float(settings.get('model_registry_ttl_hours', 168)) * 3600
+    stale = entry is None or time.time() - entry.get('fetched', 0) >= ttl
+    if stale and fetch and model not in _fetched:
+        _fetched.add(model)
+        caps = _fetch(settings, model)
+        if caps is not None:
+            entry = dict(caps, fetched=time.time())
+            registry['models'][model] = entry
+            write_json(REGISTRY_PATH, registry)
+    bundled = BUNDLED.get(model, {})
+    caps = entry or bundled
+    if not caps:
+        return None
+    # The user's override first, then the fetched schema, then the bundled one
+    budget = settings.get('model_max_megapixels', {}).get(
+        model, caps.get('max_megapixels') or bundled.get('max_megapixels'))
+    return dict(caps, max_megapixels=budget)
+
+
+def maximum(settings, model, name, default=None):
+    """Return the upper bound of the model's parameter name, or default if it has none."""
+    caps = capabilities(settings, model, fetch=False)
+    param = caps['inputs'].get(name, {}) if caps else {}
+    return param.get('maximum', default)
+
+
+def takes_mask(settings, model):
+    """True if model accepts an inpainting mask, per its schema or the 'mask_models' setting."""
+    caps = capabilities(settings, model, fetch=False)
+    if caps is not None and 'mask_url' in caps['inputs']:
+        return True
+    return model in settings.get('mask_models', [])
+
+
+def _check(model, name, value, param):
+    """Return value converted to the schema's enum type, or raise RuntimeError."""
+    enum = param.get('enum')
+    if enum:
+        for choice in enum:
+            if str(choice) == str(value):
+                return choice
+        raise RuntimeError(
+            f"{model} does not accept {name}={value!r}; expected one of "
+            f"{', '.join(str(c) for c in enum)}"
+        )
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        low, high = param.get('minimum'), param.get('maximum')
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise RuntimeError(f"{model} needs {name} between {low} and {high}, got {value}")
+    return value
+
+
+def prepare_args(settings, model, args, fetch=True):
+    """Return the subset of args model accepts, validated against its schema.
+
+    None values are dropped (the model's defaults apply), except for the input URL
+    placeholders process_image fills in after uploading. Unknown models get every
+    non-None argument. Raises RuntimeError for values the model would reject.
+    """
+    args = {k: v for k, v in args.items() if v is not None or k in URL_ARGS}
+    caps = capabilities(settings, model, fetch)
+    if caps is None:
+        return args
+    if caps['outputs'] and not {'images', 'image'} & set(caps['outputs']):
+        raise RuntimeError(f"{model} returns {', '.join(caps['outputs'])}, not images")
+    inputs = caps['inputs']
+    accepted, dropped = {}, []
+    for name, value in args.items():
+        if name == 'image_url' and name not in inputs and 'image_urls' in inputs:
+            accepted[name] = value  # Sent as a one-element image_urls, see finalize_args
+        elif name not in inputs:
+            dropped.append(name)
+        else:
+            accepted[name] = value if value is None else _check(model, name, value, inputs[name])
+    if dropped:
+        print(f"Not sending parameters {model} does not accept: {', '.join(dropped)}",
+              file=sys.stderr)
+    for name in caps['required']:
+        if name not in accepted and not (name == 'image_urls' and 'image_url' in accepted):
+            what = 'an input image' if name in ('image_url', 'image_urls') else f"'{name}'"
+            raise RuntimeError(f"{model} requires {what}")
+    return accepted
+
+
+def finalize_args(settings, model, args):
+    """Send the uploaded image_url as image_urls to models that take a list of inputs."""
+    caps = capabilities(settings, model, fetch=False)
+    if caps is None or 'image_url' not in args or 'image_url' in caps['inputs']:
+        return args
+    args = dict(args)
+    args['image_urls'] = [args.pop('image_url')]
+    return args
@@ -0,0 +1,135 @@
+"""
+Latency-aware execution policy for queued requests.
+
+A rolling history of request latencies per model (CONFIG_DIR/latency.json)
+drives three decisions in process_image:
+
+- hedging: a request still running past the 'hedge_percentile' of its model's
+  history gets one duplicate submission, and whichever finishes first wins
+  (opt-in, since both are billed; capped by 'hedge_max_per_hour'),
+- timeouts: requests running 'request_timeout_factor' times the p95 are
+  cancelled and retried with jittered backoff,
+- a circuit breaker: after 'circuit_failures' consecutive failures a model is
+  not called for 'circuit_cooldown_s' seconds.
+
+The state is shared by all plug-in processes, which usually live for one run.
+"""
+
+import random
+import threading
+import time
+
+import httpx
+
+from downloads import RETRY_STATUS
+from settings import CONFIG_DIR, read_json, write_json
+
+STATE_PATH = CONFIG_DIR / 'latency.json'
+HISTORY_SIZE = 100
+MIN_SAMPLES = 10
+
+_lock = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a model that failed repeatedly just before."""
+
+
+class RequestTimeout(RuntimeError):
+    """Raised when a request runs far longer than its model's history suggests."""
+
+
+def _update(model, change):
+    """Apply change(entry) to the model's state under the lock and save it."""
+    with _lock:
+        state = read_json(STATE_PATH, {})
+        entry = state.setdefault(model, {'latency': [], 'failures': 0, 'opened': 0, 'hedges': []})
+        change(entry)
+        write_json(STATE_PATH, state)
+
+
+def _entry(model):
+    return read_json(STATE_PATH, {}).get(model) or {}
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def hedge_after(settings, model):
+    """Seconds after which a request gets a hedged duplicate, or None."""
+    if not settings.get('hedge_enabled', False):
+        return None
+    history = _entry(model).get('latency', [])
+    if len(history) < MIN_SAMPLES:
+        return None
+    return _percentile(history, float(settings.get('hedge_percentile', 95)))
+
+
+def request_timeout(settings, model):
+    """Seconds after which a request is abandoned and retried, or None without enough history."""
+    factor = float(settings.get('request_timeout_factor', 4.0))
+    history = _entry(model).get('latency', [])
+    if not factor or len(history) < MIN_SAMPLES:
+        return None
+    return max(float(settings.get('request_timeout_min_s', 120)), factor * _percentile(history, 95))
+
+
+def allow_hedge(settings, model):
+    """Reserve a hedge if the hourly cap allows one; returns True if it may be sent."""
+    cap = int(settings.get('hedge_max_per_hour', 10))
+    allowed = []
+
+    def _reserve(entry):
+        now = time.time()
+        entry['hedges'] = [t for t in entry.get('hedges', []) if now - t < 3600]
+        if len(entry['hedges']) < cap:
+            entry['hedges'].append(now)
+            allowed.append(True)
+
+    _update(model, _reserve)
+    return bool(allowed)
+
+
+def check_circuit(settings, model):
+    """Raise CircuitOpenError while the model's breaker is open."""
+    entry = _entry(model)
+    limit = int(settings.get('circuit_failures', 5))
+    if not limit or entry.get('failures', 0) < limit:
+        return
+    left = entry.get('opened', 0) + float(settings.get('circuit_cooldown_s', 120)) - time.time()
+    if left > 0:
+        raise CircuitOpenError(
+            f"{model} failed {entry['failures']} times in a row; not retrying for {left:.0f} s")
+
+
+def record_success(model, seconds):
+    """Add a completed request's latency to the history and close the breaker."""
+    def _success(entry):
+        entry['latency'] = (entry.get('latency', []) + [round(seconds, 3)])[-HISTORY_SIZE:]
+        entry['failures'] = 0
+    _update(model, _success)
+
+
+def record_failure(model):
+    """Count a failed request; the breaker opens (again) with every failure past the limit."""
+    def _failure(entry):
+        entry['failures'] = entry.get('failures', 0) + 1
+        entry['opened'] = time.time()
+    _update(model, _failure)
+
+
+def is_transient(error):
+    """True for failures worth retrying: timeouts, connection errors and 5xx/429 responses."""
+    if isinstance(error, RequestTimeout):
+        return True
+    cause = error if isinstance(error, httpx.HTTPError) else error.__cause__
+    if isinstance(cause, httpx.HTTPStatusError):
+        return cause.response.status_code in RETRY_STATUS
+    return isinstance(cause, httpx.TransportError)
+
+
+def backoff(attempt, base=1.0):
+    """Jittered exponential delay before retry number attempt (from 0)."""
+    return base * (2 ** attempt) * (0.5 + random.random())
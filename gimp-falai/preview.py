@@ -0,0 +1,133 @@
+"""
+Live low-resolution previews inside the prompt dialog.
+
+While the prompt is edited, a debounced request runs on a downscaled copy of
+the input (optionally on a faster model variant, see 'preview_models') and
+its result is shown as a thumbnail. Only the newest request is kept: editing
+again cancels the one in flight. The full-resolution job still runs on OK.
+"""
+
+import threading
+
+from gi.repository import GdkPixbuf, Gimp, GLib, Gtk, Pango
+
+import utils
+
+
+class PreviewPane:
+    """Preview controls and thumbnails for a prompt dialog.
+
+    get_request() is called on the main thread when a preview is due and
+    returns (settings, prompt) for the current dialog state; get_region(settings)
+    returns the (x, y, width, height) of the drawable to preview, or None for
+    text-to-image.
+    """
+
+    def __init__(self, drawable, conf, get_request, get_region):
+        self._drawable = drawable
+        self._get_request = get_request
+        self._get_region = get_region
+        self._debounce_ms = int(conf.get('preview_debounce_ms', 800))
+        self._size = int(conf.get('preview_size', 512))
+        self._timer = None
+        self._cancel = None
+        self._generation = 0
+
+        self.widget = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+        self._toggle = Gtk.CheckButton(label="Live preview (low resolution)")
+        self._toggle.set_active(conf.get('preview_enabled', False))
+        self._toggle.connect('toggled', lambda button: self.schedule())
+        self._label = Gtk.Label(label="", halign=Gtk.Align.START)
+        self._label.set_ellipsize(Pango.EllipsizeMode.END)
+        self._thumbs = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.widget.pack_start(self._toggle, False, False, 0)
+        self.widget.pack_start(self._label, False, False, 0)
+        self.widget.pack_start(self._thumbs, False, False, 0)
+
+    @property
+    def enabled(self):
+        return self._toggle.get_active()
+
+    def schedule(self):
+        """(Re)start the debounce timer; the preview fires once editing pauses."""
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        if self.enabled:
+            self._timer = GLib.timeout_add(self._debounce_ms, self._fire)
+
+    def close(self):
+        """Stop pending and running previews (on OK or Cancel)."""
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        if self._cancel is not None:
+            self._cancel.set()
+        self._generation += 1
+
+    def _fire(self):
+        self._timer = None
+        conf, prompt = self._get_request()
+        if not prompt:
+            return False
+        if self._cancel is not None:
+            self._cancel.set()
+        self._cancel = threading.Event()
+        self._generation += 1
+
+        # Drafts would crowd real results out of the history
+        conf = dict(conf, num_images=1, history_enabled=False)
+        conf['model'] = conf.get('preview_models', {}).get(conf.get('model')) or conf.get('model')
+        inputs = {}
+        try:
+            region = self._get_region(conf) if self._drawable is not None else None
+            if region:
+                # Pixels are read on the main thread; the request runs on a worker
+                scale = min(1.0, self._size / max(region[2], region[3]))
+                image_url, input_data, input_key = utils.prepare_input(
+                    self._drawable, conf, region, scale)
+                inputs = {'image_url': image_url, 'input_data': input_data, 'input_key': input_key}
+        except Exception as e:
+            self._label.set_text(f"Preview unavailable: {e}")
+            return False
+
+        self._label.set_text("Generating preview...")
+        thread = threading.Thread(
+            target=self._work, args=(self._generation, self._cancel, conf, prompt, inputs),
+            name="falai-preview", daemon=True)
+        thread.start()
+        return False
+
+    def _work(self, generation, cancel, conf, prompt, inputs):
+        import falai_wrapper
+        try:
+            paths = falai_wrapper.process_image(conf, prompt, cancel=cancel, **inputs)
+        except falai_wrapper.CancelledError:
+            return
+        except Exception as e:
+            GLib.idle_add(self._show_error, generation, str(e))
+            return
+        GLib.idle_add(self._show, generation, paths)
+
+    def _show(self, generation, paths):
+        import falai_wrapper
+        try:
+            if generation != self._generation:
+                return False  # Superseded by a newer preview
+            for child in self._thumbs.get_children():
+                self._thumbs.remove(child)
+            for path in paths:
+                pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, 192, 192, True)
+                self._thumbs.pack_start(Gtk.Image.new_from_pixbuf(pixbuf), False, False, 0)
+            self._thumbs.show_all()
+            self._label.set_text("Preview ready; OK runs at full resolution")
+        except Exception as e:
+            Gimp.message(f"[fal.ai] Could not show preview: {e}")
+        finally:
+            falai_wrapper.discard_outputs(paths)
+        return False
+
+    def _show_error(self, generation, text):
+        if generation == self._generation:
+            self._label.set_text(f"Preview failed: {text}")
+        return False
@@ -0,0 +1,97 @@
+"""
+On-disk cache of generated outputs for deterministic (fixed seed) requests.
+
+Results are keyed on the model plus a canonical form of the arguments, with the
+input image identified by its content hash rather than its (changing) upload URL.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from settings import CONFIG_DIR, read_json, write_json
+
+RESULTS_DIR = CONFIG_DIR / 'results'
+INDEX_PATH = RESULTS_DIR / 'index.json'
+
+# Batch workers read, change and rewrite the index concurrently
+_lock = threading.Lock()
+
+# Arguments that change how results are delivered, not what is generated
+TRANSPORT_ARGS = ('sync_mode',)
+
+
+def cache_key(model, args, input_key=None, mask_key=None):
+    """Return a canonical hash of model + arguments, or None if the request is not deterministic."""
+    if args.get('seed') is None:
+        return None
+    return request_key(model, args, input_key, mask_key)
+
+
+def request_key(model, args, input_key=None, mask_key=None):
+    """Return a canonical hash of model + arguments, whether or not the seed is fixed."""
+    normalized = {
+        k: v for k, v in args.items()
+        if v is not None and k not in TRANSPORT_ARGS
+    }
+    if input_key and 'image_url' in args:
+        normalized['image_url'] = f"sha:{input_key}"
+    if mask_key and 'mask_url' in args:
+        normalized['mask_url'] = f"sha:{mask_key}"
+    payload = json.dumps([model, normalized], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def lookup(key):
+    """Return the cached output paths for key, or None on a miss."""
+    with _lock:
+        index = read_json(INDEX_PATH, {})
+        entry = index.get(key)
+        if entry is None:
+            return None
+        paths = [str(RESULTS_DIR / key / name) for name in entry['files']]
+        if not all(os.path.isfile(p) for p in paths):
+            # Files were removed behind our back; forget the entry
+            del index[key]
+            write_json(INDEX_PATH, index)
+            return None
+        entry['last_used'] = time.time()
+        write_json(INDEX_PATH, index)
+        return paths
+
+
+def is_cached(path):
+    """Return True if path lives inside the result cache (and must not be deleted by callers)."""
+    return os.path.abspath(path).startswith(os.path.abspath(RESULTS_DIR) + os.sep)
+
+
+def store(key, paths, settings):
+    """Copy downloaded outputs into the cache; the original files stay with the caller."""
+    entry_dir = RESULTS_DIR / key
+    os.makedirs(entry_dir, exist_ok=True)
+    files, size = [], 0
+    for i, path in enumerate(paths):
+        name = f"{i}{os.path.splitext(path)[1]}"
+        shutil.copyfile(path, entry_dir / name)
+        files.append(name)
+        size += os.path.getsize(path)
+    with _lock:
+        index = read_json(INDEX_PATH, {})
+        index[key] = {'files': files, 'size': size, 'last_used': time.time()}
+        _evict(index, settings.get('result_cache_max_mb', 500) * 1024 * 1024, keep=key)
+        write_json(INDEX_PATH, index)
+
+
+def _evict(index, max_bytes, keep):
+    """Remove least recently used entries until the cache fits into max_bytes."""
+    total = sum(e['size'] for e in index.values())
+    for key in sorted(index, key=lambda k: index[k]['last_used']):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        total -= index.pop(key)['size']
+        shutil.rmtree(RESULTS_DIR / key, ignore_errors=True)
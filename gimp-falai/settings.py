@@ -4,6 +4,7 @@ Persistent settings for the fal.ai GIMP plugin.
 
 import os
 import json
+import tempfile
 # Configuration directory and file (uses XDG_CONFIG_HOME on Unix, APPDATA on Windows)
 from pathlib import Path
 
@@ -27,6 +28,109 @@ DEFAULT_SETTINGS = {
     "aspect_ratio": "1:1",
     "sync_mode": True,
     "api_key": "",
+    # Several fal accounts, used instead of api_key when set: a list of
+    # {"name", "key", "max_concurrent", "requests_per_minute"} (0: unlimited). Requests
+    # are spread over the keys within their limits; a key answering 429 rests for the
+    # server's Retry-After or key_backoff_s, doubling while it keeps failing (see keypool.py)
+    "api_keys": [],
+    "key_backoff_s": 30,
+    # Encoding of the input layer before upload: "png", "webp" (lossless) or "jpeg"
+    "upload_format": "png",
+    "png_compress_level": 1,
+    "jpeg_quality": 92,
+    # Inputs from multipart_threshold_mb up are sent as parallel parts that resume
+    # after interruptions (0: always a single request)
+    "multipart_threshold_mb": 20,
+    "multipart_part_mb": 10,
+    "multipart_concurrency": 4,
+    "upload_retries": 3,
+    # Reuse fal CDN URLs of previously uploaded, unchanged inputs
+    "upload_cache_ttl_hours": 24,
+    "upload_cache_max_entries": 200,
+    # Reuse outputs of identical fixed-seed generations
+    "use_result_cache": True,
+    "result_cache_max_mb": 500,
+    # Result images are fetched concurrently over one keep-alive connection pool
+    "download_workers": 4,
+    "download_retries": 3,
+    # Batch mode: jobs in flight at once and queue submissions per second
+    "batch_concurrency": 4,
+    "batch_submit_rate": 2.0,
+    # Batch layers that are near-duplicates (animation holds, static backgrounds) are
+    # generated once and the result reused: frames whose perceptual hashes differ by at
+    # most frame_dedup_threshold bits (of 256) and whose thumbnails differ by at most
+    # frame_dedup_tolerance levels per pixel
+    "frame_dedup": True,
+    "frame_dedup_threshold": 4,
+    "frame_dedup_tolerance": 3.0,
+    # Execution policy (see policy.py): retries with backoff, a timeout at
+    # request_timeout_factor x the model's p95 latency, a per-model circuit breaker, and
+    # optional hedging: one duplicate request past hedge_percentile (billed as well)
+    "request_retries": 2,
+    "request_timeout_factor": 4.0,
+    "request_timeout_min_s": 120,
+    "circuit_failures": 5,
+    "circuit_cooldown_s": 120,
+    "hedge_enabled": False,
+    "hedge_percentile": 95,
+    "hedge_max_per_hour": 10,
+    # Identical requests running at the same time (double clicks, repeated batch inputs,
+    # other GIMP windows) share one fal request and its outputs
+    "dedup_inflight": True,
+    # Submitted requests are journaled until their results are retrieved, so
+    # "Collect Pending Results" can fetch them after a crash; entries expire after this
+    "job_journal_ttl_hours": 24,
+    # Inputs above the model's pixel budget (from its schema, or model_max_megapixels
+    # per endpoint) are downscaled before upload; this budget applies to models
+    # without one (0: never downscale them)
+    "max_input_megapixels": 0,
+    "model_max_megapixels": {},
+    # Split large layers into overlapping tiles instead of downscaling them
+    "tile_mode": False,
+    "tile_size": 1024,
+    "tile_overlap": 128,
+    # With a selection, only its bounding box plus a context margin is processed and the
+    # result is masked to the selection; models whose schema takes mask_url (or listed in
+    # mask_models) also receive it as the inpainting mask
+    "use_selection": True,
+    "selection_margin": 64,
+    "mask_models": [
+        "fal-ai/flux-pro/v1/fill",
+        "fal-ai/flux-lora/inpainting",
+        "fal-ai/flux-general/inpainting",
+    ],
+    # Generated results are kept in the history (history/ in the config directory) and
+    # can be re-imported from "fal.ai History..." without a new request; the oldest
+    # entries are evicted beyond either limit
+    "history_enabled": True,
+    "history_max_entries": 500,
+    "history_max_mb": 1000,
+    # Model parameter schemas (models.json in the config directory) are refreshed from
+    # fal's OpenAPI description after this many hours; an empty URL disables fetching
+    "model_registry_ttl_hours": 168,
+    "model_registry_url": "https://fal.ai/api/openapi/queue/openapi.json?endpoint_id={model}",
+    # Live preview in the prompt dialog: edge length of the downscaled input, delay
+    # after the last keystroke, and faster model variants to use per model endpoint
+    "preview_enabled": False,
+    "preview_size": 512,
+    "preview_debounce_ms": 800,
+    "preview_models": {},
+    # Shared HTTP connection pool for uploads, queue polling and downloads;
+    # http2 is used when the h2 package is installed, http_proxy overrides HTTPS_PROXY
+    "http_timeout": 30.0,
+    "http_read_timeout": 120.0,
+    "http_max_connections": 16,
+    "http2": True,
+    "http_proxy": "",
+    # Per-stage timing spans appended to trace.jsonl in the config directory
+    # (summarise with `python3 tracing.py`); rotated above trace_max_mb
+    "trace_enabled": True,
+    "trace_max_mb": 10,
+    # Show uploaded URLs, request arguments and result counts as [DEBUG] messages
+    "debug": False,
+    # Override fal.ai endpoints, e.g. to point at scripts/fake_fal_server.py
+    "fal_queue_url": "",
+    "fal_rest_url": "",
 }
 
 
@@ -37,7 +141,8 @@ def load_settings():
         save_settings(DEFAULT_SETTINGS)
         return DEFAULT_SETTINGS.copy()
     with open(CONFIG_PATH, "r") as f:
-        return json.load(f)
+        # Fill in keys added since the file was written
+        return {**DEFAULT_SETTINGS, **json.load(f)}
 
 
 def save_settings(settings):
@@ -45,3 +150,29 @@ def save_settings(settings):
     os.makedirs(CONFIG_DIR, exist_ok=True)
     with open(CONFIG_PATH, "w") as f:
         json.dump(settings, f, indent=2)
+
+
+def read_json(path, default):
+    """Read a JSON state file from the config directory, returning default if missing or corrupt."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """Atomically write a JSON state file so concurrent plug-in processes never see partial files."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A unique temp file per call: threads of one process may write the same file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
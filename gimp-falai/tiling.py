@@ -0,0 +1,75 @@
+"""
+Tiling of very large inputs into overlapping tiles and feathered re-blending.
+
+Used when a layer is too big to send in one piece: each tile is generated
+separately (concurrently, through the batch scheduler) and the results are
+blended back with linear weight ramps across the overlaps so no seams show.
+Blending needs Pillow and NumPy.
+"""
+
+import tempfile
+
+
+def _starts(length, tile, overlap):
+    """Tile start positions covering length with at least overlap pixels shared."""
+    if length <= tile:
+        return [0]
+    step = tile - overlap
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)  # Last tile flush with the edge
+    return starts
+
+
+def plan_tiles(width, height, tile=1024, overlap=128):
+    """Return (x, y, width, height) tiles covering the area, overlapping by overlap."""
+    overlap = max(0, min(overlap, tile // 2))
+    return [
+        (x, y, min(tile, width), min(tile, height))
+        for y in _starts(height, tile, overlap)
+        for x in _starts(width, tile, overlap)
+    ]
+
+
+def _ramp(np, length, overlap, fade_in, fade_out):
+    """1-D weights: 1 inside, ramping down towards edges that overlap a neighbour."""
+    weights = np.ones(length, dtype=np.float32)
+    n = min(overlap, length)
+    if n > 0:
+        ramp = (np.arange(n, dtype=np.float32) + 0.5) / n
+        if fade_in:
+            weights[:n] = np.minimum(weights[:n], ramp)
+        if fade_out:
+            weights[-n:] = np.minimum(weights[-n:], ramp[::-1])
+    return weights
+
+
+def blend_tiles(tiles, size, overlap):
+    """Blend generated tiles back into one image and return the path of a temporary PNG.
+
+    tiles is a list of ((x, y, width, height), path) with the tile's place in the
+    output; each result is resized to its tile first, since models may return a
+    different resolution.
+    """
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("Tiled processing requires Pillow and NumPy")
+
+    width, height = size
+    acc = np.zeros((height, width, 4), dtype=np.float32)
+    total = np.zeros((height, width, 1), dtype=np.float32)
+    for (x, y, w, h), path in tiles:
+        with Image.open(path) as img:
+            pixels = np.asarray(img.convert('RGBA').resize((w, h), Image.LANCZOS), dtype=np.float32)
+        weight = np.outer(
+            _ramp(np, h, overlap, y > 0, y + h < height),
+            _ramp(np, w, overlap, x > 0, x + w < width),
+        )[..., None]
+        acc[y:y + h, x:x + w] += pixels * weight
+        total[y:y + h, x:x + w] += weight
+    out = (acc / np.maximum(total, 1e-6)).round().clip(0, 255).astype(np.uint8)
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
+        out_path = tmp.name
+    Image.fromarray(out, 'RGBA').save(out_path, compress_level=1)
+    return out_path
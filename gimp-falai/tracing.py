@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Low-overhead timing spans for every stage of a generation.
+
+Spans (export, upload, submit, queue, inference, download, import, ...) are
+buffered in memory and appended as JSON lines to CONFIG_DIR/trace.jsonl when a
+run ends, so tracing can stay on by default. Run this module for a summary:
+
+    python3 gimp-falai/tracing.py --runs 20
+"""
+
+import argparse
+import atexit
+import json
+import os
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from settings import CONFIG_DIR
+
+TRACE_PATH = CONFIG_DIR / 'trace.jsonl'
+
+_lock = threading.Lock()
+_pending = []
+_state = {'enabled': True, 'max_bytes': 10 * 1024 * 1024, 'run': None}
+
+
+def begin_run(settings, kind, **attrs):
+    """Start a traced run; spans recorded until the next begin_run belong to it."""
+    _state['enabled'] = settings.get('trace_enabled', True)
+    _state['max_bytes'] = float(settings.get('trace_max_mb', 10)) * 1024 * 1024
+    _state['run'] = uuid.uuid4().hex[:12]
+    record('run', time.time(), 0.0, kind=kind, model=settings.get('model'), **attrs)
+    return _state['run']
+
+
+def end_run():
+    """Write the spans of the current run to the trace log."""
+    flush()
+    _state['run'] = None
+
+
+def record(name, start, seconds, **attrs):
+    """Record a span that started at wall time start and lasted seconds."""
+    if not _state['enabled']:
+        return
+    entry = {'run': _state['run'], 'span': name, 'ts': round(start, 3),
+             'ms': round(seconds * 1000, 2), **attrs}
+    with _lock:
+        _pending.append(entry)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as one span. The yielded dict holds the span's
+    attributes and can be extended inside the block (e.g. with a byte count).
+    """
+    if not _state['enabled']:
+        yield attrs
+        return
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        record(name, start, time.perf_counter() - t0, **attrs)
+
+
+def flush():
+    """Append buffered spans to the trace log, rotating it when it grows too large."""
+    with _lock:
+        entries = _pending[:]
+        del _pending[:]
+    if not entries:
+        return
+    try:
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        if os.path.isfile(TRACE_PATH) and os.path.getsize(TRACE_PATH) > _state['max_bytes']:
+            os.replace(TRACE_PATH, f"{TRACE_PATH}.1")
+        # One write per flush keeps lines from concurrent plug-in processes intact
+        with open(TRACE_PATH, 'a') as f:
+            f.write(''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in entries))
+    except OSError:
+        pass  # Tracing must never break a generation
+
+
+atexit.register(flush)
+
+
+def read_runs(path=TRACE_PATH):
+    """Return {run id: [span, ...]} from the trace log, in file order."""
+    runs = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                runs.setdefault(entry.get('run'), []).append(entry)
+    except OSError:
+        pass
+    return runs
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summary(runs):
+    """Return {stage: {'count', 'p50', 'p95', 'max', 'total'}} in milliseconds."""
+    stages = {}
+    for spans in runs.values():
+        for s in spans:
+            if s['span'] != 'run':
+                stages.setdefault(s['span'], []).append(s['ms'])
+    return {
+        name: {
+            'count': len(ms),
+            'p50': statistics.median(ms),
+            'p95': _percentile(ms, 95),
+            'max': max(ms),
+            'total': sum(ms),
+        }
+        for name, ms in stages.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the fal.ai plug-in trace log.")
+    parser.add_argument('--runs', type=int, default=0, help='only the last N runs (0: all)')
+    parser.add_argument('--path', default=str(TRACE_PATH))
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    opts = parser.parse_args()
+
+    runs = {k: v for k, v in read_runs(opts.path).items() if k is not None}
+    if opts.runs:
+        runs = dict(list(runs.items())[-opts.runs:])
+    stats = summary(runs)
+    if opts.json:
+        print(json.dumps({'runs': len(runs), 'stages': stats}, indent=2))
+        return
+    print(f"{len(runs)} runs from {opts.path}")
+    print(f"{'stage':<12} {'count':>6} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10} {'total s':>9}")
+    for name, st in sorted(stats.items(), key=lambda kv: -kv[1]['total']):
+        print(f"{name:<12} {st['count']:>6} {st['p50']:>10.1f} {st['p95']:>10.1f} "
+              f"{st['max']:>10.1f} {st['total'] / 1000:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,18 +2,123 @@
 UI dialogs for fal.ai GIMP plugin (settings and prompt interfaces).
 """
 
-from gi.repository import GimpUi, Gtk, Gimp, GLib
+from gi.repository import GimpUi, Gtk, Gimp, GLib, Gio
 
-import tempfile
 import os
 import utils
 
-import falai_wrapper
+import models
 import settings
+import tracing
+import worker
+
+# content (NumPy), batch and falai_wrapper (fal_client/httpx) are imported inside
+# the functions that need them, so opening a dialog never waits for them.
 
 def show_settings_dialog(settings):
     pass
 
+
+def _layer_content_bbox(layer):
+    """Return the bounding box of the layer's non-transparent pixels, or None if it is empty."""
+    if layer is None:
+        return None
+    w, h = layer.get_width(), layer.get_height()
+    if w == 0 or h == 0:
+        return None
+    if not layer.has_alpha():
+        return (0, 0, w, h)  # Opaque layer definitely has content
+    import content
+    try:
+        return content.content_bbox(*utils.read_pixels(layer))
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Error checking layer content: {e}")
+        return (0, 0, w, h)  # Assume it has content if we can't check
+
+def _input_region(image, drawable, conf):
+    """Return (region, masked): the part of the drawable to send and whether it is
+    the selection. The region is the selection (plus some surrounding context) if
+    there is one, otherwise the non-transparent part of the layer; None means the
+    layer is empty. The layer's pixels are only scanned without a selection.
+    """
+    if drawable is not None and conf.get('use_selection', True):
+        selected = utils.selection_region(image, drawable, conf.get('selection_margin', 64))
+        if selected:
+            return selected, True
+    return _layer_content_bbox(drawable), False
+
+def _group_duplicate_layers(layers, regions, conf):
+    """Return, for each layer, the index of the layer whose result it can reuse:
+    an earlier layer whose content region it nearly duplicates, or its own index.
+    """
+    import framehash
+    frames, indices = [], []
+    for i, (layer, region) in enumerate(zip(layers, regions)):
+        if region is None:
+            continue
+        try:
+            pixels = utils.read_pixels(layer, region, framehash.sample_scale(*region[2:]))
+        except Exception as e:
+            Gimp.message(f"[fal.ai] Could not compare {layer.get_name()}: {e}")
+            continue
+        frames.append((tuple(region[2:]), pixels))
+        indices.append(i)
+    groups = list(range(len(layers)))
+    reps = framehash.group_frames(frames, int(conf.get('frame_dedup_threshold', 4)),
+                                  float(conf.get('frame_dedup_tolerance', 3.0)))
+    for i, rep in zip(indices, reps):
+        groups[i] = indices[rep]
+    return groups
+
+def _insert_result(image, path, offsets=None, above=None, name=None, size=None, masked=False,
+                   scale=None):
+    """Import a result as a new layer, falling back to opening it as a new image."""
+    try:
+        utils.import_image(image, path, offsets, above, name, size, masked, scale)
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Could not import layer, opening as new image. Error: {e}")
+        try:
+            _open_result(path)
+        except Exception as e2:
+            Gimp.message(f"[fal.ai] Failed to open as new image: {e2}")
+
+def _result_target(image, offsets=None, size=None, name=None, above=None, scale=None):
+    """Describe where results go for the job journal, so a later session can find the image."""
+    file = image.get_file()
+    return {
+        'kind': 'layer',
+        'image': image.get_id(),
+        'image_name': image.get_name(),
+        'file': file.get_path() if file else None,
+        'offsets': list(offsets) if offsets else None,
+        'size': list(size) if size else None,
+        'scale': scale,
+        'name': name,
+        'above': above.get_name() if above else None,
+    }
+
+
+def _find_target_image(target):
+    """Return the open image a journaled result belongs to, or None."""
+    if target.get('file'):
+        for image in Gimp.get_images():
+            file = image.get_file()
+            if file and file.get_path() == target['file']:
+                return image
+        return None
+    # Unsaved image: IDs restart with GIMP, so the name has to match as well
+    image = Gimp.Image.get_by_id(target['image']) if target.get('image') else None
+    if image and image.is_valid() and image.get_name() == target.get('image_name'):
+        return image
+    return None
+
+
+def _open_result(path):
+    new_img = Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(path))
+    Gimp.Display.new(new_img)
+    return new_img
+
+
 def show_prompt_dialog(image, drawable):
     """
     Display the main run dialog which includes all settings.
@@ -108,6 +213,21 @@ def show_prompt_dialog(image, drawable):
     settings_grid.attach(safe_btn, 1, row, 1, 1)
     row += 1
 
+    # Result cache
+    settings_grid.attach(Gtk.Label(label="Result Cache:", halign=Gtk.Align.START), 0, row, 1, 1)
+    # Applies to this run only; the saved 'use_result_cache' setting stays as it is
+    cache_btn = Gtk.CheckButton(label="Bypass cached results for this run")
+    cache_btn.set_active(False)
+    settings_grid.attach(cache_btn, 1, row, 1, 1)
+    row += 1
+
+    # Tiling
+    settings_grid.attach(Gtk.Label(label="Large Layers:", halign=Gtk.Align.START), 0, row, 1, 1)
+    tile_btn = Gtk.CheckButton(label="Process large layers in tiles")
+    tile_btn.set_active(conf.get('tile_mode', False))
+    settings_grid.attach(tile_btn, 1, row, 1, 1)
+    row += 1
+
     # Guidance scale
     settings_grid.attach(Gtk.Label(label="Guidance Scale:", halign=Gtk.Align.START), 0, row, 1, 1)
     guid_adj = Gtk.Adjustment(value=conf.get('guidance_scale', 3.5), lower=0, upper=50, step_increment=0.1, page_increment=1, page_size=0)
@@ -120,13 +240,20 @@ def show_prompt_dialog(image, drawable):
 
     # Num images
     settings_grid.attach(Gtk.Label(label="# Images:", halign=Gtk.Align.START), 0, row, 1, 1)
-    num_adj = Gtk.Adjustment(value=conf.get('num_images', 1), lower=1, upper=10, step_increment=1, page_increment=1, page_size=0)
+    num_max = models.maximum(conf, conf.get('model'), 'num_images', 10)
+    num_adj = Gtk.Adjustment(value=min(conf.get('num_images', 1), num_max), lower=1, upper=num_max, step_increment=1, page_increment=1, page_size=0)
     num_spin = Gtk.SpinButton()
     num_spin.set_adjustment(num_adj)
     num_spin.set_numeric(True)
     settings_grid.attach(num_spin, 1, row, 1, 1)
     row += 1
 
+    # Offer only as many images as the entered model's schema allows
+    def _on_model_changed(entry):
+        num_adj.set_upper(models.maximum(conf, entry.get_text().strip(), 'num_images', 10))
+        num_adj.set_value(min(num_adj.get_value(), num_adj.get_upper()))
+    model_endpoint.connect('changed', _on_model_changed)
+
     # Seed
     settings_grid.attach(Gtk.Label(label="Seed (optional):", halign=Gtk.Align.START), 0, row, 1, 1)
     seed_entry = Gtk.Entry()
@@ -143,6 +270,15 @@ def show_prompt_dialog(image, drawable):
     settings_grid.attach(fmt_combo, 1, row, 1, 1)
     row += 1
 
+    # Upload format
+    settings_grid.attach(Gtk.Label(label="Upload Format:", halign=Gtk.Align.START), 0, row, 1, 1)
+    up_combo = Gtk.ComboBoxText()
+    for f in ['png', 'webp', 'jpeg']:
+        up_combo.append_text(f)
+    _set_combo_text(up_combo, conf.get('upload_format', 'png'))
+    settings_grid.attach(up_combo, 1, row, 1, 1)
+    row += 1
+
     # Safety tolerance
     settings_grid.attach(Gtk.Label(label="Safety Tolerance:", halign=Gtk.Align.START), 0, row, 1, 1)
     tol_combo = Gtk.ComboBoxText()
@@ -160,6 +296,45 @@ def show_prompt_dialog(image, drawable):
     _set_combo_text(ar_combo, conf.get('aspect_ratio', '1:1'))
     settings_grid.attach(ar_combo, 1, row, 1, 1)
 
+    # Update a settings dictionary with all current values from the UI
+    def _collect(target):
+        target['model'] = model_endpoint.get_text().strip()
+        target['prompt'] = entry_prompt.get_text().strip()
+        target['api_key'] = key_entry.get_text().strip()
+        target['sync_mode'] = sync_btn.get_active()
+        target['enable_safety_checker'] = safe_btn.get_active()
+        target['tile_mode'] = tile_btn.get_active()
+        target['guidance_scale'] = guid_spin.get_value()
+        target['num_images'] = num_spin.get_value_as_int()
+        seed_text = seed_entry.get_text().strip()
+        target['seed'] = int(seed_text) if seed_text.isdigit() else None
+        target['output_format'] = fmt_combo.get_active_text()
+        target['upload_format'] = up_combo.get_active_text()
+        target['safety_tolerance'] = tol_combo.get_active_text()
+        target['aspect_ratio'] = ar_combo.get_active_text()
+        return target
+
+    # --- Live preview ---
+    drawable = drawable or image.get_active_layer()
+    import preview
+
+    def _preview_request():
+        request = _collect(dict(conf))
+        return request, request['prompt']
+
+    # The region is found once per selection setting, not at every typing pause
+    preview_regions = {}
+
+    def _preview_region(request):
+        key = (request.get('use_selection', True), request.get('selection_margin', 64))
+        if key not in preview_regions:
+            preview_regions[key] = _input_region(image, drawable, request)[0]
+        return preview_regions[key]
+
+    preview_pane = preview.PreviewPane(drawable, conf, _preview_request, _preview_region)
+    box.pack_start(preview_pane.widget, False, False, 0)
+    entry_prompt.connect('changed', lambda entry: preview_pane.schedule())
+
     # --- Run the dialog ---
     dialog.set_default(ok_button)
     dialog.show_all()
@@ -167,6 +342,7 @@ def show_prompt_dialog(image, drawable):
     Gimp.message("[fal.ai] Dialog shown, waiting for response...")
     response = dialog.run()
     Gimp.message(f"[fal.ai] Dialog response: {response}")
+    preview_pane.close()
 
     if response != Gtk.ResponseType.OK:
         dialog.destroy()
@@ -180,19 +356,8 @@ def show_prompt_dialog(image, drawable):
         dialog.destroy()
         return
 
-    # Update the settings dictionary with all current values from the UI
-    conf['model'] = model_endpoint.get_text().strip()
-    conf['prompt'] = prompt_text
-    conf['api_key'] = key_entry.get_text().strip()
-    conf['sync_mode'] = sync_btn.get_active()
-    conf['enable_safety_checker'] = safe_btn.get_active()
-    conf['guidance_scale'] = guid_spin.get_value()
-    conf['num_images'] = num_spin.get_value_as_int()
-    seed_text = seed_entry.get_text().strip()
-    conf['seed'] = int(seed_text) if seed_text.isdigit() else None
-    conf['output_format'] = fmt_combo.get_active_text()
-    conf['safety_tolerance'] = tol_combo.get_active_text()
-    conf['aspect_ratio'] = ar_combo.get_active_text()
+    _collect(conf)
+    conf['preview_enabled'] = preview_pane.enabled
 
     # --- 3. Save settings to disk for next time ---
     try:
@@ -201,91 +366,528 @@ def show_prompt_dialog(image, drawable):
     except Exception as e:
         Gimp.message(f"[fal.ai] Warning: Could not save settings. Error: {e}")
 
-    # Check if layer has content to determine if we do img2img or txt2img
-    def layer_has_content(layer):
-        if layer is None:
-            return False
-            
-        w, h = layer.get_width(), layer.get_height()
-        if w == 0 or h == 0:
-            return False
-            
-        if not layer.has_alpha():
-            return True # Opaque layer definitely has content
-        
-        try:
-            # Get pixel region
-            pr = layer.get_pixel_rgn(0, 0, w, h, False, False)
-            data = bytearray(pr[0:w, 0:h])
-            bpp = pr.bpp
-
-            # Check alpha channel for any non-transparent pixels
-            for i in range(bpp - 1, len(data), bpp):
-                if data[i] > 0:
-                    return True
-            return False
-        except Exception as e:
-            Gimp.message(f"[fal.ai] Error checking layer content: {e}")
-            return True  # Assume it has content if we can't check
-
-    tmp_input = None
-    drawable = drawable or image.get_active_layer()
-    
     if drawable is None:
         Gimp.message("[fal.ai] No active layer found")
         dialog.destroy()
         return
         
-    try:
-        if layer_has_content(drawable):
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                tmp_input = tmp.name
-            Gimp.message(f"[fal.ai] Exporting layer to: {tmp_input}")
-            utils.export_drawable(drawable, tmp_input)
-        else:
-            Gimp.message("[fal.ai] Active layer is empty; running in text-to-image mode.")
-    except Exception as e:
-        Gimp.message(f"[fal.ai] Could not check or export layer content, running text-to-image. Error: {e}")
-        tmp_input = None
-
     dialog.destroy() # Close the UI before starting the long-running task
 
+    import falai_wrapper
     try:
-        # The `settings` dictionary now contains all params needed.
-        Gimp.progress_init("Running fal.ai generation...")
-        Gimp.message(f"[fal.ai] Starting generation with prompt: {prompt_text}")
-        
-        paths = falai_wrapper.process_image(conf, prompt_text, tmp_input)
-        Gimp.progress_end()
-        
+        paths = run_generation(image, drawable, conf, prompt_text,
+                               use_cache=False if cache_btn.get_active() else None)
         if not paths:
             Gimp.message("[fal.ai] No images returned from fal.ai; check the console for debug info.")
             return
 
         Gimp.message(f"[fal.ai] Received {len(paths)} images")
-        
-        for i, path in enumerate(paths):
-            try:
-                Gimp.progress_update(i / len(paths))
-                utils.import_image(image, path)
-                Gimp.message(f"[fal.ai] Imported image {i+1}/{len(paths)}")
-            except Exception as e:
-                Gimp.message(f"[fal.ai] Could not import layer, opening as new image. Error: {e}")
-                try:
-                    new_img = Gimp.file_load(Gimp.RunMode.NONINTERACTIVE, path)
-                    Gimp.Display.new(new_img)
-                except Exception as e2:
-                    Gimp.message(f"[fal.ai] Failed to open as new image: {e2}")
-                    
+
+    except falai_wrapper.CancelledError:
+        Gimp.message("[fal.ai] Generation cancelled")
     except NotImplementedError as e:
         Gimp.message(f"[fal.ai] Not implemented: {str(e)}")
     except Exception as e:
         Gimp.message(f"[fal.ai] Error during fal.ai processing: {e}")
         import traceback
         Gimp.message(f"[fal.ai] Traceback: {traceback.format_exc()}")
+
+
+def run_generation(image, drawable, conf, prompt_text, interactive=True, use_cache=None):
+    """
+    Run one generation on the drawable and insert the results into image.
+    Interactive runs use a background job with a progress/cancel dialog;
+    non-interactive runs (PDB calls, gimp -i -b) block without any UI.
+    use_cache=False bypasses the result cache for this run only.
+    Returns the result paths, whose files are removed once imported; errors are
+    raised to the caller.
+    """
+    tracing.begin_run(conf, 'run', interactive=interactive)
+    try:
+        return _run_generation(image, drawable, conf, prompt_text, interactive, use_cache)
+    finally:
+        tracing.end_run()
+
+
+def _run_generation(image, drawable, conf, prompt_text, interactive, use_cache=None):
+    import falai_wrapper
+
+    # Check if layer has content to determine if we do img2img or txt2img,
+    # and crop the upload to the part that is not transparent or to the selection
+    input_region = input_offsets = None
+    masked = False
+    try:
+        input_region, masked = _input_region(image, drawable, conf)
+        if masked:
+            Gimp.message(f"[fal.ai] Processing the selection ({input_region[2]}x{input_region[3]} pixels)")
+        if input_region:
+            off_x, off_y = drawable.get_offsets()[-2:]
+            input_offsets = (off_x + input_region[0], off_y + input_region[1])
+        else:
+            Gimp.message("[fal.ai] Active layer is empty; running in text-to-image mode.")
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Could not check layer content, running text-to-image. Error: {e}")
+        input_region = None
+
+    # The `settings` dictionary now contains all params needed.
+    Gimp.message(f"[fal.ai] Starting generation with prompt: {prompt_text}")
+
+    if (input_region and conf.get('tile_mode')
+            and max(input_region[2:]) > conf.get('tile_size', 1024)):
+        return _run_tiled(image, drawable, conf, prompt_text, input_region, input_offsets,
+                          interactive, masked, use_cache)
+
+    # Pixels are read and encoded here, on the main thread; the upload,
+    # generation and downloads run in the background job. Inputs over the
+    # model's pixel budget are downsampled and the results scaled back up.
+    image_url = input_data = input_key = result_size = None
+    mask_url = mask_data = mask_key = None
+    scale = 1.0
+    if input_region:
+        scale = utils.input_scale(conf, *input_region[2:])
+        if scale < 1.0:
+            result_size = input_region[2:]
+            Gimp.message(f"[fal.ai] Downscaling input to {scale:.0%} to fit the model's pixel budget")
+        Gimp.message(f"[fal.ai] Encoding layer as {conf.get('upload_format', 'png')}")
+        image_url, input_data, input_key = utils.prepare_input(drawable, conf, input_region, scale)
+        if masked and utils.supports_mask(conf):
+            mask_url, mask_data, mask_key = utils.prepare_mask(image, drawable, conf, input_region, scale)
+
+    inputs = {
+        'input_data': input_data, 'image_url': image_url, 'input_key': input_key,
+        'mask_data': mask_data, 'mask_url': mask_url, 'mask_key': mask_key,
+        'target': _result_target(image, input_offsets, result_size, scale=scale),
+        'use_cache': use_cache,
+    }
+    imported = []
+
+    def _on_image(index, path):
+        _insert_result(image, path, input_offsets, size=result_size, masked=masked, scale=scale)
+        imported.append(path)
+        Gimp.message(f"[fal.ai] Imported image {len(imported)}")
+
+    if not interactive:
+        # No main loop to marshal to, so results are imported after the call returns
+        paths = falai_wrapper.process_image(conf, prompt_text, **inputs)
+        try:
+            for i, path in enumerate(paths):
+                _on_image(i, path)
+        finally:
+            falai_wrapper.discard_outputs(paths)
+        return paths
+
+    def _generate(job):
+        return falai_wrapper.process_image(
+            conf, prompt_text, **inputs,
+            on_status=job.status, on_image=job.image, cancel=job.cancel_event)
+
+    job = worker.GenerationJob(_generate, on_image=_on_image, title="fal.ai generation")
+    # Every image has been imported once run() returns (see GenerationJob._work)
+    paths = job.run()
+    falai_wrapper.discard_outputs(paths)
+    return paths
+
+
+def _run_tiled(image, drawable, conf, prompt_text, region, offsets, interactive=True,
+               masked=False, use_cache=None):
+    """
+    Generate a large region as overlapping tiles and blend the results into one layer.
+    Tiles run concurrently through the batch scheduler, one image per tile.
+    """
+    import batch
+    import falai_wrapper
+    import tiling
+
+    # Single tiles are not worth recalling
+    tile_conf = dict(conf, num_images=1, history_enabled=False)
+    tile = conf.get('tile_size', 1024)
+    overlap = max(0, min(conf.get('tile_overlap', 128), tile // 2))
+    rx, ry, rw, rh = region
+    tiles = tiling.plan_tiles(rw, rh, tile, overlap)
+    Gimp.message(f"[fal.ai] Processing {rw}x{rh} pixels as {len(tiles)} tiles")
+
+    inputs = []
+    for x, y, w, h in tiles:
+        image_url, input_data, input_key = utils.prepare_input(
+            drawable, tile_conf, (rx + x, ry + y, w, h), utils.input_scale(tile_conf, w, h))
+        inputs.append({'image_url': image_url, 'input_data': input_data, 'input_key': input_key,
+                       'use_cache': use_cache})
+
+    def _generate(job=None):
+        scheduler = batch.BatchScheduler(
+            tile_conf, prompt_text,
+            on_status=job.status if job else None,
+            cancel=job.cancel_event if job else None,
+        )
+        for kwargs in inputs:
+            scheduler.submit(**kwargs)
+        scheduler.close()
+        results = scheduler.wait()
+        try:
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
+                if not result:
+                    raise RuntimeError("fal.ai returned no image for a tile")
+            if job:
+                job.status("Blending tiles", 1.0)
+            return tiling.blend_tiles(
+                [(t, paths[0]) for t, paths in zip(tiles, results)], (rw, rh), overlap)
+        finally:
+            for result in results:
+                if not isinstance(result, Exception):
+                    falai_wrapper.discard_outputs(result)
+
+    if interactive:
+        path = worker.GenerationJob(_generate, title="fal.ai tiled generation").run()
+    else:
+        path = _generate()
+    try:
+        _insert_result(image, path, offsets, name=f"{drawable.get_name()} (fal.ai)", masked=masked)
+    finally:
+        os.remove(path)
+    return [path]
+
+
+def show_batch_dialog(image, drawables):
+    """
+    Run one prompt over all selected layers and/or every image in a folder.
+    Layer results are stacked above their source layer; folder results are
+    written to a 'fal.ai' subfolder.
+    """
+    try:
+        conf = settings.load_settings()
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Could not load settings, using defaults. Error: {e}")
+        conf = dict(settings.DEFAULT_SETTINGS)
+
+    GimpUi.init("python-fu-falai-batch")
+
+    layers = [d for d in (drawables or []) if isinstance(d, Gimp.Layer)]
+
+    dialog = GimpUi.Dialog(title="fal.ai Batch", role="python-fu-falai-batch")
+    dialog.add_button("_Cancel", Gtk.ResponseType.CANCEL)
+    ok_button = dialog.add_button("_OK", Gtk.ResponseType.OK)
+    dialog.set_default_size(500, -1)
+
+    box = dialog.get_content_area()
+    box.set_spacing(12)
+    box.set_border_width(12)
+
+    grid = Gtk.Grid(row_spacing=6, column_spacing=6)
+    box.pack_start(grid, True, True, 0)
+
+    grid.attach(Gtk.Label(label="Prompt:", halign=Gtk.Align.START), 0, 0, 1, 1)
+    entry_prompt = Gtk.Entry()
+    entry_prompt.set_text(conf.get('prompt', ''))
+    entry_prompt.set_hexpand(True)
+    entry_prompt.set_activates_default(True)
+    grid.attach(entry_prompt, 1, 0, 1, 1)
+
+    grid.attach(Gtk.Label(label="Layers:", halign=Gtk.Align.START), 0, 1, 1, 1)
+    grid.attach(Gtk.Label(label=f"{len(layers)} selected", halign=Gtk.Align.START), 1, 1, 1, 1)
+
+    grid.attach(Gtk.Label(label="Image Folder:", halign=Gtk.Align.START), 0, 2, 1, 1)
+    folder_btn = Gtk.FileChooserButton(title="Select a folder of images",
+                                       action=Gtk.FileChooserAction.SELECT_FOLDER)
+    grid.attach(folder_btn, 1, 2, 1, 1)
+
+    grid.attach(Gtk.Label(label="Concurrent Jobs:", halign=Gtk.Align.START), 0, 3, 1, 1)
+    conc_adj = Gtk.Adjustment(value=conf.get('batch_concurrency', 4), lower=1, upper=32, step_increment=1, page_increment=4, page_size=0)
+    conc_spin = Gtk.SpinButton()
+    conc_spin.set_adjustment(conc_adj)
+    conc_spin.set_numeric(True)
+    grid.attach(conc_spin, 1, 3, 1, 1)
+
+    dedup_btn = Gtk.CheckButton(label="Generate near-duplicate layers once")
+    dedup_btn.set_active(conf.get('frame_dedup', True))
+    grid.attach(dedup_btn, 1, 4, 1, 1)
+
+    dialog.set_default(ok_button)
+    dialog.show_all()
+    response = dialog.run()
+    prompt_text = entry_prompt.get_text().strip()
+    folder = folder_btn.get_filename()
+    conf['batch_concurrency'] = conc_spin.get_value_as_int()
+    conf['frame_dedup'] = dedup_btn.get_active()
+    dialog.destroy()
+
+    if response != Gtk.ResponseType.OK:
+        return
+    if not prompt_text:
+        Gimp.message("Prompt cannot be empty.")
+        return
+    conf['prompt'] = prompt_text
+    try:
+        settings.save_settings(conf)
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Warning: Could not save settings. Error: {e}")
+
+    import batch
+    import falai_wrapper
+
+    if not layers and not folder:
+        Gimp.message("[fal.ai] Nothing to process: select layers or an image folder.")
+        return
+    tracing.begin_run(conf, 'batch', inputs=len(layers))
+
+    # Layer ID -> content region, and -> near-duplicate layers that reuse its result
+    regions = {}
+    copies = {}
+    if conf.get('frame_dedup', True) and len(layers) > 1:
+        with tracing.span('frame_dedup', layers=len(layers)) as attrs:
+            bboxes = [_layer_content_bbox(layer) for layer in layers]
+            groups = _group_duplicate_layers(layers, bboxes, conf)
+            for layer, region, rep in zip(layers, bboxes, groups):
+                regions[layer.get_id()] = region
+                if layers[rep] is not layer:
+                    copies.setdefault(layers[rep].get_id(), []).append(layer)
+            attrs['saved'] = sum(len(c) for c in copies.values())
+        if attrs['saved']:
+            Gimp.message(f"[fal.ai] {attrs['saved']} of {len(layers)} layers are near-duplicates; "
+                         f"reusing their results saves {attrs['saved']} call(s)")
+    reused = {layer.get_id() for c in copies.values() for layer in c}
+    sources = [('layer', layer) for layer in layers if layer.get_id() not in reused]
+    if folder:
+        sources += [('file', path) for path in batch.image_files(folder)]
+
+    # Scheduler index -> (kind, source, (x, y, size, scale)) for inputs that were submitted
+    submitted = {}
+    # Scheduler index -> [(layer, (x, y, size, scale))] for near-duplicates of the submitted layer
+    copy_places = {}
+    failures = []
+
+    def _deliver(index, result):
+        kind, source, place = submitted[index]
+        label = source.get_name() if kind == 'layer' else os.path.basename(source)
+        if isinstance(result, Exception):
+            failures.append(label)
+            Gimp.message(f"[fal.ai] {label}: {result}")
+        elif kind == 'layer':
+            for layer, layer_place in [(source, place)] + copy_places.get(index, []):
+                for path in result:
+                    _insert_result(image, path, layer_place[:2], above=layer,
+                                   name=f"{layer.get_name()} (fal.ai)", size=layer_place[2],
+                                   scale=layer_place[3])
+            falai_wrapper.discard_outputs(result)
+        else:
+            out_dir = os.path.join(os.path.dirname(source), 'fal.ai')
+            stem = os.path.splitext(os.path.basename(source))[0]
+            batch.write_outputs(result, out_dir, stem)
+        return False
+
+    scheduler = None
+
+    def _generate(job):
+        return scheduler.wait()
+
+    job = worker.GenerationJob(_generate, title="fal.ai batch")
+    scheduler = batch.BatchScheduler(
+        conf, prompt_text,
+        on_result=lambda i, r: GLib.idle_add(_deliver, i, r),
+        on_status=job.status,
+        cancel=job.cancel_event,
+    )
+    pending = iter(sources)
+
+    def _prepare_next():
+        # Exports run one per main-loop iteration while earlier jobs are in flight
+        if job.cancel_event.is_set():
+            scheduler.close()
+            return False
+        try:
+            kind, source = next(pending)
+        except StopIteration:
+            scheduler.close()
+            return False
+        try:
+            if kind == 'layer':
+                layer_id = source.get_id()
+                region = regions[layer_id] if layer_id in regions else _layer_content_bbox(source)
+                if region is None:
+                    Gimp.message(f"[fal.ai] {source.get_name()} is empty; skipped.")
+                    return True
+                scale = utils.input_scale(conf, *region[2:])
+                image_url, input_data, input_key = utils.prepare_input(source, conf, region, scale)
+                off_x, off_y = source.get_offsets()[-2:]
+                place = (off_x + region[0], off_y + region[1], region[2:] if scale < 1.0 else None,
+                         scale)
+                target = _result_target(image, place[:2], place[2],
+                                        f"{source.get_name()} (fal.ai)", above=source, scale=scale)
+                index = scheduler.submit(image_url=image_url, input_data=input_data,
+                                         input_key=input_key, target=target)
+                # Duplicates share the region size, so the result fits them unchanged
+                copy_places[index] = []
+                for layer in copies.get(layer_id, []):
+                    x, y = layer.get_offsets()[-2:]
+                    copy_region = regions[layer.get_id()]
+                    copy_places[index].append(
+                        (layer, (x + copy_region[0], y + copy_region[1], place[2], place[3])))
+            else:
+                place = None
+                target = {
+                    'kind': 'file',
+                    'out_dir': os.path.join(os.path.dirname(source), 'fal.ai'),
+                    'stem': os.path.splitext(os.path.basename(source))[0],
+                }
+                index = scheduler.submit(input_path=source, target=target)
+            submitted[index] = (kind, source, place)
+        except Exception as e:
+            Gimp.message(f"[fal.ai] Could not prepare {source}: {e}")
+        return True
+
+    GLib.idle_add(_prepare_next)
+    image.undo_group_start()
+    try:
+        results = job.run()
+        done = len(results) - len(failures)
+        saved = sum(len(c) for c in copy_places.values())
+        note = f"; {saved} call(s) saved by reusing duplicate layers" if saved else ''
+        Gimp.message(f"[fal.ai] Batch finished: {done}/{len(results)} succeeded{note}")
+    except Exception as e:
+        Gimp.message(f"[fal.ai] Error during fal.ai batch: {e}")
+    finally:
+        image.undo_group_end()
+        tracing.end_run()
+
+
+def collect_pending_results(conf, interactive=True):
+    """
+    Fetch the results of requests submitted in earlier sessions that closed or
+    crashed before the results arrived, and put them where they were headed:
+    layers go into the original image if it is open (otherwise they open as new
+    images), batch file results are written to their output folder. Without
+    interactive, no progress dialog is shown and the call blocks until done.
+    """
+    import batch
+    import falai_wrapper
+
+    def _deliver(entry, result):
+        target = entry.get('target') or {}
+        label = target.get('name') or entry['request_id']
+        if isinstance(result, Exception):
+            Gimp.message(f"[fal.ai] {label}: {result}")
+            return False
+        if target.get('kind') == 'file':
+            batch.write_outputs(result, target['out_dir'], target['stem'])
+            return False
+        image = _find_target_image(target)
+        try:
+            for path in result:
+                if image is None:
+                    _open_result(path)
+                    continue
+                above = None
+                if target.get('above'):
+                    above = image.get_layer_by_name(target['above'])
+                _insert_result(image, path, target.get('offsets'), above=above,
+                               name=target.get('name'), size=target.get('size'),
+                               scale=target.get('scale'))
+        finally:
+            falai_wrapper.discard_outputs(result)
+        return False
+
+    def _generate(job):
+        return falai_wrapper.collect_pending(
+            conf, lambda entry, result: GLib.idle_add(_deliver, entry, result),
+            on_status=job.status, cancel=job.cancel_event)
+
+    tracing.begin_run(conf, 'collect')
+    try:
+        if interactive:
+            collected, running = worker.GenerationJob(_generate, title="fal.ai pending results").run()
+        else:
+            # On the main thread, so results are delivered as they arrive
+            collected, running = falai_wrapper.collect_pending(conf, _deliver)
+    except falai_wrapper.CancelledError:
+        Gimp.message("[fal.ai] Collecting cancelled")
+        return
+    finally:
+        tracing.end_run()
+    if not collected and not running:
+        Gimp.message("[fal.ai] No pending results")
+    else:
+        Gimp.message(f"[fal.ai] Collected {collected} pending result(s); {running} still running")
+
+
+def show_history_dialog(image, conf):
+    """
+    Browse earlier results and re-import the selected ones from their stored
+    full-resolution files, without a new request. Thumbnails come from the
+    memory-mapped history atlas.
+    """
+    import time
+    from gi.repository import GdkPixbuf
+    import history
+
+    GimpUi.init("python-fu-falai-history")
+    entries = history.entries(limit=conf.get('history_max_entries', 500))
+    if not entries:
+        Gimp.message("[fal.ai] The history is empty")
+        return
+
+    dialog = GimpUi.Dialog(title="fal.ai History", role="python-fu-falai-history")
+    dialog.add_button("_Cancel", Gtk.ResponseType.CANCEL)
+    ok_button = dialog.add_button("_Import", Gtk.ResponseType.OK)
+    dialog.set_default_size(720, 520)
+
+    box = dialog.get_content_area()
+    box.set_spacing(12)
+    box.set_border_width(12)
+
+    # Columns: thumbnail, label, tooltip; rows follow entries (newest first)
+    store = Gtk.ListStore(GdkPixbuf.Pixbuf, str, str)
+    with history.Atlas() as atlas:
+        for entry in entries:
+            pixbuf = None
+            thumb = atlas.thumbnail(entry)
+            if thumb:
+                data, width, height, rowstride = thumb
+                pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
+                    GLib.Bytes.new(data), GdkPixbuf.Colorspace.RGB, True, 8,
+                    width, height, rowstride)
+            prompt = entry.get('prompt') or ''
+            label = prompt if len(prompt) <= 32 else prompt[:31] + '…'
+            tooltip = (f"{prompt}\n{entry['model']}  seed {entry.get('seed')}\n"
+                       f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['created']))}"
+                       f"  {entry.get('seconds') or 0:.1f} s  {len(entry['files'])} image(s)")
+            store.append([pixbuf, label, GLib.markup_escape_text(tooltip)])
+
+    view = Gtk.IconView(model=store)
+    view.set_pixbuf_column(0)
+    view.set_text_column(1)
+    view.set_tooltip_column(2)
+    view.set_item_width(history.THUMB_SIZE)
+    view.set_selection_mode(Gtk.SelectionMode.MULTIPLE)
+    view.connect('item-activated', lambda *_: dialog.response(Gtk.ResponseType.OK))
+    scroller = Gtk.ScrolledWindow()
+    scroller.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+    scroller.add(view)
+    box.pack_start(scroller, True, True, 0)
+
+    dialog.set_default(ok_button)
+    dialog.show_all()
+    response = dialog.run()
+    # Oldest first, so the newest selected result ends up on top
+    rows = sorted((path.get_indices()[0] for path in view.get_selected_items()), reverse=True)
+    selected = [entries[row] for row in rows]
+    dialog.destroy()
+    if response != Gtk.ResponseType.OK or not selected:
+        return
+
+    if image is not None:
+        image.undo_group_start()
+    try:
+        for entry in selected:
+            paths = history.files(entry)
+            if not paths:
+                Gimp.message(f"[fal.ai] The files of '{entry.get('prompt')}' are gone")
+                continue
+            for path in paths:
+                if image is None:
+                    _open_result(path)
+                else:
+                    _insert_result(image, path, name=f"{entry.get('prompt') or 'fal.ai'} (history)")
     finally:
-        if tmp_input and os.path.exists(tmp_input):
-            try:
-                os.remove(tmp_input)
-            except:
-                pass
\ No newline at end of file
+        if image is not None:
+            image.undo_group_end()
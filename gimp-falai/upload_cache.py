@@ -0,0 +1,75 @@
+"""
+Content-addressed cache of uploaded input images.
+
+Maps a hash of the exported pixels (plus the encode parameters) to the fal CDN
+URL returned by the upload, so repeated runs on an unchanged layer skip the upload.
+"""
+
+import hashlib
+import threading
+import time
+
+from settings import CONFIG_DIR, read_json, write_json
+
+CACHE_PATH = CONFIG_DIR / 'upload_cache.json'
+
+# Batch workers read, change and rewrite the cache file concurrently
+_lock = threading.Lock()
+
+
+def cache_key(pixels, settings):
+    """Hash the raw pixels together with everything that affects the encoded upload."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{pixels.width}x{pixels.height}x{pixels.bpp}".encode())
+    fmt = settings.get('upload_format', 'png')
+    # Only the parameter of the selected encoder changes the uploaded bytes
+    if fmt == 'png':
+        h.update(f"png:{settings.get('png_compress_level', 1)}".encode())
+    elif fmt == 'jpeg':
+        h.update(f"jpeg:{settings.get('jpeg_quality', 92)}".encode())
+    else:
+        h.update(fmt.encode())
+    h.update(pixels.data)
+    return h.hexdigest()
+
+
+def _ttl(settings):
+    return float(settings.get('upload_cache_ttl_hours', 24)) * 3600
+
+
+def _prune(entries, settings, now):
+    """Drop expired entries, then evict least recently used ones above the size limit."""
+    ttl = _ttl(settings)
+    for key in [k for k, e in entries.items() if now - e['created'] >= ttl]:
+        del entries[key]
+    excess = len(entries) - int(settings.get('upload_cache_max_entries', 200))
+    if excess > 0:
+        for key in sorted(entries, key=lambda k: entries[k]['last_used'])[:excess]:
+            del entries[key]
+
+
+def lookup(key, settings):
+    """Return the cached URL for key, or None if unknown, expired or caching is disabled."""
+    if _ttl(settings) <= 0:
+        return None
+    with _lock:
+        entries = read_json(CACHE_PATH, {})
+        entry = entries.get(key)
+        now = time.time()
+        if entry is None or now - entry['created'] >= _ttl(settings):
+            return None
+        entry['last_used'] = now
+        write_json(CACHE_PATH, entries)
+        return entry['url']
+
+
+def store(key, url, size, settings):
+    """Remember the URL an upload of size bytes returned for key."""
+    if _ttl(settings) <= 0:
+        return
+    with _lock:
+        entries = read_json(CACHE_PATH, {})
+        now = time.time()
+        entries[key] = {'url': url, 'size': size, 'created': now, 'last_used': now}
+        _prune(entries, settings, now)
+        write_json(CACHE_PATH, entries)
@@ -0,0 +1,172 @@
+"""
+Upload engine for input images: single requests for small payloads, parallel
+resumable multipart uploads for large ones.
+
+Payloads of at least 'multipart_threshold_mb' are split into parts of
+'multipart_part_mb' that are uploaded concurrently on the shared connection pool,
+each part retrying with jittered backoff. The ETag of every finished part is
+recorded in CONFIG_DIR/uploads/<key>.json, so an upload interrupted by a dropped
+connection, a cancel or a crash continues with the missing parts next time.
+"""
+
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+import httpx
+
+import fal_api
+from downloads import RETRY_STATUS
+from settings import CONFIG_DIR, read_json, write_json
+
+STATE_DIR = CONFIG_DIR / 'uploads'
+# fal's multipart upload IDs outlive this; older progress is discarded
+RESUME_TTL = 12 * 3600
+
+
+class Source:
+    """Bytes to upload, held in memory or read part by part from a file."""
+
+    def __init__(self, data=None, path=None):
+        self._data = data
+        self._path = path
+        self.size = len(data) if data is not None else os.path.getsize(path)
+
+    def read(self, offset, length):
+        if self._data is not None:
+            return bytes(memoryview(self._data)[offset:offset + length])
+        with open(self._path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def digest(self):
+        h = hashlib.blake2b(digest_size=20)
+        if self._data is not None:
+            h.update(self._data)
+        else:
+            with open(self._path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(block)
+        return h.hexdigest()
+
+
+def _part_size(settings):
+    # The storage backend rejects parts under 5 MiB (except the last one)
+    return max(5, int(settings.get('multipart_part_mb', 10))) * 1024 * 1024
+
+
+def upload(settings, source, content_type, file_name=None, key=None,
+           on_progress=None, check=None):
+    """Upload source (a Source) and return its access URL.
+
+    key identifies the content for resuming (hashed from the bytes if omitted).
+    on_progress(sent, total) is called as parts finish, check() between parts
+    (it may raise to abort; finished parts are kept for the next attempt).
+    """
+    threshold = float(settings.get('multipart_threshold_mb', 20)) * 1024 * 1024
+    if not threshold or source.size < threshold:
+        url = fal_api.upload(settings, source.read(0, source.size), content_type, file_name)
+        if on_progress:
+            on_progress(source.size, source.size)
+        return url
+    key = key or source.digest()
+    try:
+        return _multipart(settings, source, content_type, file_name, key, on_progress, check)
+    except (httpx.HTTPStatusError, RuntimeError) as e:
+        # fal_api wraps the status errors of its JSON calls (create, complete)
+        cause = e if isinstance(e, httpx.HTTPError) else e.__cause__
+        if not isinstance(cause, httpx.HTTPStatusError) or cause.response.status_code != 404:
+            raise
+        # The recorded upload expired on the server; start a fresh one
+        _forget(key)
+        return _multipart(settings, source, content_type, file_name, key, on_progress, check)
+
+
+def _forget(key):
+    try:
+        os.remove(STATE_DIR / f"{key}.json")
+    except OSError:
+        pass
+
+
+def _load_state(state_path, source, part_size, content_type):
+    state = read_json(state_path, None)
+    if (state and state['size'] == source.size and state['part_size'] == part_size
+            and state['content_type'] == content_type
+            and time.time() - state['created'] < RESUME_TTL):
+        return state
+    return None
+
+
+def _multipart(settings, source, content_type, file_name, key, on_progress, check):
+    part_size = _part_size(settings)
+    state_path = STATE_DIR / f"{key}.json"
+    state = _load_state(state_path, source, part_size, content_type)
+    if state is None:
+        access_url, upload_id = fal_api.multipart_create(settings, content_type, file_name)
+        state = {
+            'access_url': access_url, 'upload_id': upload_id, 'size': source.size,
+            'part_size': part_size, 'content_type': content_type,
+            'created': time.time(), 'etags': {},
+        }
+        write_json(state_path, state)
+    etags = {int(n): etag for n, etag in state['etags'].items()}
+    count = (source.size + part_size - 1) // part_size
+    todo = [n for n in range(1, count + 1) if n not in etags]
+    if len(todo) < count:
+        print(f"Resuming upload: {count - len(todo)}/{count} parts already sent", file=sys.stderr)
+
+    lock = threading.Lock()
+    stop = threading.Event()
+    retries = int(settings.get('upload_retries', 3))
+
+    def _sent():
+        return min(source.size, len(etags) * part_size)
+
+    def _put(number):
+        if stop.is_set():
+            return
+        if check:
+            check()
+        data = source.read((number - 1) * part_size, part_size)
+        attempt = 0
+        while True:
+            try:
+                etag = fal_api.multipart_part(
+                    settings, state['access_url'], state['upload_id'], number, data, content_type)
+                break
+            except httpx.HTTPError as e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if stop.is_set() or attempt >= retries or (
+                        status is not None and status not in RETRY_STATUS):
+                    raise
+                time.sleep(0.5 * (2 ** attempt) * (0.5 + random.random()))
+                attempt += 1
+        with lock:
+            etags[number] = etag
+            state['etags'] = {str(n): t for n, t in etags.items()}
+            write_json(state_path, state)
+        if on_progress:
+            on_progress(_sent(), source.size)
+
+    workers = max(1, int(settings.get('multipart_concurrency', 4)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='falai-upload') as pool:
+        pending = {pool.submit(_put, n) for n in todo}
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()  # Re-raises the first failed part
+                if check:
+                    check()
+        except BaseException:
+            stop.set()  # Parts in flight finish; queued ones are skipped
+            raise
+
+    url = fal_api.multipart_complete(settings, state['access_url'], state['upload_id'], etags)
+    _forget(key)
+    return url
@@ -2,26 +2,220 @@
 Utility functions for fal.ai GIMP plugin.
 """
 
-from gi.repository import Gimp, Gio
+import io
+import os
+import tempfile
+from collections import namedtuple
 
-def export_drawable(drawable, path):
-    """Export the given drawable to a file at the given path using GIMP's file_save."""
+import gi
+gi.require_version('Gegl', '0.4')
+from gi.repository import Gimp, Gio, Gegl
+
+import models
+import tracing
+import upload_cache
+
+# Raw 8-bit pixel dump of a drawable region; alpha, if any, is the last byte per pixel
+Pixels = namedtuple('Pixels', ['data', 'width', 'height', 'bpp'])
+
+
+# Pillow image modes by bytes per pixel
+MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+# MIME types for the encoders supported by encode_pixels
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+}
+
+
+def read_pixels(drawable, region=None, scale=1.0):
+    """Read the raw pixels of the drawable, or of the (x, y, width, height) region.
+    A scale below 1.0 returns a downsampled copy of that area.
+    """
+    x, y, w, h = region or (0, 0, drawable.get_width(), drawable.get_height())
+    if not hasattr(drawable, 'get_buffer'):
+        pr = drawable.get_pixel_rgn(x, y, w, h, False, False)
+        pixels = Pixels(pr[x:x + w, y:y + h], w, h, pr.bpp)
+        return resize_pixels(pixels, scale) if scale < 1.0 else pixels
+    # Read straight from the GEGL buffer, letting babl convert to 8-bit RGB(A);
+    # GEGL samples scaled reads from its mipmaps, so large layers are never copied whole
+    alpha = drawable.has_alpha()
+    fmt = "R'G'B'A u8" if alpha else "R'G'B' u8"
+    sw, sh = max(1, round(w * scale)), max(1, round(h * scale))
+    data = drawable.get_buffer().get(
+        Gegl.Rectangle.new(int(x * scale), int(y * scale), sw, sh),
+        scale, fmt, Gegl.AbyssPolicy.CLAMP)
+    return Pixels(data, sw, sh, 4 if alpha else 3)
+
+
+def read_mask(image, drawable, region, scale=1.0):
+    """Read the image selection under the drawable's region as an 8-bit greyscale mask."""
+    off_x, off_y = drawable.get_offsets()[-2:]
+    x, y, w, h = region
+    sw, sh = max(1, round(w * scale)), max(1, round(h * scale))
+    data = image.get_selection().get_buffer().get(
+        Gegl.Rectangle.new(int((x + off_x) * scale), int((y + off_y) * scale), sw, sh),
+        scale, "Y u8", Gegl.AbyssPolicy.NONE)
+    return Pixels(data, sw, sh, 1)
+
+
+def selection_region(image, drawable, margin=0):
+    """Return the selection's bounding box grown by margin, in drawable coordinates
+    and clipped to the drawable, or None if nothing selected touches the drawable.
+    """
+    non_empty, x1, y1, x2, y2 = Gimp.Selection.bounds(image)[-5:]
+    if not non_empty:
+        return None
+    off_x, off_y = drawable.get_offsets()[-2:]
+    left = max(0, x1 - off_x - margin)
+    top = max(0, y1 - off_y - margin)
+    right = min(drawable.get_width(), x2 - off_x + margin)
+    bottom = min(drawable.get_height(), y2 - off_y + margin)
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right - left, bottom - top)
+
+
+def supports_mask(settings):
+    """Return True if the selected model takes an inpainting mask (mask_url)."""
+    return models.takes_mask(settings, settings.get('model'))
+
+
+def resize_pixels(pixels, scale):
+    """Return pixels resampled by scale with Pillow (unchanged if Pillow is missing)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return pixels
+    mode = MODES[pixels.bpp]
+    size = (max(1, round(pixels.width * scale)), max(1, round(pixels.height * scale)))
+    img = Image.frombuffer(mode, (pixels.width, pixels.height), pixels.data, 'raw', mode, 0, 1)
+    return Pixels(img.resize(size, Image.LANCZOS).tobytes(), size[0], size[1], pixels.bpp)
+
+
+def input_scale(settings, width, height):
+    """Scale factor that fits width x height into the model's input pixel budget."""
+    caps = models.capabilities(settings, settings.get('model'), fetch=False)
+    budget = caps and caps['max_megapixels']
+    if budget is None:
+        budget = settings.get('model_max_megapixels', {}).get(
+            settings.get('model'), settings.get('max_input_megapixels', 0))
+    if not budget or width * height <= budget * 1e6:
+        return 1.0
+    return (budget * 1e6 / (width * height)) ** 0.5
+
+
+def encode_pixels(pixels, fmt='png', png_compress_level=1, jpeg_quality=92):
+    """Encode raw pixels in memory and return (data, content_type).
+
+    fmt is one of 'png', 'webp' (lossless) or 'jpeg'; JPEG drops the alpha channel.
+    """
+    from PIL import Image
+
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Unsupported upload format: {fmt}")
+    mode = MODES[pixels.bpp]
+    # frombuffer wraps the pixel bytes without copying them
+    img = Image.frombuffer(mode, (pixels.width, pixels.height), pixels.data, 'raw', mode, 0, 1)
+    buf = io.BytesIO()
+    if fmt == 'png':
+        img.save(buf, 'PNG', compress_level=png_compress_level)
+    elif fmt == 'webp':
+        img.save(buf, 'WEBP', lossless=True, quality=0, method=0)
+    else:
+        if img.mode == 'RGBA':
+            img = img.convert('RGB')
+        img.save(buf, 'JPEG', quality=jpeg_quality)
+    return buf.getvalue(), CONTENT_TYPES[fmt]
+
+
+def encode_drawable(drawable, settings, region=None, pixels=None):
+    """Encode the drawable (or region) in memory for upload.
+    Pass pixels if they were already read with read_pixels.
+    Returns (data, content_type, region) where region is the part actually encoded.
+    """
+    try:
+        pixels = pixels or read_pixels(drawable, region)
+        data, content_type = encode_pixels(
+            pixels,
+            settings.get('upload_format', 'png'),
+            settings.get('png_compress_level', 1),
+            settings.get('jpeg_quality', 92),
+        )
+        return data, content_type, region or (0, 0, pixels.width, pixels.height)
+    except ImportError:
+        # Pillow not available; go through GIMP's exporter and a temporary file
+        pass
+    except Exception as e:
+        # Pixels GEGL can't read as 8-bit or Pillow can't encode; GIMP's exporter can
+        Gimp.message(f"[fal.ai] Could not encode the layer in memory ({e}); exporting it instead")
+    with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        region = export_drawable(drawable, tmp_path, region)
+        with open(tmp_path, 'rb') as f:
+            return f.read(), CONTENT_TYPES['png'], region
+    finally:
+        os.remove(tmp_path)
+
+
+def prepare_input(drawable, settings, region=None, scale=1.0):
+    """Prepare the drawable (or region) as generation input, downsampled by scale.
+
+    Returns (image_url, input_data, key): image_url is set when an upload of the
+    same pixels can be reused, otherwise input_data holds the encoded
+    (bytes, content_type) to upload. key identifies the pixels for the caches.
+    """
+    with tracing.span('export') as attrs:
+        pixels = read_pixels(drawable, region, scale)
+        attrs.update(width=pixels.width, height=pixels.height)
+        key = upload_cache.cache_key(pixels, settings)
+        image_url = upload_cache.lookup(key, settings)
+        if image_url:
+            attrs['cached'] = True
+            Gimp.message(f"[fal.ai] Reusing uploaded input: {image_url}")
+            return image_url, None, key
+        data, content_type, _ = encode_drawable(drawable, settings, region, pixels)
+        attrs.update(format=content_type, bytes=len(data))
+    return None, (data, content_type), key
+
+
+def prepare_mask(image, drawable, settings, region, scale=1.0):
+    """Prepare the selection under region as an inpainting mask (always PNG).
+    Returns (mask_url, mask_data, key) like prepare_input.
+    """
+    mask_settings = dict(settings, upload_format='png')
+    with tracing.span('export', mask=True) as attrs:
+        pixels = read_mask(image, drawable, region, scale)
+        key = upload_cache.cache_key(pixels, mask_settings)
+        mask_url = upload_cache.lookup(key, mask_settings)
+        if mask_url:
+            attrs['cached'] = True
+            return mask_url, None, key
+        mask_data = encode_pixels(pixels, 'png', settings.get('png_compress_level', 1))
+        attrs['bytes'] = len(mask_data[0])
+    return None, mask_data, key
+
+
+def export_drawable(drawable, path, region=None):
+    """Export the given drawable to a file at the given path using GIMP's file_save.
+    If region (x, y, width, height) is given, only that part is exported when possible.
+    Returns the region that was actually written.
+    """
     # Try exporting via direct pixel dump (PIL) to avoid C-API mismatches
     try:
         # Ensure drawable is up-to-date
         drawable.flush()
         drawable.merge_shadow()
-        w = drawable.get_width()
-        h = drawable.get_height()
-        pr = drawable.get_pixel_rgn(0, 0, w, h, False, False)
-        data = pr[0:w, 0:h]
-        bpp = pr.bpp
+        pixels = read_pixels(drawable, region)
         from PIL import Image
 
-        mode = 'RGB' if bpp == 3 else 'RGBA'
-        img = Image.frombytes(mode, (w, h), data, 'raw', mode)
+        mode = MODES[pixels.bpp]
+        img = Image.frombytes(mode, (pixels.width, pixels.height), pixels.data, 'raw', mode)
         img.save(path)
-        return
+        return region or (0, 0, pixels.width, pixels.height)
     except ImportError:
         # Pillow not available; fall back to GIMP file_save API
         pass
@@ -33,32 +227,93 @@ def export_drawable(drawable, path):
     out_file = Gio.File.new_for_path(path)
     first_exc = None
     # Try 5-arg (run_mode, image, drawable, Gio.File, filename)
+    # file_save always writes the whole drawable, so the region is ignored here
+    full = (0, 0, drawable.get_width(), drawable.get_height())
     try:
         Gimp.file_save(Gimp.RunMode.NONINTERACTIVE, image, drawable, out_file, path)
-        return
+        return full
     except Exception as exc1:
         first_exc = exc1
     # Try 4-arg Gimp.file_save signature: (run_mode, image, GFile, options)
     try:
         Gimp.file_save(Gimp.RunMode.NONINTERACTIVE, image, out_file, None)
-        return
+        return full
     except Exception as exc2:
         raise RuntimeError(
             f"Failed to export drawable to {path}: {first_exc}; {exc2}"
         )
 
-def import_image(image, image_path):
-    """Import an image file into GIMP as a new layer using GIMP's file_load_layer."""
+def load_layer(image, image_path, name=None):
+    """Create a layer (not yet inserted) from an image file.
+
+    The file is decoded with Pillow and its pixels written straight into the new
+    layer's GEGL buffer, which avoids a round trip through GIMP's file loader
+    plug-ins. The layer matches the image's base type (RGB or grayscale). Indexed
+    images, formats Pillow can't read (or a missing Pillow) use file_load_layer,
+    which maps the pixels onto the image's palette.
+    """
+    file = Gio.File.new_for_path(image_path)
+    if image.get_base_type() == Gimp.ImageBaseType.INDEXED:
+        return Gimp.file_load_layer(Gimp.RunMode.NONINTERACTIVE, image, file)
+    gray = image.get_base_type() == Gimp.ImageBaseType.GRAY
     try:
-        # Load layer from file; wrap path in Gio.File
-        # Import via the core file_load_layer API (run-mode, image, Gio.File)
-        in_file = Gio.File.new_for_path(image_path)
-        layer = Gimp.file_load_layer(
-            Gimp.RunMode.NONINTERACTIVE,
-            image,
-            in_file,
-        )
-        image.insert_layer(layer, None, -1)
+        from PIL import Image
+        with Image.open(image_path) as img:
+            alpha = 'A' in img.getbands() or 'transparency' in img.info
+            mode = ('L' if gray else 'RGB') + ('A' if alpha else '')
+            data = img.convert(mode).tobytes()
+            width, height = img.size
+    except (ImportError, OSError):
+        return Gimp.file_load_layer(Gimp.RunMode.NONINTERACTIVE, image, file)
+    if gray:
+        layer_type = Gimp.ImageType.GRAYA_IMAGE if alpha else Gimp.ImageType.GRAY_IMAGE
+        fmt = "Y'A u8" if alpha else "Y' u8"
+    else:
+        layer_type = Gimp.ImageType.RGBA_IMAGE if alpha else Gimp.ImageType.RGB_IMAGE
+        fmt = "R'G'B'A u8" if alpha else "R'G'B' u8"
+    layer = Gimp.Layer.new(
+        image, name or os.path.basename(image_path), width, height, layer_type,
+        100.0, Gimp.LayerMode.NORMAL,
+    )
+    buffer = layer.get_buffer()
+    buffer.set(Gegl.Rectangle.new(0, 0, width, height), fmt, data)
+    buffer.flush()
+    return layer
+
+
+def import_image(image, image_path, offsets=None, above=None, name=None, size=None,
+                 masked=False, scale=None):
+    """Import an image file into GIMP as a new layer (see load_layer).
+    If offsets (x, y) are given the new layer is moved there; if above is a layer,
+    the new layer is stacked directly above it. If the input was downscaled by scale,
+    the result is enlarged by 1 / scale, to exactly size (the source's width, height)
+    when it has the downscaled input's dimensions. If masked, the current selection
+    becomes the layer's mask so only the selected area shows. Returns the new layer.
+    """
+    try:
+        with tracing.span('import', bytes=os.path.getsize(image_path)):
+            layer = load_layer(image, image_path, name)
+        if above is not None:
+            image.insert_layer(layer, above.get_parent(), image.get_item_position(above))
+        else:
+            image.insert_layer(layer, None, -1)
+        if scale and scale < 1.0:
+            width, height = layer.get_width(), layer.get_height()
+            if size and (width, height) == (max(1, round(size[0] * scale)),
+                                            max(1, round(size[1] * scale))):
+                restored = tuple(size)
+            else:
+                # Another resolution or aspect ratio (e.g. a fixed aspect_ratio setting)
+                restored = (max(1, round(width / scale)), max(1, round(height / scale)))
+            if restored != (width, height):
+                layer.scale(restored[0], restored[1], False)
+        if offsets:
+            layer.set_offsets(*offsets)
+        if name:
+            layer.set_name(name)
+        if masked and not Gimp.Selection.is_empty(image):
+            layer.add_mask(layer.create_mask(Gimp.AddMaskType.SELECTION))
         Gimp.displays_flush()
+        return layer
     except Exception as e:
         raise RuntimeError(f"Failed to import image {image_path} into GIMP: {e}")
@@ -0,0 +1,115 @@
+"""
+Background execution of fal.ai generations for the GIMP plugin.
+
+The network work runs on a worker thread while the plug-in spins a GLib main
+loop; progress and results are marshalled back with GLib.idle_add because
+libgimp (the PDB, progress and layer calls) must only be used from the main thread.
+"""
+
+import threading
+
+from gi.repository import Gimp, GLib, Gtk, Pango
+
+
+class GenerationJob:
+    """Run target(job) on a worker thread and keep GIMP responsive until it finishes.
+
+    The target reports through job.status(text, fraction) and job.image(index, path);
+    both may be called from any thread. on_image(index, path) runs on the main thread
+    as each image arrives. A small dialog shows progress and lets the user cancel,
+    which sets job.cancel_event.
+    """
+
+    def __init__(self, target, on_image=None, title="fal.ai"):
+        self.cancel_event = threading.Event()
+        self._target = target
+        self._on_image = on_image
+        self._title = title
+        self._result = None
+        self._error = None
+        self._loop = None
+        self._dialog = None
+        self._label = None
+        self._bar = None
+
+    # --- Called from the worker thread ---
+
+    def status(self, text, fraction=None):
+        GLib.idle_add(self._show_status, text, fraction)
+
+    def image(self, index, path):
+        GLib.idle_add(self._deliver_image, index, path)
+
+    def _work(self):
+        try:
+            self._result = self._target(self)
+        except Exception as e:
+            self._error = e
+        finally:
+            # Idle callbacks run in order, so every image is delivered before this
+            GLib.idle_add(self._finish)
+
+    # --- Main thread ---
+
+    def run(self):
+        """Start the job and block in a nested main loop; returns the target's result."""
+        self._build_dialog()
+        Gimp.progress_init(f"{self._title}: starting...")
+        self._loop = GLib.MainLoop()
+        thread = threading.Thread(target=self._work, name="falai-generation", daemon=True)
+        thread.start()
+        self._loop.run()
+        thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def _build_dialog(self):
+        self._dialog = Gtk.Dialog(title=self._title)
+        self._dialog.add_button("_Cancel", Gtk.ResponseType.CANCEL)
+        self._dialog.set_default_size(360, -1)
+        box = self._dialog.get_content_area()
+        box.set_spacing(6)
+        box.set_border_width(12)
+        self._label = Gtk.Label(label="Starting...", halign=Gtk.Align.START)
+        self._label.set_ellipsize(Pango.EllipsizeMode.END)
+        self._bar = Gtk.ProgressBar()
+        box.pack_start(self._label, False, False, 0)
+        box.pack_start(self._bar, False, False, 0)
+        self._dialog.connect('response', self._on_response)
+        self._dialog.show_all()
+
+    def _on_response(self, dialog, response):
+        if not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self._label.set_text("Cancelling...")
+            dialog.set_response_sensitive(Gtk.ResponseType.CANCEL, False)
+
+    def _show_status(self, text, fraction):
+        if self.cancel_event.is_set() or self._dialog is None:
+            return False
+        self._label.set_text(text)
+        Gimp.progress_set_text(f"{self._title}: {text}")
+        if fraction is None:
+            self._bar.pulse()
+            Gimp.progress_pulse()
+        else:
+            self._bar.set_fraction(fraction)
+            Gimp.progress_update(fraction)
+        return False
+
+    def _deliver_image(self, index, path):
+        if self._on_image and not self.cancel_event.is_set():
+            try:
+                self._on_image(index, path)
+            except Exception as e:
+                Gimp.message(f"[fal.ai] Could not insert image {index + 1}: {e}")
+        return False
+
+    def _finish(self):
+        Gimp.progress_end()
+        if self._dialog is not None:
+            self._dialog.destroy()
+            self._dialog = None
+        self._loop.quit()
+        return False
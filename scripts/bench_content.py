@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the alpha-coverage scan in gimp-falai/content.py.
+
+Compares the old per-byte Python loop against the NumPy and pure-bytes paths on a
+synthetic RGBA buffer. Run from the repository root:
+
+    python3 scripts/bench_content.py --size 4096
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'gimp-falai'))
+
+import content
+
+
+def legacy_has_content(data, bpp):
+    """The original loop from ui.show_prompt_dialog."""
+    data = bytearray(data)
+    for i in range(bpp - 1, len(data), bpp):
+        if data[i] > 0:
+            return True
+    return False
+
+
+def make_buffer(size, bpp=4):
+    """Transparent square with a single opaque pixel near the bottom-right corner."""
+    data = bytearray(size * size * bpp)
+    y = x = size - size // 8
+    data[(y * size + x) * bpp + bpp - 1] = 255
+    return bytes(data)
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=2048, help='square buffer edge in pixels')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--skip-legacy', action='store_true', help='skip the slow per-byte loop')
+    opts = parser.parse_args()
+
+    data = make_buffer(opts.size)
+    args = (data, opts.size, opts.size, 4)
+    # Opaque layers are bounded after one band from each edge
+    opaque = (b'\xff' * (opts.size * opts.size * 4), opts.size, opts.size, 4)
+    results = {}
+    if not opts.skip_legacy:
+        results['legacy loop'] = timed(lambda: legacy_has_content(data, 4), opts.repeat)
+
+    numpy_mod = content.np
+    for label, np_mod in (('numpy', numpy_mod), ('bytes fallback', None)):
+        if label == 'numpy' and numpy_mod is None:
+            continue
+        content.np = np_mod
+        results[f'content_bbox ({label})'] = timed(lambda: content.content_bbox(*args), opts.repeat)
+        results[f'content_bbox opaque ({label})'] = timed(
+            lambda: content.content_bbox(*opaque), opts.repeat)
+    content.np = numpy_mod
+
+    print(f"{opts.size}x{opts.size} RGBA, best of {opts.repeat}:")
+    for label, secs in results.items():
+        print(f"  {label:<36} {secs * 1000:10.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Connection reuse benchmark for gimp-falai/http_session.py.
+
+Replays the HTTP traffic of a batch of generations (CDN token, upload, queue
+submit, status polls, result and image download) against the local fake
+server, once with a fresh connection per request, as the plug-in did with
+urllib and per-call clients, and once through the shared pool. The server adds
+--connect-delay to every new connection to stand in for DNS, TCP and TLS setup:
+
+    python3 scripts/bench_http.py --jobs 8 --polls 5 --connect-delay 0.05
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'gimp-falai'))
+sys.path.insert(0, HERE)
+
+importlib.import_module('falai_wrapper')  # Puts the vendored fal_client and httpx on sys.path
+import httpx
+
+import fake_fal_server
+import http_session
+
+
+def replay(get_client, base_url, jobs, polls):
+    """Run the request sequence of jobs generations; get_client() returns the client per request."""
+    auth = {'Authorization': 'Key bench'}
+    token = get_client().post(f"{base_url}/storage/auth/token?storage_type=fal-cdn-v3",
+                              json={}, headers=auth).json()
+    for _ in range(jobs):
+        upload = get_client().post(
+            f"{token['base_url']}/files/upload", content=os.urandom(64 * 1024),
+            headers={'Authorization': f"Bearer {token['token']}", 'Content-Type': 'image/png'},
+        ).json()
+        req = get_client().post(f"{base_url}/fal-ai/bench",
+                                json={'image_url': upload['access_url']}, headers=auth).json()
+        for _ in range(polls):
+            get_client().get(req['status_url'], headers=auth)
+        result = get_client().get(req['response_url'], headers=auth).json()
+        for image in result['images']:
+            get_client().get(image['url']).read()
+
+
+def run(label, make_client, fake, jobs, polls):
+    fake.counts.clear()
+    clients = []
+
+    def _get_client():
+        client = make_client()
+        clients.append(client)
+        return client
+
+    start = time.perf_counter()
+    replay(_get_client, fake.base_url, jobs, polls)
+    elapsed = time.perf_counter() - start
+    requests = sum(v for k, v in fake.counts.items() if k != 'connection')
+    print(f"{label:<20} {elapsed:8.3f} s  {requests:4d} requests  "
+          f"{fake.counts.get('connection', 0):4d} connections")
+    return clients
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--jobs', type=int, default=8, help='generations to replay')
+    parser.add_argument('--polls', type=int, default=5, help='status polls per generation')
+    parser.add_argument('--connect-delay', type=float, default=0.05,
+                        help='simulated handshake cost per new connection, seconds')
+    opts = parser.parse_args()
+
+    server, fake = fake_fal_server.start_server(
+        queue_delay=0, run_delay=0, image_size=256, connect_delay=opts.connect_delay)
+    try:
+        def _fresh():
+            return httpx.Client(timeout=30.0)
+        for client in run('new connection each', _fresh, fake, opts.jobs, opts.polls):
+            client.close()
+        run('shared pool', http_session.get_client, fake, opts.jobs, opts.polls)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for spreading a batch over several API keys.
+
+The fake server allows --key-concurrency unfinished requests per key and answers
+429 beyond that. A batch of --requests text-to-image jobs runs three ways:
+
+- one key: the batch is capped by that key's limit
+- pooled: --keys keys with the server's limit configured, so none is exceeded
+- overcommitted: the same keys configured with twice the server's limit, so
+  rate-limited keys rest and requests move to the others
+
+Every run must deliver every result; 429s and per-key submissions are reported:
+
+    python3 scripts/bench_keys.py --requests 24 --keys 3 --key-concurrency 2
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(HERE, '..', 'gimp-falai')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=24)
+    parser.add_argument('--keys', type=int, default=3)
+    parser.add_argument('--key-concurrency', type=int, default=2)
+    parser.add_argument('--run-delay', type=float, default=0.5)
+    opts = parser.parse_args()
+
+    # Keep usage counters and latency history away from the user's config
+    os.environ['XDG_CONFIG_HOME'] = tempfile.mkdtemp(prefix='falai-bench-')
+    sys.path.insert(0, PLUGIN_DIR)
+    sys.path.insert(0, HERE)
+    import batch
+    import fake_fal_server
+    import falai_wrapper
+    import keypool
+    import settings
+
+    server, fake = fake_fal_server.start_server(
+        queue_delay=0.05, run_delay=opts.run_delay, image_size=16,
+        key_concurrency=opts.key_concurrency)
+    base = dict(
+        settings.DEFAULT_SETTINGS,
+        model='fal-ai/bench', model_registry_url='',
+        fal_queue_url=fake.base_url, fal_rest_url=fake.base_url,
+        use_result_cache=False, dedup_inflight=False, history_enabled=False,
+        trace_enabled=False, batch_submit_rate=0, batch_concurrency=1,
+        request_retries=2, key_backoff_s=0.5,
+    )
+    failed = False
+    print(f"{opts.requests} requests, {opts.key_concurrency} per key allowed by the server")
+    print(f"{'mode':<14} {'seconds':>8} {'429s':>5}  submissions per key")
+    runs = (
+        ('one key', 1, opts.key_concurrency),
+        ('pooled', opts.keys, opts.key_concurrency),
+        ('overcommitted', opts.keys, opts.key_concurrency * 2),
+    )
+    for mode, count, limit in runs:
+        names = [f"{mode.replace(' ', '-')}-{i}" for i in range(count)]
+        conf = dict(base, api_keys=[
+            {'name': name, 'key': name, 'max_concurrent': limit} for name in names])
+        limited = fake.counts.get('rate_limited', 0)
+        start = time.perf_counter()
+        scheduler = batch.BatchScheduler(conf, mode)
+        for _ in range(opts.requests):
+            scheduler.submit()
+        scheduler.close()
+        results = scheduler.wait()
+        seconds = time.perf_counter() - start
+        errors = [r for r in results if isinstance(r, Exception)]
+        for result in results:
+            if not isinstance(result, Exception):
+                falai_wrapper.discard_outputs(result)
+        spread = ' '.join(str(fake.counts.get(f"submit:{name}", 0)) for name in names)
+        print(f"{mode:<14} {seconds:>8.2f} {fake.counts.get('rate_limited', 0) - limited:>5}  {spread}")
+        if errors:
+            print(f"  {len(errors)} failed: {errors[0]}")
+            failed = True
+    print("usage:", {name: (u['requests'], u['rate_limited'])
+                     for name, u in keypool.usage().items()})
+    server.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Peak-memory benchmark for retrieving sync_mode (inline data: URI) results.
+
+Runs scripts/fake_fal_server.py in a subprocess, uploads one large
+incompressible PNG and requests --num-images copies of it inline. It then
+measures the peak Python allocation (tracemalloc) of two ways of handling the
+result:
+
+- legacy: response.json(), then base64-decode each URI and write it, and
+  format the result into a message. This is what process_image used to do.
+- streaming: fal_api.get_result, which decodes to disk as the bytes arrive.
+
+Exits with status 1 if the streaming peak exceeds --max-peak-mb:
+
+    python3 scripts/bench_memory.py --size 2048 --num-images 10 --max-peak-mb 16
+"""
+
+import argparse
+import importlib
+import base64
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'gimp-falai'))
+
+import numpy as np
+from PIL import Image
+
+importlib.import_module('falai_wrapper')  # Puts the vendored fal_client and httpx on sys.path
+import fal_api
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def noise_png(size):
+    pixels = np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels, 'RGB').save(buf, 'PNG', compress_level=1)
+    return buf.getvalue()
+
+
+def legacy(conf, handle):
+    """The former process_image path: whole JSON in memory, whole-string decodes."""
+    result = fal_api.get_client(conf).get(handle.response_url).json()
+    message = f"[DEBUG] fal.ai full result: {result!r}"
+    paths = []
+    for img in result['images']:
+        header, data_part = img['url'].split(',', 1)
+        data = base64.b64decode(data_part)
+        path = tempfile.mktemp(suffix='.png')
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    del message
+    return paths
+
+
+def streaming(conf, handle):
+    result, paths = fal_api.get_result(conf, handle)
+    return paths
+
+
+def measure(fn, conf, handle):
+    tracemalloc.start()
+    start = time.perf_counter()
+    paths = fn(conf, handle)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    written = sum(os.path.getsize(p) for p in paths)
+    for path in paths:
+        os.remove(path)
+    return peak, elapsed, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=2048, help='edge of the generated PNG')
+    parser.add_argument('--num-images', type=int, default=10)
+    parser.add_argument('--max-peak-mb', type=float, default=16.0,
+                        help='fail if the streaming path peaks above this')
+    opts = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen([
+        sys.executable, os.path.join(HERE, 'fake_fal_server.py'),
+        '--port', str(port), '--queue-delay', '0', '--run-delay', '0',
+    ], stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    conf = {'api_key': 'bench', 'fal_queue_url': base_url, 'fal_rest_url': base_url}
+    try:
+        for _ in range(50):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        image_url = fal_api.upload(conf, noise_png(opts.size), 'image/png')
+        handle = fal_api.submit(conf, 'fal-ai/bench', {
+            'image_url': image_url, 'num_images': opts.num_images, 'sync_mode': True,
+        })
+        for _ in handle.iter_events(interval=0.05):
+            pass
+
+        print(f"{opts.num_images} inline images of {opts.size}x{opts.size}")
+        peaks = {}
+        for name, fn in (('legacy', legacy), ('streaming', streaming)):
+            peak, elapsed, written = measure(fn, conf, handle)
+            peaks[name] = peak
+            print(f"{name:<10} peak {peak / 1e6:8.1f} MB  {elapsed:6.2f} s  "
+                  f"wrote {written / 1e6:.1f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+    if peaks['streaming'] > opts.max_peak_mb * 1e6:
+        print(f"Streaming peak above the {opts.max_peak_mb} MB cap")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
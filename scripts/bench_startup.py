@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the plug-in process.
+
+GIMP starts gimp-falai.py once at launch to query its procedures and again for
+every run, so import cost is paid on each dialog open. This script replays the
+imports of each phase in a fresh interpreter with `python -X importtime` and
+reports wall time plus the slowest top-level imports. Run it with GIMP's Python
+so that gi is available:
+
+    python3 scripts/bench_startup.py --repeat 5 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gimp-falai')
+
+_GIMP = (
+    "import gi; gi.require_version('Gimp', '3.0'); gi.require_version('GimpUi', '3.0'); "
+    "from gi.repository import Gimp, GObject, GLib; "
+)
+
+# What each phase imports, mirroring gimp-falai.py and ui.py
+PHASES = {
+    # Module level of gimp-falai.py: all GIMP needs to query procedures
+    'query': _GIMP + "import settings",
+    # Run handler up to the prompt dialog being shown
+    'dialog-open': _GIMP + "import settings; from gi.repository import GimpUi; import ui",
+    # After OK: content scan and the fal.ai client stack
+    'generate': _GIMP + "from gi.repository import GimpUi; import ui, content, falai_wrapper",
+    # falai_cli.py outside GIMP
+    'headless-cli': "import falai_cli",
+}
+
+
+def run_phase(code):
+    """Run code in a fresh interpreter; return (wall seconds, {module: cumulative us})."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PLUGIN_DIR, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    modules = {}
+    for line in proc.stderr.splitlines():
+        # "import time:      self [us] |  cumulative | imported package"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # Top-level imports only
+            modules[name.strip()] = int(cumulative)
+    return wall, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure plug-in import/startup cost per phase.")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='slowest imports to list per phase')
+    parser.add_argument('--json', help='write results to this file for regression comparison')
+    opts = parser.parse_args()
+
+    report = {}
+    for phase, code in PHASES.items():
+        try:
+            runs = [run_phase(code) for _ in range(opts.repeat)]
+        except RuntimeError as e:
+            print(f"{phase:<14} unavailable: {e}")
+            report[phase] = {'error': str(e)}
+            continue
+        walls = [w for w, _ in runs]
+        modules = runs[-1][1]
+        slowest = sorted(modules.items(), key=lambda kv: kv[1], reverse=True)[:opts.top]
+        report[phase] = {
+            'wall_ms_median': statistics.median(walls) * 1000,
+            'wall_ms_min': min(walls) * 1000,
+            'import_ms_total': sum(modules.values()) / 1000,
+            'slowest_imports_ms': {name: us / 1000 for name, us in slowest},
+        }
+        print(f"{phase:<14} median {report[phase]['wall_ms_median']:8.1f} ms  "
+              f"(imports {report[phase]['import_ms_total']:.1f} ms)")
+        for name, ms in report[phase]['slowest_imports_ms'].items():
+            print(f"    {name:<32} {ms:8.1f} ms")
+
+    if opts.json:
+        with open(opts.json, 'w') as f:
+            json.dump({'python': sys.version, 'phases': report}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite for the generation pipeline.
+
+Runs the same steps as ui.run_generation (content check, export/encode, upload,
+queue, downloads, layer import) and the batch scheduler against
+scripts/fake_fal_server.py, with the gi.repository GIMP objects replaced by
+in-memory stand-ins so no GIMP is needed. Per-stage timings come from the
+plug-in's own trace spans. Results are written as JSON; pass an earlier file to
+--compare to flag regressions:
+
+    python3 scripts/bench_suite.py --quick -o bench.json
+    python3 scripts/bench_suite.py --sizes 512 2048 8192 --num-images 1 10 \\
+        --latency 0.03 --bandwidth 50 --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(HERE, '..', 'gimp-falai')
+
+import numpy as np
+from PIL import Image
+
+
+# --- Stand-ins for the gi.repository objects the pipeline touches ---
+
+class _Rectangle:
+    def __init__(self, x, y, width, height):
+        self.x, self.y, self.width, self.height = x, y, width, height
+
+    @classmethod
+    def new(cls, x, y, width, height):
+        return cls(x, y, width, height)
+
+
+class _Buffer:
+    """GeglBuffer.get() over an (height, width, 4) uint8 array."""
+
+    def __init__(self, pixels):
+        self._pixels = pixels
+        self.data = None
+
+    def get(self, rect, scale, fmt, abyss):
+        if scale == 1.0:
+            area = self._pixels[rect.y:rect.y + rect.height, rect.x:rect.x + rect.width]
+        else:
+            # Rectangle is in scaled coordinates, as with GEGL
+            x0, y0 = int(rect.x / scale), int(rect.y / scale)
+            x1, y1 = int((rect.x + rect.width) / scale), int((rect.y + rect.height) / scale)
+            img = Image.fromarray(self._pixels[y0:y1, x0:x1], 'RGBA')
+            area = np.asarray(img.resize((rect.width, rect.height), Image.BILINEAR))
+        if 'A' not in fmt.split()[0]:
+            area = area[..., :3]
+        return np.ascontiguousarray(area).tobytes()
+
+    def set(self, rect, fmt, data):
+        self.data = bytes(data)  # GEGL copies the pixels into its tiles
+
+    def flush(self):
+        pass
+
+
+class FakeLayer:
+    """Gimp.Layer stand-in; only methods the real Layer/Drawable/Item API has."""
+
+    def __init__(self, image, pixels=None, size=None, name='layer'):
+        self._image = image
+        self._pixels = pixels
+        self._size = size or (pixels.shape[1], pixels.shape[0])
+        self._offsets = (0, 0)
+        self._name = name
+        self._buffer = _Buffer(pixels)
+
+    def get_width(self):
+        return self._size[0]
+
+    def get_height(self):
+        return self._size[1]
+
+    def has_alpha(self):
+        return True
+
+    def get_offsets(self):
+        return (True,) + self._offsets
+
+    def set_offsets(self, x, y):
+        self._offsets = (x, y)
+
+    def get_buffer(self):
+        return self._buffer
+
+    def get_image(self):
+        return self._image
+
+    def get_name(self):
+        return self._name
+
+    def set_name(self, name):
+        self._name = name
+
+    def get_parent(self):
+        return None
+
+    def scale(self, width, height, local_origin):
+        self._size = (width, height)
+
+
+class FakeImage:
+    def __init__(self):
+        self.layers = []
+
+    def insert_layer(self, layer, parent, position):
+        self.layers.insert(position if position >= 0 else len(self.layers), layer)
+
+    def get_item_position(self, layer):
+        return self.layers.index(layer)
+
+    def get_base_type(self):
+        return 0  # Gimp.ImageBaseType.RGB
+
+
+def _file_load_layer(run_mode, image, gfile):
+    # Decode fully, as GIMP's loaders do
+    with Image.open(gfile.get_path()) as img:
+        img.load()
+        return FakeLayer(image, size=img.size)
+
+
+def install_gi_stubs():
+    """Register minimal gi / gi.repository modules so the plug-in modules import."""
+    gi = types.ModuleType('gi')
+    gi.require_version = lambda name, version: None
+    repository = types.ModuleType('gi.repository')
+    ns = types.SimpleNamespace
+    repository.Gimp = ns(
+        message=lambda text: None,
+        displays_flush=lambda: None,
+        file_load_layer=_file_load_layer,
+        Layer=ns(new=lambda image, name, width, height, kind, opacity, mode:
+                 FakeLayer(image, size=(width, height), name=name)),
+        ImageBaseType=ns(RGB=0, GRAY=1, INDEXED=2),
+        ImageType=ns(RGB_IMAGE=0, RGBA_IMAGE=1, GRAY_IMAGE=2, GRAYA_IMAGE=3),
+        LayerMode=ns(NORMAL=28),
+        RunMode=ns(NONINTERACTIVE=1),
+        AddMaskType=ns(SELECTION=4),
+        Selection=ns(is_empty=lambda image: True, bounds=lambda image: (True, False, 0, 0, 0, 0)),
+    )
+    repository.Gio = ns(File=ns(new_for_path=lambda path: ns(get_path=lambda: path)))
+    repository.Gegl = ns(Rectangle=_Rectangle, AbyssPolicy=ns(CLAMP=0, NONE=1))
+    repository.GLib = ns(idle_add=lambda fn, *args: fn(*args))
+    gi.repository = repository
+    sys.modules['gi'] = gi
+    sys.modules['gi.repository'] = repository
+
+
+def make_pixels(size, seed=0):
+    """Smooth gradient with mild noise, so encoders see photo-like data."""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, size, dtype=np.float32)
+    pixels = np.empty((size, size, 4), dtype=np.uint8)
+    pixels[..., 0] = ramp[None, :]
+    pixels[..., 1] = ramp[:, None]
+    pixels[..., 2] = 128
+    noise = rng.integers(0, 8, (size, size, 3), dtype=np.uint8)
+    pixels[..., :3] = np.minimum(pixels[..., :3], 247) + noise
+    pixels[..., 3] = 255
+    return pixels
+
+
+# --- Benchmark cases ---
+
+def stage_totals(run_id):
+    """Sum span durations per stage for one traced run."""
+    import tracing
+    totals = {}
+    for span in tracing.read_runs().get(run_id, []):
+        if span['span'] != 'run':
+            totals[span['span']] = totals.get(span['span'], 0.0) + span['ms']
+    return totals
+
+
+def run_single(conf, size, num_images, layer):
+    """One generation on layer, mirroring ui.run_generation's non-interactive path."""
+    import content
+    import falai_wrapper
+    import tracing
+    import utils
+
+    image = layer.get_image()
+    run_conf = dict(conf, num_images=num_images)
+    run_id = tracing.begin_run(run_conf, 'bench', size=size, num_images=num_images)
+    start = time.perf_counter()
+    try:
+        with tracing.span('content'):
+            region = content.content_bbox(*utils.read_pixels(layer))
+        scale = utils.input_scale(run_conf, *region[2:])
+        image_url, input_data, input_key = utils.prepare_input(layer, run_conf, region, scale)
+        paths = falai_wrapper.process_image(
+            run_conf, 'benchmark', input_data=input_data, image_url=image_url, input_key=input_key)
+        for path in paths:
+            utils.import_image(image, path, region[:2], size=region[2:] if scale < 1.0 else None,
+                               scale=scale)
+    finally:
+        tracing.end_run()
+    wall = (time.perf_counter() - start) * 1000
+    for path in paths:
+        os.remove(path)
+    return wall, stage_totals(run_id)
+
+
+def run_batch(conf, size, count, layers):
+    """count layers through the batch scheduler, exporting while earlier jobs run."""
+    import batch
+    import tracing
+    import utils
+
+    run_id = tracing.begin_run(conf, 'bench-batch', size=size, batch=count)
+    start = time.perf_counter()
+    try:
+        scheduler = batch.BatchScheduler(conf, 'benchmark')
+        for layer in layers[:count]:
+            region = (0, 0, size, size)
+            image_url, input_data, input_key = utils.prepare_input(layer, conf, region)
+            scheduler.submit(image_url=image_url, input_data=input_data, input_key=input_key)
+        scheduler.close()
+        results = scheduler.wait()
+    finally:
+        tracing.end_run()
+    wall = (time.perf_counter() - start) * 1000
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+        for path in result:
+            os.remove(path)
+    return wall, stage_totals(run_id)
+
+
+def measure(fn, repeat):
+    """Median wall time and per-stage totals over repeat runs."""
+    walls, stages = [], {}
+    for _ in range(repeat):
+        wall, totals = fn()
+        walls.append(wall)
+        for name, ms in totals.items():
+            stages.setdefault(name, []).append(ms)
+    return {
+        'wall_ms': round(statistics.median(walls), 2),
+        'stages_ms': {k: round(statistics.median(v), 2) for k, v in sorted(stages.items())},
+    }
+
+
+def compare(cases, baseline_path, threshold):
+    """Print wall-time changes against a previous results file; return the regressed case names."""
+    with open(baseline_path) as f:
+        baseline = {c['name']: c for c in json.load(f)['cases']}
+    regressed = []
+    print(f"\n{'case':<28} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for case in cases:
+        old = baseline.get(case['name'])
+        if old is None:
+            continue
+        change = case['wall_ms'] / old['wall_ms'] - 1
+        flag = ''
+        if change > threshold:
+            regressed.append(case['name'])
+            flag = '  REGRESSION'
+        print(f"{case['name']:<28} {old['wall_ms']:>10.1f} {case['wall_ms']:>10.1f} {change:>+8.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048, 4096, 8192],
+                        help='square layer edge lengths')
+    parser.add_argument('--num-images', type=int, nargs='+', default=[1, 4, 10])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--batch-layer-size', type=int, default=1024)
+    parser.add_argument('--concurrency', type=int, default=4, help='batch jobs in flight')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='small matrix for a fast check')
+    parser.add_argument('--sync-mode', type=int, choices=[0, 1], default=1,
+                        help='results inline as data URIs (1, the default) or as CDN URLs (0)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--bandwidth', type=float, default=0, help='MB/s cap on bodies (0: unlimited)')
+    parser.add_argument('--queue-delay', type=float, default=0.0)
+    parser.add_argument('--run-delay', type=float, default=0.0)
+    parser.add_argument('-o', '--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='relative wall-time increase reported as a regression')
+    opts = parser.parse_args()
+    if opts.quick:
+        opts.sizes, opts.num_images, opts.batch_sizes, opts.repeat = [512, 1024], [1, 4], [4], 1
+
+    # Keep caches and trace logs of the benchmark away from the user's config
+    config_home = tempfile.mkdtemp(prefix='falai-bench-')
+    os.environ['XDG_CONFIG_HOME'] = config_home
+    install_gi_stubs()
+    sys.path.insert(0, PLUGIN_DIR)
+    sys.path.insert(0, HERE)
+    import fake_fal_server
+    import settings
+
+    server, fake = fake_fal_server.start_server(
+        queue_delay=opts.queue_delay, run_delay=opts.run_delay,
+        latency=opts.latency, bandwidth=opts.bandwidth * 1e6,
+    )
+    conf = dict(
+        settings.DEFAULT_SETTINGS,
+        api_key='bench', model='fal-ai/bench',
+        fal_queue_url=fake.base_url, fal_rest_url=fake.base_url, model_registry_url='',
+        sync_mode=bool(opts.sync_mode), seed=None,
+        # Measure the work itself: no caches, no downscaling
+        use_result_cache=False, upload_cache_ttl_hours=0, max_input_megapixels=0,
+        batch_concurrency=opts.concurrency, batch_submit_rate=0,
+    )
+
+    cases = []
+
+    def _report(case):
+        cases.append(case)
+        stages = ', '.join(f"{k} {v:.0f}" for k, v in case['stages_ms'].items())
+        print(f"{case['name']:<28} {case['wall_ms']:>10.1f} ms   {stages}", flush=True)
+
+    try:
+        for size in opts.sizes:
+            image = FakeImage()
+            layer = FakeLayer(image, make_pixels(size))
+            for n in opts.num_images:
+                result = measure(lambda: run_single(conf, size, n, layer), opts.repeat)
+                _report({'name': f"single-{size}-n{n}", 'kind': 'single', 'size': size,
+                         'num_images': n, **result})
+        image = FakeImage()
+        size = opts.batch_layer_size
+        layers = [FakeLayer(image, make_pixels(size, seed=i)) for i in range(max(opts.batch_sizes))]
+        for count in opts.batch_sizes:
+            result = measure(lambda: run_batch(dict(conf, num_images=1), size, count, layers), opts.repeat)
+            _report({'name': f"batch-{size}-x{count}", 'kind': 'batch', 'size': size,
+                     'batch': count, 'concurrency': opts.concurrency, **result})
+    finally:
+        server.shutdown()
+
+    results = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': {k: v for k, v in vars(opts).items() if k not in ('output', 'compare')},
+        },
+        'cases': cases,
+    }
+    with open(opts.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {opts.output}")
+
+    if opts.compare:
+        regressed = compare(cases, opts.compare, opts.threshold)
+        if regressed:
+            print(f"{len(regressed)} case(s) regressed by more than {opts.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
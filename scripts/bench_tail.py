@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tail-latency benchmark for hedged requests against the fake fal server.
+
+Runs --requests sequential text-to-image generations through process_image
+with every --straggler-every-th request held in the queue for
+--straggler-delay seconds, once without and once with hedging, and reports
+p50/p95/max latency and the extra submissions hedging cost. The first pass also
+fills the latency history that the hedge point is derived from:
+
+    python3 scripts/bench_tail.py --requests 40 --straggler-every 8 --straggler-delay 3
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(HERE, '..', 'gimp-falai')
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--run-delay', type=float, default=0.3)
+    parser.add_argument('--straggler-every', type=int, default=8)
+    parser.add_argument('--straggler-delay', type=float, default=3.0)
+    parser.add_argument('--percentile', type=float, default=90, help='hedge point')
+    opts = parser.parse_args()
+
+    # Keep the latency history away from the user's config
+    os.environ['XDG_CONFIG_HOME'] = tempfile.mkdtemp(prefix='falai-bench-')
+    sys.path.insert(0, PLUGIN_DIR)
+    sys.path.insert(0, HERE)
+    import falai_wrapper
+    import fake_fal_server
+    import settings
+
+    server, fake = fake_fal_server.start_server(
+        queue_delay=0.05, run_delay=opts.run_delay, image_size=64,
+        straggler_every=opts.straggler_every, straggler_delay=opts.straggler_delay)
+    conf = dict(
+        settings.DEFAULT_SETTINGS,
+        api_key='bench', model='fal-ai/bench', model_registry_url='',
+        fal_queue_url=fake.base_url, fal_rest_url=fake.base_url,
+        use_result_cache=False, dedup_inflight=False, trace_enabled=False,
+        hedge_percentile=opts.percentile, hedge_max_per_hour=opts.requests,
+    )
+
+    print(f"{opts.requests} requests, every {opts.straggler_every}th "
+          f"{opts.straggler_delay:g} s slower")
+    print(f"{'mode':<8} {'p50 s':>7} {'p95 s':>7} {'max s':>7} {'submits':>8}")
+    for mode, hedge in (('plain', False), ('hedged', True)):
+        conf['hedge_enabled'] = hedge
+        submits = fake.counts.get('submit', 0)
+        latencies = []
+        for i in range(opts.requests):
+            start = time.perf_counter()
+            paths = falai_wrapper.process_image(conf, f"bench {mode} {i}")
+            latencies.append(time.perf_counter() - start)
+            falai_wrapper.discard_outputs(paths)
+        print(f"{mode:<8} {statistics.median(latencies):>7.2f} {percentile(latencies, 95):>7.2f} "
+              f"{max(latencies):>7.2f} {fake.counts['submit'] - submits:>8}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Upload benchmark and resume check against the fake fal storage server.
+
+Sends one --size-mb payload three ways and verifies the stored bytes each time:
+
+- single: one POST /files/upload request (the path below the threshold)
+- multipart: parallel parts through gimp-falai/uploads.py
+- resumed: a multipart upload aborted after --abort-after parts, then restarted;
+  only the missing parts may be sent again
+
+--bandwidth caps each connection (as a long, lossy uplink path does), so parallel
+parts finish sooner; --drop-parts makes the server drop every Nth part to
+exercise the retries:
+
+    python3 scripts/bench_upload.py --size-mb 64 --bandwidth 8 --drop-parts 5
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR = os.path.join(HERE, '..', 'gimp-falai')
+
+
+class Abort(Exception):
+    pass
+
+
+def stored(fake, url):
+    return fake.files[url.rsplit('/', 1)[1]][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size-mb', type=float, default=64)
+    parser.add_argument('--part-mb', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--bandwidth', type=float, default=16, help='MB/s per connection (0: unlimited)')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to each response')
+    parser.add_argument('--drop-parts', type=int, default=0, help='drop every Nth part upload')
+    parser.add_argument('--abort-after', type=int, default=3, help='parts sent before the abort')
+    opts = parser.parse_args()
+
+    # Keep resume state away from the user's config
+    os.environ['XDG_CONFIG_HOME'] = tempfile.mkdtemp(prefix='falai-bench-')
+    sys.path.insert(0, PLUGIN_DIR)
+    sys.path.insert(0, HERE)
+    importlib.import_module('falai_wrapper')  # Puts the vendored fal_client and httpx on sys.path
+    import fake_fal_server
+    import fal_api
+    import uploads
+
+    server, fake = fake_fal_server.start_server(
+        latency=opts.latency, bandwidth=opts.bandwidth * 1e6, drop_parts=opts.drop_parts)
+    conf = {
+        'api_key': 'bench', 'fal_queue_url': fake.base_url, 'fal_rest_url': fake.base_url,
+        'multipart_threshold_mb': 1, 'multipart_part_mb': opts.part_mb,
+        'multipart_concurrency': opts.concurrency, 'http_max_connections': opts.concurrency + 2,
+    }
+    data = os.urandom(int(opts.size_mb * 1024 * 1024))
+    source = uploads.Source(data)
+    failed = False
+    print(f"{len(data) / 1e6:.1f} MB payload, {opts.bandwidth:g} MB/s per connection")
+
+    def report(name, url, seconds, parts=None):
+        nonlocal failed
+        ok = stored(fake, url) == data
+        failed = failed or not ok
+        extra = f"  {parts} parts sent" if parts is not None else ''
+        print(f"{name:<10} {seconds:7.2f} s  {len(data) / 1e6 / seconds:7.1f} MB/s  "
+              f"{'ok' if ok else 'CORRUPT'}{extra}")
+
+    start = time.perf_counter()
+    url = fal_api.upload(conf, data, 'application/octet-stream')
+    report('single', url, time.perf_counter() - start)
+
+    before = fake.counts.get('part', 0)
+    start = time.perf_counter()
+    url = uploads.upload(conf, source, 'application/octet-stream', key='bench-multipart')
+    report('multipart', url, time.perf_counter() - start, fake.counts['part'] - before)
+
+    # Abort once enough parts are through, as a dropped uplink or closed GIMP would
+    sent = []
+
+    def _check():
+        if len(sent) >= opts.abort_after:
+            raise Abort()
+
+    try:
+        uploads.upload(conf, source, 'application/octet-stream', key='bench-resume',
+                       on_progress=lambda done, total: sent.append(done), check=_check)
+    except Abort:
+        pass
+    before = fake.counts['part']
+    start = time.perf_counter()
+    url = uploads.upload(conf, source, 'application/octet-stream', key='bench-resume')
+    resent = fake.counts['part'] - before
+    report('resumed', url, time.perf_counter() - start, resent)
+    total = -(-len(data) // (opts.part_mb * 1024 * 1024))
+    if not opts.drop_parts and resent > total - len(sent):
+        print(f"Resume sent {resent} parts; at most {total - len(sent)} were missing")
+        failed = True
+
+    server.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the fal.ai queue, storage (including multipart uploads) and
+CDN endpoints.
+
+Serves just enough of the REST API used by gimp-falai/fal_api.py to run the
+plug-in, falai_cli.py or the benchmarks without network access or an API key.
+Generated "images" echo the uploaded input, or are solid-colour PNGs for
+text-to-image requests. Point the plug-in at it with
+
+    python3 scripts/fake_fal_server.py --port 8765
+    python3 gimp-falai/falai_cli.py --endpoint http://127.0.0.1:8765 --prompt test in.png
+"""
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# Granularity of bandwidth throttling
+THROTTLE_CHUNK = 64 * 1024
+
+
+def solid_png(width, height, rgb=(128, 96, 160)):
+    """Encode a solid-colour RGB PNG without needing Pillow."""
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    row = b'\x00' + bytes(rgb) * width
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(row * height, 1))
+        + chunk(b'IEND', b'')
+    )
+
+
+class FakeFal:
+    """In-memory state shared by all request handlers."""
+
+    def __init__(self, queue_delay=0.2, run_delay=0.5, image_size=512, connect_delay=0.0,
+                 latency=0.0, bandwidth=0, drop_parts=0, straggler_every=0, straggler_delay=0.0,
+                 key_concurrency=0, key_rate=0):
+        self.queue_delay = queue_delay
+        self.run_delay = run_delay
+        self.image_size = image_size
+        # Simulated DNS + TCP + TLS setup cost, paid once per new connection
+        self.connect_delay = connect_delay
+        # Round-trip time added to every response, and a bytes/second cap on
+        # request and response bodies (0: unlimited)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # Drop the connection on every Nth multipart part upload (0: never)
+        self.drop_parts = drop_parts
+        # Every Nth submitted request runs straggler_delay seconds longer (0: never)
+        self.straggler_every = straggler_every
+        self.straggler_delay = straggler_delay
+        # Per API key: unfinished requests and submissions per minute (0: unlimited);
+        # submissions beyond either get a 429 with Retry-After, as fal's limits do
+        self.key_concurrency = key_concurrency
+        self.key_rate = key_rate
+        self.key_submits = {}
+        self.base_url = None
+        self.files = {}
+        self.uploads = {}
+        self.requests = {}
+        self.counts = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def new_id(self):
+        with self._lock:
+            return f"{next(self._ids):08d}"
+
+    def store_file(self, data, content_type):
+        file_id = self.new_id()
+        self.files[file_id] = (data, content_type)
+        return f"{self.base_url}/files/{file_id}"
+
+    def output_for(self, args):
+        """Return (bytes, content_type) of the image generated for args."""
+        image_url = args.get('image_url') or ''
+        prefix = f"{self.base_url}/files/"
+        if image_url.startswith(prefix) and image_url[len(prefix):] in self.files:
+            return self.files[image_url[len(prefix):]]
+        return solid_png(self.image_size, self.image_size), 'image/png'
+
+    def admit(self, key):
+        """Record a submission for key; returns False if it is over the key's limits."""
+        with self._lock:
+            now = time.monotonic()
+            submits = [t for t in self.key_submits.get(key, []) if now - t < 60]
+            active = sum(1 for r in list(self.requests.values())
+                         if r['key'] == key and self.status(r)['status'] != 'COMPLETED')
+            if ((self.key_concurrency and active >= self.key_concurrency)
+                    or (self.key_rate and len(submits) >= self.key_rate)):
+                self.key_submits[key] = submits
+                return False
+            self.key_submits[key] = submits + [now]
+            return True
+
+    def status(self, req):
+        elapsed = time.monotonic() - req['created'] - req['extra_delay']
+        if req['cancelled']:
+            return {'status': 'COMPLETED', 'logs': [], 'error': 'cancelled'}
+        if elapsed < self.queue_delay:
+            position = sum(
+                1 for r in list(self.requests.values())
+                if r['created'] < req['created'] and time.monotonic() - r['created'] < self.queue_delay
+            )
+            return {'status': 'IN_QUEUE', 'queue_position': position}
+        if elapsed < self.queue_delay + self.run_delay:
+            return {'status': 'IN_PROGRESS', 'logs': [{'message': f"step {int(elapsed * 10)}"}]}
+        return {'status': 'COMPLETED', 'logs': [], 'metrics': {'inference_time': self.run_delay}}
+
+    def result(self, req):
+        args = req['args']
+        data, content_type = self.output_for(args)
+        images = []
+        for _ in range(int(args.get('num_images') or 1)):
+            if args.get('sync_mode'):
+                url = f"data:{content_type};base64,{base64.b64encode(data).decode('ascii')}"
+            else:
+                url = self.store_file(data, content_type)
+            images.append({'url': url, 'content_type': content_type})
+        return {'images': images, 'seed': args.get('seed'), 'prompt': args.get('prompt')}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without TCP_NODELAY keep-alive
+    # responses stall on delayed ACKs
+    disable_nagle_algorithm = True
+    fake = None  # Set by make_server
+
+    def setup(self):
+        super().setup()
+        self.fake.count('connection')
+        if self.fake.connect_delay:
+            time.sleep(self.fake.connect_delay)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _throttle(self, nbytes):
+        if self.fake.bandwidth:
+            time.sleep(nbytes / self.fake.bandwidth)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        chunks = []
+        while length > 0:
+            chunk = self.rfile.read(min(length, THROTTLE_CHUNK))
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b''.join(chunks)
+
+    def _send(self, status, data=b'', content_type='application/json', headers=None):
+        if isinstance(data, (dict, list)):
+            data = json.dumps(data).encode('utf-8')
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.write_body(data)
+
+    def write_body(self, data):
+        if not self.fake.bandwidth:
+            self.wfile.write(data)
+            return
+        view = memoryview(data)
+        for start in range(0, len(view), THROTTLE_CHUNK):
+            chunk = view[start:start + THROTTLE_CHUNK]
+            self.wfile.write(chunk)
+            self._throttle(len(chunk))
+
+    def do_POST(self):
+        fake = self.fake
+        path = urlparse(self.path).path
+        body = self._body()
+        if path == '/storage/auth/token':
+            fake.count('token')
+            fake.count(f"token:{self.headers.get('Authorization', '').split(' ', 1)[-1]}")
+            return self._send(200, {
+                'token': 'fake-token', 'token_type': 'Bearer',
+                'base_url': fake.base_url, 'expires_at': '2099-01-01T00:00:00+00:00',
+            })
+        if path == '/files/upload':
+            fake.count('upload')
+            url = fake.store_file(body, self.headers.get('Content-Type', 'application/octet-stream'))
+            return self._send(200, {'access_url': url})
+        if path == '/files/upload/multipart':
+            fake.count('multipart')
+            file_id, upload_id = fake.new_id(), f"upload-{fake.new_id()}"
+            fake.uploads[upload_id] = {
+                'file_id': file_id, 'parts': {},
+                'content_type': self.headers.get('Content-Type', 'application/octet-stream'),
+            }
+            return self._send(200, {
+                'access_url': f"{fake.base_url}/files/{file_id}", 'uploadId': upload_id,
+            })
+        parts = path.strip('/').split('/')
+        if parts[0] == 'files' and parts[2:3] == ['multipart'] and parts[-1] == 'complete':
+            upload = fake.uploads.get(parts[3])
+            if upload is None:
+                return self._send(404, {'detail': 'Unknown upload'})
+            fake.count('complete')
+            listed = json.loads(body)['parts']
+            if any(upload['parts'].get(p['partNumber'], (None, None))[0] != p['etag'] for p in listed):
+                return self._send(400, {'detail': 'Part ETag mismatch'})
+            data = b''.join(upload['parts'][p['partNumber']][1]
+                            for p in sorted(listed, key=lambda p: p['partNumber']))
+            fake.files[upload['file_id']] = (data, upload['content_type'])
+            del fake.uploads[parts[3]]
+            return self._send(200, {})
+        # Anything else is a queue submission for the model at this path
+        key = self.headers.get('Authorization', '')
+        if not fake.admit(key):
+            fake.count('rate_limited')
+            return self._send(429, {'detail': 'Rate limit exceeded'}, headers={'Retry-After': '1'})
+        fake.count('submit')
+        fake.count(f"submit:{key.split(' ', 1)[-1]}")
+        request_id = fake.new_id()
+        straggler = fake.straggler_every and fake.counts['submit'] % fake.straggler_every == 0
+        fake.requests[request_id] = {
+            'model': path.strip('/'),
+            'key': key,
+            'args': json.loads(body or b'{}'),
+            'created': time.monotonic(),
+            'extra_delay': fake.straggler_delay if straggler else 0.0,
+            'cancelled': False,
+        }
+        base = f"{fake.base_url}/requests/{request_id}"
+        return self._send(200, {
+            'request_id': request_id,
+            'response_url': base,
+            'status_url': f"{base}/status",
+            'cancel_url': f"{base}/cancel",
+        })
+
+    def do_GET(self):
+        fake = self.fake
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts[0] == 'files' and len(parts) == 2 and parts[1] in fake.files:
+            fake.count('download')
+            data, content_type = fake.files[parts[1]]
+            match = (self.headers.get('Range') or '').replace('bytes=', '').split('-')
+            if match[0].isdigit():
+                start = int(match[0])
+                return self._send(206, data[start:], content_type, {
+                    'Content-Range': f"bytes {start}-{len(data) - 1}/{len(data)}",
+                })
+            return self._send(200, data, content_type)
+        if parts[0] == 'requests' and len(parts) >= 2 and parts[1] in fake.requests:
+            req = fake.requests[parts[1]]
+            if parts[-1] == 'status':
+                fake.count('status')
+                return self._send(200, fake.status(req))
+            fake.count('result')
+            return self._send(200, fake.result(req))
+        self._send(404, {'detail': 'Not found'})
+
+    def do_PUT(self):
+        fake = self.fake
+        body = self._body()
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if parts[0] == 'files' and parts[2:3] == ['multipart'] and len(parts) == 5:
+            upload = fake.uploads.get(parts[3])
+            if upload is None:
+                return self._send(404, {'detail': 'Unknown upload'})
+            fake.count('part')
+            if fake.drop_parts and fake.counts['part'] % fake.drop_parts == 0:
+                self.close_connection = True
+                return  # No response: the client sees a dropped connection
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            upload['parts'][int(parts[4])] = (etag, body)
+            return self._send(200, b'', headers={'ETag': etag})
+        if parts[0] == 'requests' and parts[-1] == 'cancel' and parts[1] in fake.requests:
+            fake.count('cancel')
+            fake.requests[parts[1]]['cancelled'] = True
+            return self._send(202, {'status': 'CANCELLATION_REQUESTED'})
+        self._send(404, {'detail': 'Not found'})
+
+
+def make_server(host='127.0.0.1', port=0, handler=Handler, **options):
+    """Create a fake server (port 0 picks a free port); returns (server, fake)."""
+    fake = FakeFal(**options)
+    handler_cls = type('BoundHandler', (handler,), {'fake': fake})
+    server = ThreadingHTTPServer((host, port), handler_cls)
+    server.daemon_threads = True
+    fake.base_url = f"http://{host}:{server.server_address[1]}"
+    return server, fake
+
+
+def start_server(**options):
+    """Start a fake server on a background thread and return (server, fake)."""
+    server, fake = make_server(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for fal.ai endpoints.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--queue-delay', type=float, default=0.2, help='seconds a request stays queued')
+    parser.add_argument('--run-delay', type=float, default=0.5, help='seconds of simulated inference')
+    parser.add_argument('--image-size', type=int, default=512, help='edge of generated text-to-image PNGs')
+    parser.add_argument('--connect-delay', type=float, default=0.0, help='seconds added to each new connection')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each response')
+    parser.add_argument('--bandwidth', type=float, default=0, help='body transfer cap in MB/s (0: unlimited)')
+    parser.add_argument('--drop-parts', type=int, default=0,
+                        help='drop the connection on every Nth multipart part (0: never)')
+    parser.add_argument('--straggler-every', type=int, default=0,
+                        help='make every Nth request slow (0: never)')
+    parser.add_argument('--straggler-delay', type=float, default=10.0,
+                        help='extra seconds a slow request takes')
+    parser.add_argument('--key-concurrency', type=int, default=0,
+                        help='unfinished requests allowed per API key (0: unlimited)')
+    parser.add_argument('--key-rate', type=int, default=0,
+                        help='submissions per minute allowed per API key (0: unlimited)')
+    opts = parser.parse_args()
+    server, fake = make_server(
+        opts.host, opts.port,
+        queue_delay=opts.queue_delay, run_delay=opts.run_delay, image_size=opts.image_size,
+        connect_delay=opts.connect_delay, latency=opts.latency, bandwidth=opts.bandwidth * 1e6,
+        drop_parts=opts.drop_parts, straggler_every=opts.straggler_every,
+        straggler_delay=opts.straggler_delay, key_concurrency=opts.key_concurrency,
+        key_rate=opts.key_rate,
+    )
+    print(f"Fake fal.ai server listening on {fake.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""
+Shared setup for the unit tests of the plug-in's GIMP-independent modules.
+
+The modules are imported by bare name, as GIMP loads them from the plug-in
+folder. Tests that touch state files point them at a per-test directory.
+"""
+
+import os
+import sys
+import tempfile
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'gimp-falai')
+
+# settings resolves CONFIG_DIR at import time; keep it away from the user's config
+os.environ['XDG_CONFIG_HOME'] = tempfile.mkdtemp(prefix='falai-tests-')
+sys.path.insert(0, PLUGIN_DIR)
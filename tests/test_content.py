@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+import content
+
+
+@pytest.fixture(params=['numpy', 'bytes'])
+def scan(request, monkeypatch):
+    """Run each test with NumPy and with the pure bytes fallback."""
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(content, 'np', None)
+    return content
+
+
+def _rgba(width, height, opaque=()):
+    data = bytearray(width * height * 4)
+    for x, y in opaque:
+        data[(y * width + x) * 4 + 3] = 255
+    return bytes(data)
+
+
+def _brute_bbox(width, opaque):
+    if not opaque:
+        return None
+    xs, ys = [x for x, _ in opaque], [y for _, y in opaque]
+    return (min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+
+
+def test_transparent_layer_has_no_content(scan):
+    assert scan.content_bbox(_rgba(300, 600), 300, 600, 4) is None
+
+
+def test_single_pixel_in_a_later_band(scan):
+    data = _rgba(300, 600, [(7, 500)])
+    assert scan.content_bbox(data, 300, 600, 4) == (7, 500, 1, 1)
+
+
+def test_bbox_spans_all_covered_pixels(scan):
+    data = _rgba(40, 30, [(3, 20), (35, 4), (10, 10)])
+    assert scan.content_bbox(data, 40, 30, 4) == (3, 4, 33, 17)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bbox_across_band_boundaries(scan, seed):
+    rng = random.Random(seed)
+    width, height = 3 * content.TILE_ROWS + 17, 2 * content.TILE_ROWS + 5
+    opaque = [(rng.randrange(width), rng.randrange(height)) for _ in range(rng.randrange(1, 4))]
+    data = _rgba(width, height, opaque)
+    assert scan.content_bbox(data, width, height, 4) == _brute_bbox(width, opaque)
+
+
+def test_content_on_the_last_row_and_column(scan):
+    width, height = content.TILE_ROWS + 1, content.TILE_ROWS + 1
+    data = _rgba(width, height, [(width - 1, height - 1)])
+    assert scan.content_bbox(data, width, height, 4) == (width - 1, height - 1, 1, 1)
+
+
+def test_gray_alpha(scan):
+    data = bytearray(10 * 5 * 2)
+    data[(2 * 10 + 6) * 2 + 1] = 1
+    assert scan.content_bbox(bytes(data), 10, 5, 2) == (6, 2, 1, 1)
+
+
+def test_layers_without_alpha_are_full(scan):
+    assert scan.content_bbox(bytes(12 * 8 * 3), 12, 8, 3) == (0, 0, 12, 8)
+
+
+def test_empty_extent(scan):
+    assert scan.content_bbox(b'', 10, 0, 4) is None
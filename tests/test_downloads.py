@@ -0,0 +1,92 @@
+import base64
+import json
+import os
+
+import pytest
+
+import downloads
+
+PAYLOAD = bytes(range(256)) * 40
+
+
+def _extract(document, chunk_size):
+    extractor = downloads.DataURIExtractor()
+    try:
+        for start in range(0, len(document), chunk_size):
+            extractor.feed(document[start:start + chunk_size])
+        return extractor.result(), extractor.paths
+    except BaseException:
+        extractor.discard()
+        raise
+
+
+def _read_local(url):
+    assert url.startswith(downloads.LOCAL_PREFIX)
+    path = url[len(downloads.LOCAL_PREFIX):]
+    with open(path, 'rb') as f:
+        data = f.read()
+    os.remove(path)
+    return data, path
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64, 1 << 20])
+def test_data_uris_are_decoded_to_files(chunk_size):
+    uri = 'data:image/png;base64,' + base64.b64encode(PAYLOAD).decode('ascii')
+    document = json.dumps({
+        'images': [{'url': uri, 'width': 8}, {'url': 'https://cdn.example/a.png'}],
+        'prompt': 'data: a, b',
+        'seed': 7,
+    }).encode('utf-8')
+    result, paths = _extract(document, chunk_size)
+    data, path = _read_local(result['images'][0]['url'])
+    assert data == PAYLOAD
+    assert paths == [path] and path.endswith('.png')
+    assert result['images'][1]['url'] == 'https://cdn.example/a.png'
+    assert result['prompt'] == 'data: a, b'
+    assert result['seed'] == 7
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 1 << 20])
+def test_escaped_slashes_are_undone(chunk_size):
+    encoded = base64.b64encode(PAYLOAD).decode('ascii')
+    assert '/' in encoded
+    document = ('{"image": "data:image/jpeg;base64,' + encoded.replace('/', '\\/') + '"}').encode()
+    result, _ = _extract(document, chunk_size)
+    assert _read_local(result['image'])[0] == PAYLOAD
+
+
+def test_strings_that_only_look_like_data_uris_are_kept():
+    document = json.dumps({
+        'a': 'data:text/plain,hello',
+        'b': 'data:',
+        'c': 'data:' + 'x' * 1000 + ',y',
+    }).encode('utf-8')
+    result, paths = _extract(document, 4)
+    assert paths == []
+    assert result == json.loads(document)
+
+
+def test_other_escapes_are_refused():
+    document = b'{"image": "data:image/png;base64,AAAA\\u002fAAAA"}'
+    with pytest.raises(downloads.UnsupportedEscape):
+        _extract(document, 1 << 20)
+
+
+def test_unterminated_data_uri_is_an_error():
+    extractor = downloads.DataURIExtractor()
+    extractor.feed(b'{"image": "data:image/png;base64,AAAA')
+    with pytest.raises(ValueError):
+        extractor.result()
+    paths = list(extractor.paths)
+    extractor.discard()
+    assert paths and not any(os.path.exists(p) for p in paths)
+
+
+def test_decode_inline_walks_parsed_json():
+    value = {'images': [{'url': 'data:image/png;base64,' + base64.b64encode(PAYLOAD).decode()}],
+             'note': 'data: not an image'}
+    paths = []
+    result = downloads._decode_inline(value, paths)
+    assert _read_local(result['images'][0]['url'])[0] == PAYLOAD
+    assert result['note'] == 'data: not an image'
+    assert len(paths) == 1
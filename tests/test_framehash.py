@@ -0,0 +1,53 @@
+from collections import namedtuple
+
+import pytest
+
+import framehash
+
+np = pytest.importorskip('numpy')
+
+# Same layout as utils.Pixels, which needs GIMP to import
+Pixels = namedtuple('Pixels', ['data', 'width', 'height', 'bpp'])
+
+
+def _frame(seed=0, square=None, noise=0, size=96):
+    rng = np.random.default_rng(seed)
+    a = np.tile(np.linspace(0, 255, size, dtype=np.float32), (size, 1))
+    a = np.stack([a, a.T, np.full_like(a, 80)], axis=-1)
+    if noise:
+        a += rng.integers(-noise, noise + 1, a.shape)
+    if square:
+        x, y = square
+        a[y:y + 12, x:x + 12] = 255
+    return Pixels(a.clip(0, 255).astype(np.uint8).tobytes(), size, size, 3)
+
+
+def test_sample_scale():
+    assert framehash.sample_scale(64, 32) == 1.0
+    assert framehash.sample_scale(1024, 512) == framehash.SAMPLE_EDGE / 1024
+
+
+def test_repeated_and_slightly_noisy_frames_are_grouped():
+    frames = [(96, _frame()), (96, _frame()), (96, _frame(seed=1, noise=1))]
+    assert framehash.group_frames(frames) == [0, 0, 0]
+
+
+def test_moving_object_starts_a_new_group():
+    frames = [(96, _frame(square=(10, 10))), (96, _frame(square=(60, 60))),
+              (96, _frame(square=(10, 10)))]
+    assert framehash.group_frames(frames) == [0, 1, 0]
+
+
+def test_frames_with_different_keys_are_never_grouped():
+    frames = [((96, 96), _frame()), ((96, 97), _frame())]
+    assert framehash.group_frames(frames) == [0, 1]
+
+
+def test_without_numpy_only_identical_bytes_match(monkeypatch):
+    monkeypatch.setattr(framehash, 'np', None)
+    frames = [(96, _frame()), (96, _frame(seed=1, noise=1)), (96, _frame())]
+    assert framehash.group_frames(frames) == [0, 1, 0]
+
+
+def test_no_frames():
+    assert framehash.group_frames([]) == []
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import journal
+
+SETTINGS = {'job_journal_ttl_hours': 24}
+
+
+@pytest.fixture(autouse=True)
+def jobs_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, 'JOBS_DIR', tmp_path / 'jobs')
+
+
+def _handle(request_id):
+    return SimpleNamespace(request_id=request_id, response_url='r', status_url='s', cancel_url='c')
+
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def _set_owner(request_id, pid, host=None):
+    path = journal.JOBS_DIR / f"{request_id}.json"
+    entry = journal.read_json(path, None)
+    entry['owner_pid'] = pid
+    if host is not None:
+        entry['owner_host'] = host
+    journal.write_json(path, entry)
+
+
+def test_entries_of_a_live_process_are_not_pending():
+    journal.record(SETTINGS, _handle('mine'), 'fal-ai/test', {}, {})
+    assert journal.pending(SETTINGS) == []
+
+
+def test_entries_of_a_dead_process_are_pending():
+    journal.record(SETTINGS, _handle('orphan'), 'fal-ai/test', {}, {})
+    _set_owner('orphan', _dead_pid())
+    assert [e['request_id'] for e in journal.pending(SETTINGS)] == ['orphan']
+
+
+def test_entries_without_owner_are_pending():
+    journal.record(SETTINGS, _handle('old'), 'fal-ai/test', {}, {})
+    path = journal.JOBS_DIR / 'old.json'
+    entry = journal.read_json(path, None)
+    del entry['owner_pid'], entry['owner_host']
+    journal.write_json(path, entry)
+    assert len(journal.pending(SETTINGS)) == 1
+
+
+def test_entries_of_another_host_are_left_to_it():
+    journal.record(SETTINGS, _handle('remote'), 'fal-ai/test', {}, {})
+    _set_owner('remote', os.getpid(), host='elsewhere.invalid')
+    assert journal.pending(SETTINGS) == []
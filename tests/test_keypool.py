@@ -0,0 +1,103 @@
+import httpx
+import pytest
+
+import keypool
+
+
+class Abort(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(keypool, 'USAGE_PATH', tmp_path / 'key_usage.json')
+    monkeypatch.setattr(keypool, '_pools', {})
+
+
+def _settings(*entries, backoff=30):
+    return {'api_keys': [dict(e) for e in entries], 'key_backoff_s': backoff}
+
+
+def _raise():
+    raise Abort
+
+
+def _status_error(status, headers=None):
+    request = httpx.Request('POST', 'https://queue.example/model')
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError('error', request=request, response=response)
+
+
+def test_no_pool_without_keys():
+    assert keypool.get_pool({}) is None
+    assert keypool.get_pool(_settings({'name': 'a', 'key': ''})) is None
+
+
+def test_pool_is_shared_per_key_list():
+    settings = _settings({'name': 'a', 'key': 'ka'})
+    assert keypool.get_pool(settings) is keypool.get_pool(dict(settings))
+    assert keypool.get_pool(settings) is not keypool.get_pool(_settings({'name': 'a', 'key': 'kb'}))
+
+
+def test_leases_spread_and_respect_limits():
+    pool = keypool.get_pool(_settings(
+        {'name': 'a', 'key': 'ka', 'max_concurrent': 2},
+        {'name': 'b', 'key': 'kb', 'max_concurrent': 1}))
+    assert pool.total_concurrency() == 3
+    names = sorted(pool.acquire() for _ in range(3))
+    assert names == ['a', 'a', 'b']
+    waited = []
+    with pytest.raises(Abort):
+        pool.acquire(check=_raise, on_wait=lambda: waited.append(True))
+    assert waited == [True]
+    pool.release('b')
+    assert pool.acquire(check=_raise) == 'b'
+
+
+def test_unlimited_key_has_no_total():
+    pool = keypool.get_pool(_settings({'name': 'a', 'key': 'ka'}, {'name': 'b', 'key': 'kb',
+                                                                   'max_concurrent': 1}))
+    assert pool.total_concurrency() is None
+
+
+def test_rate_limited_key_rests():
+    pool = keypool.get_pool(_settings({'name': 'a', 'key': 'ka'}, {'name': 'b', 'key': 'kb'}))
+    first = pool.acquire()
+    pool.release(first, rate_limited=True, retry_after=60)
+    other = 'b' if first == 'a' else 'a'
+    assert [pool.acquire() for _ in range(3)] == [other] * 3
+    usage = keypool.usage()
+    assert usage[first] == {'requests': 1, 'rate_limited': 1, 'failures': 0,
+                            'last_used': usage[first]['last_used']}
+    assert usage[other]['requests'] == 3
+
+
+def test_requests_per_minute():
+    pool = keypool.get_pool(_settings({'name': 'a', 'key': 'ka', 'requests_per_minute': 1}))
+    pool.release(pool.acquire())
+    with pytest.raises(Abort):
+        pool.acquire(check=_raise)
+
+
+def test_with_key_and_key_for():
+    settings = _settings({'name': 'a', 'key': 'ka'})
+    keyed = keypool.with_key(settings, 'a', 'ka')
+    assert keyed['api_key'] == 'ka' and keyed['api_key_name'] == 'a'
+    assert 'api_key' not in settings
+    assert keypool.key_for(settings, 'a') == 'ka'
+    assert keypool.key_for(settings, 'missing') is None
+
+
+def test_is_rate_limited():
+    assert keypool.is_rate_limited(_status_error(429, {'Retry-After': '7'})) == (True, 7.0)
+    assert keypool.is_rate_limited(_status_error(429)) == (True, None)
+    assert keypool.is_rate_limited(_status_error(500)) == (False, None)
+    wrapped = RuntimeError('submit failed')
+    wrapped.__cause__ = _status_error(429, {'Retry-After': 'soon'})
+    assert keypool.is_rate_limited(wrapped) == (True, None)
+
+
+def test_failures_are_counted():
+    keypool.record_failure('a')
+    keypool.record_failure('a')
+    assert keypool.usage()['a']['failures'] == 2
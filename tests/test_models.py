@@ -0,0 +1,115 @@
+import time
+
+import pytest
+
+import models
+from settings import write_json
+
+KONTEXT = 'fal-ai/flux-pro/kontext'
+SETTINGS = {'model_registry_url': ''}
+
+
+@pytest.fixture(autouse=True)
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(models, 'REGISTRY_PATH', tmp_path / 'models.json')
+    monkeypatch.setattr(models, '_fetched', set())
+
+
+def _register(model, caps):
+    write_json(models.REGISTRY_PATH, {
+        'version': models.REGISTRY_VERSION,
+        'models': {model: dict(caps, fetched=time.time())},
+    })
+
+
+def test_unaccepted_and_unset_parameters_are_dropped():
+    args = models.prepare_args(SETTINGS, KONTEXT, {
+        'prompt': 'a cat', 'image_url': None, 'seed': None, 'num_inference_steps': 20,
+        'num_images': 2,
+    }, fetch=False)
+    assert args == {'prompt': 'a cat', 'image_url': None, 'num_images': 2}
+
+
+def test_values_outside_the_schema_are_rejected():
+    with pytest.raises(RuntimeError, match='num_images between 1 and 4'):
+        models.prepare_args(SETTINGS, KONTEXT, {'prompt': 'x', 'image_url': None,
+                                                'num_images': 5}, fetch=False)
+    with pytest.raises(RuntimeError, match='expected one of'):
+        models.prepare_args(SETTINGS, KONTEXT, {'prompt': 'x', 'image_url': None,
+                                                'output_format': 'gif'}, fetch=False)
+
+
+def test_enum_values_take_the_schema_type():
+    args = models.prepare_args(SETTINGS, KONTEXT, {'prompt': 'x', 'image_url': None,
+                                                   'safety_tolerance': 2}, fetch=False)
+    assert args['safety_tolerance'] == '2'
+
+
+def test_required_inputs():
+    with pytest.raises(RuntimeError, match='requires an input image'):
+        models.prepare_args(SETTINGS, KONTEXT, {'prompt': 'x'}, fetch=False)
+    with pytest.raises(RuntimeError, match="requires 'prompt'"):
+        models.prepare_args(SETTINGS, 'fal-ai/flux/dev', {'seed': 1}, fetch=False)
+
+
+def test_unknown_models_get_every_set_argument():
+    args = models.prepare_args(SETTINGS, 'someone/new-model', {'prompt': 'x', 'seed': None,
+                                                              'anything': 3}, fetch=False)
+    assert args == {'prompt': 'x', 'anything': 3}
+
+
+def test_models_without_image_outputs_are_refused():
+    _register('fal-ai/speech', {'inputs': {'text': {'type': 'string'}}, 'required': [],
+                                'outputs': ['audio']})
+    with pytest.raises(RuntimeError, match='not images'):
+        models.prepare_args(SETTINGS, 'fal-ai/speech', {'text': 'hi'}, fetch=False)
+
+
+def test_image_url_goes_to_image_urls_models():
+    _register('fal-ai/multi', {'inputs': {'prompt': {'type': 'string'},
+                                          'image_urls': {'type': 'array'}},
+                               'required': ['prompt', 'image_urls'], 'outputs': ['images']})
+    args = models.prepare_args(SETTINGS, 'fal-ai/multi', {'prompt': 'x', 'image_url': None},
+                               fetch=False)
+    args['image_url'] = 'https://cdn.example/in.png'
+    assert models.finalize_args(SETTINGS, 'fal-ai/multi', args) == {
+        'prompt': 'x', 'image_urls': ['https://cdn.example/in.png']}
+
+
+def test_maximum_comes_from_the_schema():
+    assert models.maximum(SETTINGS, KONTEXT, 'num_images', 10) == 4
+    assert models.maximum(SETTINGS, 'someone/new-model', 'num_images', 10) == 10
+
+
+def test_pixel_budget_prefers_the_users_override():
+    assert models.capabilities(SETTINGS, KONTEXT, fetch=False)['max_megapixels'] == 1.0
+    override = dict(SETTINGS, model_max_megapixels={KONTEXT: 3})
+    assert models.capabilities(override, KONTEXT, fetch=False)['max_megapixels'] == 3
+    assert models.capabilities(SETTINGS, 'fal-ai/flux/dev', fetch=False)['max_megapixels'] is None
+
+
+def test_parse_openapi():
+    spec = {
+        'paths': {
+            '/fal-ai/edit': {'post': {'requestBody': {'content': {'application/json': {
+                'schema': {'$ref': '#/components/schemas/Input'}}}}}},
+            '/fal-ai/edit/requests/{request_id}': {'get': {'responses': {'200': {'content': {
+                'application/json': {'schema': {'properties': {'images': {}, 'seed': {}}}}}}}}},
+        },
+        'components': {'schemas': {
+            'Input': {'required': ['prompt'], 'properties': {
+                'prompt': {'type': 'string'},
+                'num_images': {'type': 'integer', 'minimum': 1, 'maximum': 4},
+                'format': {'anyOf': [{'enum': ['png']}, {'enum': ['jpeg']}, {'type': 'null'}]},
+                'image_size': {'anyOf': [{'$ref': '#/components/schemas/Size'},
+                                         {'type': 'string', 'enum': ['square']}]},
+            }},
+            'Size': {'properties': {'width': {'maximum': 2000}, 'height': {'maximum': 1000}}},
+        }},
+    }
+    caps = models.parse_openapi(spec, 'fal-ai/edit')
+    assert caps['required'] == ['prompt']
+    assert caps['outputs'] == ['images', 'seed']
+    assert caps['inputs']['num_images'] == {'type': 'integer', 'minimum': 1, 'maximum': 4}
+    assert caps['inputs']['format']['enum'] == ['png', 'jpeg']
+    assert caps['max_megapixels'] == 2.0
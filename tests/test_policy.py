@@ -0,0 +1,79 @@
+import httpx
+import pytest
+
+import policy
+
+MODEL = 'fal-ai/test'
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(policy, 'STATE_PATH', tmp_path / 'latency.json')
+
+
+def _history(seconds):
+    for s in seconds:
+        policy.record_success(MODEL, s)
+
+
+def _status_error(status):
+    request = httpx.Request('GET', 'https://queue.example/model')
+    return httpx.HTTPStatusError('error', request=request,
+                                 response=httpx.Response(status, request=request))
+
+
+def test_no_hedge_or_timeout_without_history():
+    settings = {'hedge_enabled': True}
+    _history([1.0] * (policy.MIN_SAMPLES - 1))
+    assert policy.hedge_after(settings, MODEL) is None
+    assert policy.request_timeout(settings, MODEL) is None
+
+
+def test_hedge_and_timeout_follow_the_latency_percentile():
+    _history(range(1, 21))
+    assert policy.hedge_after({}, MODEL) is None
+    assert policy.hedge_after({'hedge_enabled': True, 'hedge_percentile': 50}, MODEL) == 11
+    assert policy.request_timeout({'request_timeout_min_s': 0}, MODEL) == 4.0 * 19
+    assert policy.request_timeout({}, MODEL) == 120
+    assert policy.request_timeout({'request_timeout_factor': 0}, MODEL) is None
+
+
+def test_latency_history_is_bounded():
+    _history([1.0] * (policy.HISTORY_SIZE + 5))
+    assert len(policy._entry(MODEL)['latency']) == policy.HISTORY_SIZE
+
+
+def test_hedges_are_capped_per_hour():
+    settings = {'hedge_max_per_hour': 2}
+    assert [policy.allow_hedge(settings, MODEL) for _ in range(3)] == [True, True, False]
+
+
+def test_circuit_opens_after_repeated_failures_and_closes_on_success():
+    settings = {'circuit_failures': 2, 'circuit_cooldown_s': 60}
+    policy.record_failure(MODEL)
+    policy.check_circuit(settings, MODEL)
+    policy.record_failure(MODEL)
+    with pytest.raises(policy.CircuitOpenError):
+        policy.check_circuit(settings, MODEL)
+    policy.check_circuit({'circuit_failures': 0}, MODEL)
+    policy.check_circuit(dict(settings, circuit_cooldown_s=0), MODEL)
+    policy.record_success(MODEL, 1.0)
+    policy.check_circuit(settings, MODEL)
+
+
+def test_transient_errors():
+    assert policy.is_transient(policy.RequestTimeout('slow'))
+    assert policy.is_transient(_status_error(503))
+    assert policy.is_transient(_status_error(429))
+    assert not policy.is_transient(_status_error(422))
+    assert policy.is_transient(httpx.ConnectError('refused'))
+    wrapped = RuntimeError('poll failed')
+    wrapped.__cause__ = httpx.ReadTimeout('timed out')
+    assert policy.is_transient(wrapped)
+    assert not policy.is_transient(ValueError('bad'))
+
+
+def test_backoff_is_jittered_exponential():
+    for attempt in range(4):
+        delay = policy.backoff(attempt, base=2.0)
+        assert 2.0 * 2 ** attempt * 0.5 <= delay <= 2.0 * 2 ** attempt * 1.5
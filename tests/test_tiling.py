@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import tiling
+
+
+def _covered(tiles, width, height):
+    covered = set()
+    for x, y, w, h in tiles:
+        covered.update((i, j) for i in range(x, x + w) for j in range(y, y + h))
+    return len(covered) == width * height
+
+
+def test_small_area_is_one_tile():
+    assert tiling.plan_tiles(800, 600, tile=1024, overlap=128) == [(0, 0, 800, 600)]
+
+
+def test_tiles_cover_the_area_within_bounds():
+    tiles = tiling.plan_tiles(250, 130, tile=64, overlap=16)
+    assert _covered(tiles, 250, 130)
+    for x, y, w, h in tiles:
+        assert (w, h) == (64, 64)
+        assert x + w <= 250 and y + h <= 130
+
+
+def test_neighbours_overlap_by_at_least_the_overlap():
+    starts = sorted({x for x, _, _, _ in tiling.plan_tiles(250, 64, tile=64, overlap=16)})
+    assert starts[-1] == 250 - 64
+    assert all(b - a <= 64 - 16 for a, b in zip(starts, starts[1:]))
+
+
+def test_overlap_is_capped_at_half_a_tile():
+    starts = [x for x, _, _, _ in tiling.plan_tiles(200, 10, tile=40, overlap=100)]
+    assert starts[:3] == [0, 20, 40]
+
+
+def test_blend_of_uniform_tiles_is_seamless(tmp_path):
+    np = pytest.importorskip('numpy')
+    Image = pytest.importorskip('PIL.Image')
+    tiles = tiling.plan_tiles(100, 70, tile=48, overlap=12)
+    inputs = []
+    for i, (x, y, w, h) in enumerate(tiles):
+        path = str(tmp_path / f"{i}.png")
+        # Results at another resolution are resized to their tile
+        Image.new('RGB', (w * 2, h * 2), (200, 100, 50)).save(path)
+        inputs.append(((x, y, w, h), path))
+    out = tiling.blend_tiles(inputs, (100, 70), 12)
+    try:
+        with Image.open(out) as img:
+            assert img.size == (100, 70)
+            pixels = np.asarray(img)
+    finally:
+        os.remove(out)
+    assert (np.abs(pixels.astype(int) - [200, 100, 50, 255]) <= 1).all()
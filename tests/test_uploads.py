@@ -0,0 +1,61 @@
+import httpx
+import pytest
+
+import fal_api
+import uploads
+
+PART = 5 * 1024 * 1024
+SETTINGS = {'multipart_threshold_mb': 1, 'multipart_part_mb': 5, 'upload_retries': 0}
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, 'STATE_DIR', tmp_path / 'uploads')
+
+
+def _status_error(status):
+    request = httpx.Request('POST', 'https://rest.example/files/upload/multipart')
+    return httpx.HTTPStatusError('error', request=request,
+                                 response=httpx.Response(status, request=request))
+
+
+class FakeStorage:
+    """fal_api multipart calls; complete() fails with the given statuses first."""
+
+    def __init__(self, monkeypatch, complete_failures=()):
+        self.created = []
+        self.complete_failures = list(complete_failures)
+        monkeypatch.setattr(fal_api, 'multipart_create', self.create)
+        monkeypatch.setattr(fal_api, 'multipart_part', self.part)
+        monkeypatch.setattr(fal_api, 'multipart_complete', self.complete)
+
+    def create(self, settings, content_type, file_name=None):
+        upload_id = f"upload-{len(self.created)}"
+        self.created.append(upload_id)
+        return f"https://cdn.example/{upload_id}", upload_id
+
+    def part(self, settings, access_url, upload_id, number, data, content_type):
+        return f"etag-{number}"
+
+    def complete(self, settings, access_url, upload_id, etags):
+        if self.complete_failures:
+            try:
+                raise _status_error(self.complete_failures.pop(0))
+            except httpx.HTTPStatusError as e:
+                # As fal_api._raise_for_status does
+                raise RuntimeError(f"fal.ai request failed ({e.response.status_code})") from e
+        return access_url
+
+
+def test_expired_upload_restarts_when_complete_is_not_found(monkeypatch):
+    storage = FakeStorage(monkeypatch, complete_failures=[404])
+    url = uploads.upload(SETTINGS, uploads.Source(bytes(2 * PART)), 'image/png', key='k')
+    assert url == 'https://cdn.example/upload-1'
+    assert storage.created == ['upload-0', 'upload-1']
+
+
+def test_other_complete_errors_are_raised(monkeypatch):
+    storage = FakeStorage(monkeypatch, complete_failures=[500])
+    with pytest.raises(RuntimeError, match='500'):
+        uploads.upload(SETTINGS, uploads.Source(bytes(2 * PART)), 'image/png', key='k')
+    assert storage.created == ['upload-0']
@@ -0,0 +1,63 @@
+"""
+utils against the benchmark's GIMP stand-ins (scripts/bench_suite.py).
+
+The stand-in layer offers only methods of the real Gimp.Layer API, so calling
+anything GIMP 3 does not have fails here as it would in GIMP.
+"""
+
+import io
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import bench_suite  # noqa: E402
+
+# Gimp.Layer methods (with those of Gimp.Drawable and Gimp.Item) the stand-in may define
+GIMP_LAYER_METHODS = {
+    'get_width', 'get_height', 'has_alpha', 'get_offsets', 'set_offsets', 'get_buffer',
+    'get_image', 'get_name', 'set_name', 'get_parent', 'scale',
+}
+
+
+@pytest.fixture(scope='module')
+def utils():
+    saved = {name: sys.modules.pop(name, None) for name in ('gi', 'gi.repository', 'utils')}
+    bench_suite.install_gi_stubs()
+    import utils
+    yield utils
+    for name, module in saved.items():
+        sys.modules.pop(name, None)
+        if module is not None:
+            sys.modules[name] = module
+
+
+def _layer(size=64):
+    return bench_suite.FakeLayer(bench_suite.FakeImage(), pixels=bench_suite.make_pixels(size))
+
+
+def test_stand_in_only_has_real_layer_methods():
+    methods = {name for name in vars(bench_suite.FakeLayer) if not name.startswith('_')}
+    assert methods <= GIMP_LAYER_METHODS
+
+
+def test_prepare_input_reads_and_encodes_the_region(utils):
+    settings = {'upload_format': 'png', 'upload_cache_ttl_hours': 0}
+    image_url, (data, content_type), key = utils.prepare_input(
+        _layer(), settings, (8, 4, 32, 16), 0.5)
+    assert image_url is None and key
+    assert content_type == 'image/png'
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (16, 8)
+
+
+def test_encode_drawable_without_prepared_pixels(utils):
+    data, content_type, region = utils.encode_drawable(_layer(), {'upload_format': 'jpeg'})
+    assert content_type == 'image/jpeg'
+    assert region == (0, 0, 64, 64)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.size == (64, 64)